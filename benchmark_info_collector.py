@@ -0,0 +1,310 @@
+"""
+TripInfoCollector 效能基準測試
+
+以詞彙表合成大量繁體中文旅遊需求，量測規則路徑的吞吐量與延遲分位數，
+並與 JSON 基準比較，退步超過門檻時以非零退出碼結束。
+每次執行同時量測一段固定的參考迴圈，比較時依參考迴圈的耗時換算機器速度差異，
+基準因此可以在不同機器或負載下重複使用
+
+執行方式：
+1. 執行並與基準比較：python benchmark_info_collector.py
+2. 更新基準：python benchmark_info_collector.py --save-baseline
+3. 調整語料大小／門檻：python benchmark_info_collector.py --size 20000 --threshold 0.3
+"""
+
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from utils.info_collector import TripInfoCollector
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+# === 合成語料 ===
+CHINESE_NUMBERS = ["一", "兩", "三", "四", "五", "六", "七", "八", "九", "十"]
+
+OPENINGS = ["我想去", "想去", "打算去", "計畫去", "這次要去", "下個月想到", "我們想去", "請幫我規劃"]
+DURATION_FORMS = ["玩{n}天", "{n}天", "待{n}天", "{cn}天{cn_night}夜", "玩個{cn}天", "{n}日遊"]
+PEOPLE_FORMS = ["{n}個人", "{cn}個人", "一共{n}人", "{n}位"]
+BUDGET_FORMS = ["預算{n}元", "預算{k}萬", "大概{n}塊", "預算{cn}萬"]
+VAGUE_PLACES = ["南部", "東部", "海邊", "山上", "離島", "北部"]
+VAGUE_DURATIONS = ["走走", "幾天", "放個假", "週末", "一週"]
+
+
+def _chinese(n):
+    return CHINESE_NUMBERS[n - 1] if 1 <= n <= 10 else str(n)
+
+
+def generate_corpus(size, seed=42):
+    """
+    合成旅遊需求語料
+
+    約 70% 訊息同時包含城市與天數，其餘只有其中之一或都是模糊說法，
+    讓規則解析率有意義
+
+    Returns:
+        list[str]: 訊息列表
+    """
+    rng = random.Random(seed)
+    collector = TripInfoCollector
+    trip_keywords = [word for words in collector.TRIP_TYPE_KEYWORDS.values() for word in words]
+    preference_keywords = [word for words in collector.PREFERENCE_KEYWORDS.values() for word in words]
+    need_keywords = [word for words in collector.SPECIAL_NEEDS_KEYWORDS.values() for word in words]
+
+    messages = []
+    for _ in range(size):
+        parts = []
+        roll = rng.random()
+
+        if roll < 0.85:
+            parts.append(rng.choice(OPENINGS) + rng.choice(collector.CITIES))
+        else:
+            parts.append(rng.choice(OPENINGS) + rng.choice(VAGUE_PLACES))
+
+        if roll < 0.7 or roll >= 0.85:
+            days = rng.randint(1, 7)
+            parts.append(rng.choice(DURATION_FORMS).format(
+                n=days, cn=_chinese(days), cn_night=_chinese(max(days - 1, 1))
+            ))
+        else:
+            parts.append(rng.choice(VAGUE_DURATIONS))
+
+        if rng.random() < 0.5:
+            parts.append("和" + rng.choice(trip_keywords))
+
+        if rng.random() < 0.4:
+            people = rng.randint(1, 10)
+            parts.append(rng.choice(PEOPLE_FORMS).format(n=people, cn=_chinese(people)))
+
+        if rng.random() < 0.4:
+            thousands = rng.randint(3, 50)
+            parts.append(rng.choice(BUDGET_FORMS).format(
+                n=thousands * 1000, k=thousands / 10, cn=_chinese(min(thousands // 10, 10) or 1)
+            ))
+
+        for keyword in rng.sample(preference_keywords, rng.randint(0, 2)):
+            parts.append("喜歡" + keyword)
+
+        if rng.random() < 0.1:
+            parts.append(rng.choice(need_keywords))
+
+        messages.append(rng.choice(["，", " ", ""]).join(parts))
+
+    return messages
+
+
+# === 量測 ===
+def _percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _summarize(durations_ns):
+    """延遲（微秒）分位數與吞吐量（次／秒）"""
+    ordered = sorted(durations_ns)
+    total_seconds = sum(ordered) / 1e9
+    return {
+        "count": len(ordered),
+        "throughput": len(ordered) / total_seconds if total_seconds else 0.0,
+        "p50_us": _percentile(ordered, 0.50) / 1000,
+        "p95_us": _percentile(ordered, 0.95) / 1000,
+        "p99_us": _percentile(ordered, 0.99) / 1000
+    }
+
+
+def _reference_loop(messages, rounds=3):
+    """
+    與被測函式性質相近、但不依賴專案程式碼的固定工作量（逐字計數與字串搜尋）
+
+    Returns:
+        float: 每則訊息的耗時（微秒，取多輪中最快的一輪以降低雜訊）
+    """
+    clock = time.perf_counter_ns
+    samples = []
+    for _ in range(rounds):
+        start = clock()
+        for message in messages:
+            counts = {}
+            for char in message:
+                counts[char] = counts.get(char, 0) + 1
+            message.find("天")
+        samples.append((clock() - start) / len(messages))
+    return min(samples) / 1000 if samples and messages else 0.0
+
+
+def run_benchmark(messages):
+    """
+    量測 _rule_extract、merge_info、is_info_complete 與規則解析率
+
+    量測期間停用 GC（與 timeit 相同），避免回收時機造成的尾端延遲雜訊
+
+    Returns:
+        dict: 各函式的統計、resolution_rate 與參考迴圈耗時 reference_us
+    """
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _run_benchmark(messages)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def _run_benchmark(messages):
+    clock = time.perf_counter_ns
+    reference_us = _reference_loop(messages)
+
+    extract_ns = []
+    extracted = []
+    for message in messages:
+        start = clock()
+        result = TripInfoCollector._rule_extract(message)
+        extract_ns.append(clock() - start)
+        extracted.append(result)
+
+    # 模擬多輪對話：每則訊息合併進前一則的結果
+    merge_ns = []
+    merged = []
+    previous = {}
+    for result in extracted:
+        start = clock()
+        current = TripInfoCollector.merge_info(previous, result)
+        merge_ns.append(clock() - start)
+        merged.append(current)
+        previous = current
+
+    complete_ns = []
+    resolved = 0
+    for result in extracted:
+        start = clock()
+        is_complete = TripInfoCollector.is_info_complete(result)
+        complete_ns.append(clock() - start)
+        resolved += is_complete
+
+    return {
+        "corpus_size": len(messages),
+        "resolution_rate": resolved / len(messages) if messages else 0.0,
+        "reference_us": reference_us,
+        "rule_extract": _summarize(extract_ns),
+        "merge_info": _summarize(merge_ns),
+        "is_info_complete": _summarize(complete_ns)
+    }
+
+
+# === 基準比較 ===
+def compare(results, baseline, threshold):
+    """
+    與基準比較
+
+    兩邊都有參考迴圈耗時時，先依其比例換算基準（本次機器慢一倍，容許的延遲也加倍），
+    只有相對於參考迴圈變慢才算退步；舊基準沒有參考迴圈時直接比較絕對值。
+    p95／p99 只有幾微秒，容易受排程與計時精度影響，使用兩倍門檻
+
+    Args:
+        threshold: 容許的相對退步比例（0.2 表示 p50 延遲增加或吞吐量下降超過 20% 即失敗）
+
+    Returns:
+        list[str]: 退步項目說明（空列表表示通過）
+    """
+    regressions = []
+    scale = 1.0
+    if results.get("reference_us") and baseline.get("reference_us"):
+        scale = results["reference_us"] / baseline["reference_us"]
+
+    for name in ("rule_extract", "merge_info", "is_info_complete"):
+        current = results.get(name)
+        reference = baseline.get(name)
+        if not current or not reference:
+            continue
+
+        for metric, tolerance in (("p50_us", threshold), ("p95_us", threshold * 2), ("p99_us", threshold * 2)):
+            expected = reference[metric] * scale
+            if expected and current[metric] > expected * (1 + tolerance):
+                regressions.append(
+                    f"{name}.{metric}: {expected:.2f} → {current[metric]:.2f}"
+                )
+
+        expected = reference["throughput"] / scale
+        if expected and current["throughput"] < expected * (1 - threshold):
+            regressions.append(
+                f"{name}.throughput: {expected:,.0f} → {current['throughput']:,.0f}"
+            )
+
+    # 解析率是正確性指標，不套用時間門檻（容許 0.1 個百分點的浮動）
+    if "resolution_rate" in baseline and results["resolution_rate"] < baseline["resolution_rate"] - 0.001:
+        regressions.append(
+            f"resolution_rate: {baseline['resolution_rate']:.2%} → {results['resolution_rate']:.2%}"
+        )
+
+    return regressions
+
+
+def print_results(results):
+    print(f"\n📊 語料 {results['corpus_size']:,} 則，規則解析率 {results['resolution_rate']:.2%}")
+    print(f"參考迴圈 {results['reference_us']:.2f} µs／則")
+    print(f"{'函式':<20}{'吞吐量/s':>14}{'p50 µs':>10}{'p95 µs':>10}{'p99 µs':>10}")
+    for name in ("rule_extract", "merge_info", "is_info_complete"):
+        stats = results[name]
+        print(
+            f"{name:<20}{stats['throughput']:>14,.0f}"
+            f"{stats['p50_us']:>10.2f}{stats['p95_us']:>10.2f}{stats['p99_us']:>10.2f}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TripInfoCollector 效能基準測試")
+    parser.add_argument("--size", type=int, default=100_000, help="合成語料筆數")
+    parser.add_argument("--seed", type=int, default=42, help="語料亂數種子")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基準 JSON 路徑")
+    parser.add_argument("--threshold", type=float, default=0.2, help="容許的相對退步比例")
+    parser.add_argument("--save-baseline", action="store_true", help="將本次結果寫入基準")
+    args = parser.parse_args(argv)
+
+    print(f"🧪 合成 {args.size:,} 則旅遊需求...")
+    messages = generate_corpus(args.size, args.seed)
+
+    # 暖機（讓惰性初始化與快取不影響量測）
+    run_benchmark(messages[:1000])
+    results = run_benchmark(messages)
+    results["seed"] = args.seed
+    print_results(results)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 已寫入基準：{args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\n⚠️ 找不到基準 {args.baseline}，請先執行 --save-baseline")
+        return 0
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    if (baseline.get("corpus_size"), baseline.get("seed")) != (results["corpus_size"], args.seed):
+        print("\n⚠️ 語料大小或種子與基準不同，比較結果僅供參考")
+    if baseline.get("reference_us"):
+        print(f"\n⚖️ 機器速度換算：本次參考迴圈為基準的 {results['reference_us'] / baseline['reference_us']:.2f} 倍")
+    else:
+        print("\n⚠️ 基準沒有參考迴圈耗時，直接比較絕對值（請以 --save-baseline 更新）")
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n❌ 效能退步超過 {args.threshold:.0%}：")
+        for line in regressions:
+            print(f"  • {line}")
+        return 1
+
+    print(f"\n✅ 與基準相比無退步（門檻 {args.threshold:.0%}）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -51,10 +51,16 @@ st.markdown("""
 # === 初始化 AI Client ===
 @st.cache_resource
 def init_gemini_client():
-    """初始化 Gemini 用於問答"""
+    """初始化 Gemini 用於問答（與行程規劃共用同一份配額排程）"""
+    from utils.quota_scheduler import ScheduledModel, shared_scheduler
+    
+    if os.getenv("LLM_STAND_IN"):
+        from utils.stand_in_llm import FakeGeminiModel
+        return ScheduledModel(FakeGeminiModel(), shared_scheduler())
+    
     api_key = os.getenv("GEMINI_API_KEY")
     genai.configure(api_key=api_key)
-    return genai.GenerativeModel("gemini-2.0-flash-exp")
+    return ScheduledModel(genai.GenerativeModel("gemini-2.0-flash-exp"), shared_scheduler())
 
 gemini_client = init_gemini_client()
 
@@ -175,6 +181,8 @@ if len(st.session_state.qa_messages) == 0:
 # === AI 回答函數 ===
 def get_ai_answer(question):
     """使用 Gemini AI 生成回答"""
+    from utils.quota_scheduler import QuotaExceeded
+    
     try:
         # 構建 prompt
         system_prompt = """你是一位專業的台灣旅遊顧問，精通台灣各地的景點、美食、交通、住宿等旅遊資訊。
@@ -206,8 +214,13 @@ def get_ai_answer(question):
         # 組合完整 prompt
         full_prompt = f"{system_prompt}\n{knowledge_context}\n\n用戶問題：{question}"
         
-        # 呼叫 Gemini
-        response = gemini_client.generate_content(full_prompt)
+        # 呼叫 Gemini（配額不足時直接以知識庫內容回答）
+        try:
+            response = gemini_client.generate_content(full_prompt)
+        except QuotaExceeded as e:
+            if knowledge_context:
+                return f"⏳ AI 目前忙碌中（{e}），先提供知識庫中的相關資訊：\n{knowledge_context}"
+            raise
         answer = response.text.strip()
         return answer
         
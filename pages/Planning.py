@@ -1,5 +1,5 @@
 import streamlit as st
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 import google.generativeai as genai
 import json
 from datetime import datetime, timedelta
@@ -75,16 +75,36 @@ def init_vllm_client():
         api_key=get_env("VLLM_API_KEY")
     )
 
+@st.cache_resource
+def init_vllm_async_client():
+    """資訊收集與追問用的 AsyncOpenAI（由 TripInfoCollector 的常駐事件迴圈執行，不佔用同步執行緒池）"""
+    return AsyncOpenAI(
+        base_url=get_env("VLLM_BASE_URL"),
+        api_key=get_env("VLLM_API_KEY")
+    )
+
 @st.cache_resource
 def init_gemini_client():
-    """初始化 Gemini（用於行程生成）"""
+    """初始化 Gemini（用於行程生成；所有呼叫先經過程序內共用的配額排程）"""
+    from utils.quota_scheduler import ScheduledModel, shared_scheduler
+    
+    if get_env("LLM_STAND_IN"):
+        from utils.stand_in_llm import FakeGeminiModel
+        return ScheduledModel(FakeGeminiModel(), shared_scheduler())
+    
     api_key = get_env("GEMINI_API_KEY")
     genai.configure(api_key=api_key)
-    return genai.GenerativeModel(MODEL_CONFIG["gemini"])
+    return ScheduledModel(genai.GenerativeModel(MODEL_CONFIG["gemini"]), shared_scheduler())
 
 vllm_client = init_vllm_client()
+vllm_async_client = init_vllm_async_client()
 gemini_client = init_gemini_client()
 
+# 精簡輸出格式（活動以位置元組表示，減少行程生成的輸出 token）
+if get_env("ITINERARY_COMPACT"):
+    from utils.itinerary_generator import ItineraryGenerator
+    ItineraryGenerator.compact_output = True
+
 # === 載入知識庫 ===
 @st.cache_resource
 def load_knowledge_base():
@@ -96,6 +116,100 @@ def load_knowledge_base():
 
 knowledge_base = load_knowledge_base()
 
+# === LLM 提取快取（SQLite 磁碟層，重啟後保留）===
+@st.cache_resource
+def init_extraction_cache():
+    try:
+        from utils.info_collector import TripInfoCollector
+        from utils.result_cache import ResultCache
+        cache = ResultCache(
+            max_size=1024,
+            ttl=7 * 24 * 3600,
+            db_path="user_data/extraction_cache.db",
+            table="llm_extract"
+        )
+        TripInfoCollector.llm_cache = cache
+        return cache
+    except:
+        return None
+
+extraction_cache = init_extraction_cache()
+
+# === 追問庫（SQLite 磁碟層，背景預熱常見情境）===
+@st.cache_resource
+def init_follow_up_cache():
+    try:
+        import threading
+        from utils.info_collector import TripInfoCollector
+        from utils.result_cache import ResultCache
+        cache = ResultCache(
+            max_size=512,
+            ttl=30 * 24 * 3600,
+            db_path="user_data/extraction_cache.db",
+            table="follow_up"
+        )
+        TripInfoCollector.follow_up_cache = cache
+        
+        threading.Thread(
+            target=TripInfoCollector.warm_follow_up_questions,
+            args=(vllm_async_client,),
+            daemon=True
+        ).start()
+        return cache
+    except:
+        return None
+
+follow_up_cache = init_follow_up_cache()
+
+# === 行程結果快取（SQLite 磁碟層，相同需求不重複消耗 Gemini 配額）===
+@st.cache_resource
+def init_itinerary_cache():
+    try:
+        from utils.itinerary_generator import ItineraryGenerator
+        from utils.result_cache import ResultCache
+        cache = ResultCache(
+            max_size=128,
+            ttl=3 * 24 * 3600,
+            db_path="user_data/itinerary_cache.db",
+            table="itinerary"
+        )
+        ItineraryGenerator.result_cache = cache
+        return cache
+    except:
+        return None
+
+itinerary_cache = init_itinerary_cache()
+
+# === 語意行程快取（FAISS 索引，相似需求改寫既有行程）===
+@st.cache_resource
+def init_semantic_cache():
+    try:
+        from utils.itinerary_generator import ItineraryGenerator
+        from utils.semantic_cache import SemanticItineraryCache
+        cache = SemanticItineraryCache(index_path="user_data/itinerary_index.faiss")
+        if not cache.available:
+            return None
+        ItineraryGenerator.semantic_cache = cache
+        return cache
+    except:
+        return None
+
+semantic_cache = init_semantic_cache()
+
+# === 解析失敗語料（背景寫入壓縮分段，可用 replay_failure_corpus.py 重播）===
+@st.cache_resource
+def init_failure_corpus():
+    try:
+        from utils.failure_corpus import FailureCorpus
+        from utils.itinerary_generator import ItineraryGenerator
+        corpus = FailureCorpus("user_data/failure_corpus")
+        ItineraryGenerator.failure_corpus = corpus
+        return corpus
+    except:
+        return None
+
+failure_corpus = init_failure_corpus()
+
 # === Session State 初始化 ===
 if "messages" not in st.session_state:
     st.session_state.messages = []
@@ -109,6 +223,34 @@ if "collected_trip_info" not in st.session_state:
 if "waiting_for_dates" not in st.session_state:
     st.session_state.waiting_for_dates = False
 
+# 分日並行生成（骨架加每天一次請求，會多用 Gemini 配額，預設關閉；ITINERARY_PARALLEL=1 開啟）
+# 開啟後天數較多時改用並行生成（vLLM 熔斷器未開啟時一起分擔每日生成）
+PARALLEL_ENABLED = str(get_env("ITINERARY_PARALLEL", "0")).strip().lower() in ("1", "true", "yes", "on")
+PARALLEL_MIN_DAYS = 4
+
+def stream_itinerary(client, location, duration, budget=None, preferences=None):
+    from utils.info_collector import TripInfoCollector
+    from utils.itinerary_generator import ItineraryGenerator
+    
+    extra_clients = []
+    if vllm_client is not None and TripInfoCollector.llm_breaker.state != TripInfoCollector.llm_breaker.OPEN:
+        extra_clients.append(vllm_client)
+    
+    if not PARALLEL_ENABLED or duration < PARALLEL_MIN_DAYS:
+        # 單一請求：主要後端超過 p90 延遲仍未完成才同時送 vLLM，先成功者勝出
+        return ItineraryGenerator.stream_itinerary_hedged(
+            client, location, duration, budget, preferences,
+            secondary=extra_clients[0] if extra_clients else None
+        )
+    
+    return ItineraryGenerator.stream_itinerary_parallel(
+        client, location, duration, budget, preferences, extra_clients=extra_clients
+    )
+
+if "speculative_itinerary" not in st.session_state:
+    from utils.speculative_generator import SpeculativeItinerary
+    st.session_state.speculative_itinerary = SpeculativeItinerary(stream=stream_itinerary)
+
 # === 主標題 ===
 st.title("💬 行程規劃")
 st.caption("告訴我您的旅遊需求，讓 AI 為您規劃完美行程")
@@ -131,12 +273,14 @@ with st.sidebar:
     except Exception as e:
         st.error("❌ vLLM 連接失敗")
     
-    try:
-        gemini_test = gemini_client.generate_content("test")
+    # Gemini 狀態取自配額排程器（不再每次重新整理都送測試請求消耗配額）
+    quota_stats = gemini_client.scheduler.stats()
+    if quota_stats["remaining_requests"] and not quota_stats["blocked_for"]:
         st.success("✅ Gemini 已就緒")
-        st.caption("負責行程生成")
-    except Exception as e:
-        st.warning("⚠️ Gemini 配額已滿或無法連線")
+        st.caption(f"負責行程生成（今日剩餘 {quota_stats['remaining_requests']} 次請求，"
+                   f"本分鐘可用 {quota_stats['minute_requests_available']} 次）")
+    else:
+        st.warning("⚠️ Gemini 配額已滿")
         st.info("💡 將使用精選模板生成行程\n（模板來自 data/trip_templates.json）")
     
     st.divider()
@@ -150,6 +294,49 @@ with st.sidebar:
     
     st.divider()
     
+    # LLM 提取快取
+    if extraction_cache is not None:
+        st.subheader("⚡ 提取快取")
+        cache_stats = extraction_cache.stats()
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric("命中", cache_stats["hits"])
+        with col2:
+            st.metric("未命中", cache_stats["misses"])
+        st.caption(f"已省下 {cache_stats['hits']} 次 LLM 呼叫（命中率 {cache_stats['hit_rate']:.0%}）")
+
+        st.divider()
+
+    # 行程結果快取
+    if itinerary_cache is not None:
+        st.subheader("🗄️ 行程快取")
+        itinerary_stats = itinerary_cache.stats()
+        st.caption(f"已省下 {itinerary_stats['hits']} 次行程生成（命中率 {itinerary_stats['hit_rate']:.0%}）")
+        if semantic_cache is not None:
+            semantic_stats = semantic_cache.stats()
+            st.caption(f"語意快取：{semantic_stats['size']} 筆行程，相似命中 {semantic_stats['hits']} 次")
+
+        st.divider()
+
+    # vLLM 斷路器
+    try:
+        from utils.info_collector import TripInfoCollector
+        breaker_stats = TripInfoCollector.llm_breaker.stats()
+
+        st.subheader("🔌 vLLM 斷路器")
+        if breaker_stats["state"] == "open":
+            st.error(f"⛔ 已開啟：{breaker_stats['cooldown_remaining']:.0f} 秒後探測")
+            st.caption("vLLM 連續失敗，暫時只使用規則提取")
+        elif breaker_stats["state"] == "half_open":
+            st.warning("🟡 半開：下一次請求將探測 vLLM")
+        else:
+            st.success("✅ 關閉：正常呼叫 vLLM")
+        st.caption(f"開啟 {breaker_stats['trips']} 次，已跳過 {breaker_stats['rejected']} 次 LLM 呼叫")
+
+        st.divider()
+    except Exception:
+        pass
+
     # 統計資訊
     st.subheader("📊 規劃統計")
     col1, col2 = st.columns(2)
@@ -165,6 +352,7 @@ with st.sidebar:
         st.session_state.messages = []
         st.session_state.collected_trip_info = {}
         st.session_state.waiting_for_dates = False
+        st.session_state.speculative_itinerary.cancel()
         st.rerun()
     
     if st.button("🗺️ 查看我的行程", use_container_width=True, type="primary"):
@@ -179,6 +367,47 @@ except ImportError as e:
     st.info("請確保 utils/ 目錄存在且包含必要文件")
     st.stop()
 
+def itinerary_args(info):
+    """行程生成參數（推測式生成與實際生成共用，確保簽章一致）"""
+    return {
+        "location": info.get('location', '台灣'),
+        "duration": info.get('duration', 3),
+        "budget": info.get('budget'),
+        "preferences": info.get('preferences')
+    }
+
+def start_speculative_generation(info):
+    """地點和天數都已知時，在背景先開始生成行程"""
+    if info.get("location") and info.get("duration"):
+        st.session_state.speculative_itinerary.start(gemini_client, **itinerary_args(info))
+
+def generate_with_preview(info, status_text, progress_bar):
+    """
+    生成行程，每完成一天就先顯示（接續推測式生成的進度，或直接串流生成）
+    
+    Returns:
+        dict: 與 ItineraryGenerator.generate_itinerary 相同格式
+    """
+    args = itinerary_args(info)
+    preview = st.empty()
+    shown = {}
+    
+    for event, payload in st.session_state.speculative_itinerary.events(gemini_client, **args):
+        if event == "done":
+            preview.empty()
+            return payload
+        
+        # 並行生成時各天完成順序不一定，依天數排序顯示
+        day = payload.get('day', len(shown) + 1)
+        lines = [f"**Day {day}** - {payload.get('theme', '')}"]
+        for activity in payload.get('activities', []):
+            lines.append(f"• {activity.get('icon', '📍')} {activity.get('time', '')} {activity.get('name', '')}")
+        shown[day] = "\n".join(lines)
+        
+        preview.markdown("\n\n".join(shown[key] for key in sorted(shown)))
+        status_text.text(f"🗺️ 已完成第 {len(shown)} 天，繼續規劃...")
+        progress_bar.progress(min(95, 50 + int(45 * len(shown) / max(args["duration"], 1))))
+
 # === 顯示歷史訊息 ===
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
@@ -232,6 +461,7 @@ if st.session_state.waiting_for_dates:
             st.session_state.collected_trip_info["date"] = start_date.strftime("%Y-%m-%d")
             st.session_state.collected_trip_info["duration"] = duration
             st.session_state.waiting_for_dates = False
+            start_speculative_generation(st.session_state.collected_trip_info)
             
             # 新增訊息記錄
             date_msg = f"我選擇 {start_date.strftime('%Y年%m月%d日')} 到 {end_date.strftime('%Y年%m月%d日')}（共 {duration} 天）"
@@ -259,45 +489,30 @@ if st.session_state.get('trigger_generation', False):
         
         # === 直接生成行程 ===
         with st.spinner("🤖 AI 正在為您精心規劃..."):
-            import time
-            
             progress_bar = st.progress(0)
             status_text = st.empty()
             
-            status_text.text("🔍 分析目的地特色...")
-            progress_bar.progress(20)
-            time.sleep(0.3)
-            
             status_text.text("🗺️ 規劃景點路線...")
             progress_bar.progress(50)
-            time.sleep(0.3)
-            
-            status_text.text("🍜 搜尋美食推薦...")
-            progress_bar.progress(75)
-            time.sleep(0.3)
-            
-            status_text.text("✨ 最後優化...")
-            progress_bar.progress(90)
             
-            # 實際生成
-            result = ItineraryGenerator.generate_itinerary(
-                client=gemini_client,
-                location=info.get('location', '台灣'),
-                duration=info.get('duration', 3),
-                budget=info.get('budget'),
-                preferences=info.get('preferences')
-            )
+            # 實際生成（參數未改變時接續推測式生成，每完成一天就先顯示）
+            result = generate_with_preview(info, status_text, progress_bar)
             
             if result["success"]:
                 itinerary_data = result["data"]
-                generation_method = "✨ AI 智能生成"
+                cache_info = result.get("cache", {})
+                if cache_info.get("semantic"):
+                    generation_method = "🧭 改寫相似行程"
+                elif cache_info.get("hit"):
+                    generation_method = "⚡ 使用快取行程"
+                else:
+                    generation_method = "✨ AI 智能生成"
             else:
                 itinerary_data = result["fallback"]
                 generation_method = "📋 使用高品質模板"
             
             status_text.text("✅ 完成！")
             progress_bar.progress(100)
-            time.sleep(0.5)
             
             # 清除進度條
             progress_bar.empty()
@@ -359,13 +574,19 @@ if prompt := st.chat_input("輸入你的需求... 例如：我想去台中玩",
     with st.chat_message("user"):
         st.markdown(prompt)
     
+    # === 推測式生成：規則已能得到地點和天數時，立即在背景開始生成行程 ===
+    start_speculative_generation(TripInfoCollector.merge_info(
+        st.session_state.collected_trip_info,
+        TripInfoCollector._rule_extract(prompt)
+    ))
+    
     # === 處理回應 ===
     with st.chat_message("assistant"):
         # ✅ 使用混合提取（規則優先 + LLM 輔助）
         try:
             extracted = TripInfoCollector.extract_info_from_message(
                 prompt,
-                vllm_client=vllm_client  # 傳入 vLLM client
+                vllm_client=vllm_async_client  # 傳入 vLLM client
             )
             
             # 合併提取到的資訊
@@ -391,6 +612,9 @@ if prompt := st.chat_input("輸入你的需求... 例如：我想去台中玩",
                 extracted
             )
         
+        # LLM 補上或修正了地點／天數時，以最新資訊重新推測
+        start_speculative_generation(st.session_state.collected_trip_info)
+        
         # 顯示已收集資訊
         if st.session_state.collected_trip_info:
             st.success("✅ 已收集資訊")
@@ -411,45 +635,30 @@ if prompt := st.chat_input("輸入你的需求... 例如：我想去台中玩",
             
             # === 直接生成行程 ===
             with st.spinner("🤖 AI 正在為您精心規劃..."):
-                import time
-                
                 progress_bar = st.progress(0)
                 status_text = st.empty()
                 
-                status_text.text("🔍 分析目的地特色...")
-                progress_bar.progress(20)
-                time.sleep(0.3)
-                
                 status_text.text("🗺️ 規劃景點路線...")
                 progress_bar.progress(50)
-                time.sleep(0.3)
-                
-                status_text.text("🍜 搜尋美食推薦...")
-                progress_bar.progress(75)
-                time.sleep(0.3)
                 
-                status_text.text("✨ 最後優化...")
-                progress_bar.progress(90)
-                
-                # 實際生成
-                result = ItineraryGenerator.generate_itinerary(
-                    client=gemini_client,
-                    location=info.get('location', '台灣'),
-                    duration=info.get('duration', 3),
-                    budget=info.get('budget'),
-                    preferences=info.get('preferences')
-                )
+                # 實際生成（參數未改變時接續推測式生成，每完成一天就先顯示）
+                result = generate_with_preview(info, status_text, progress_bar)
                 
                 if result["success"]:
                     itinerary_data = result["data"]
-                    generation_method = "✨ AI 智能生成"
+                    cache_info = result.get("cache", {})
+                    if cache_info.get("semantic"):
+                        generation_method = "🧭 改寫相似行程"
+                    elif cache_info.get("hit"):
+                        generation_method = "⚡ 使用快取行程"
+                    else:
+                        generation_method = "✨ AI 智能生成"
                 else:
                     itinerary_data = result["fallback"]
                     generation_method = "📋 使用高品質模板"
                 
                 status_text.text("✅ 完成！")
                 progress_bar.progress(100)
-                time.sleep(0.5)
                 
                 # 清除進度條
                 progress_bar.empty()
@@ -516,7 +725,7 @@ if prompt := st.chat_input("輸入你的需求... 例如：我想去台中玩",
             response_text = TripInfoCollector.generate_follow_up_question(
                 missing_fields,
                 st.session_state.collected_trip_info,
-                client=vllm_client  # 傳入 client 讓追問更自然
+                client=vllm_async_client  # 傳入 client 讓追問更自然
                 # client=None  # 或不傳，使用規則追問
             )
             
@@ -0,0 +1,141 @@
+"""
+失敗語料重播
+
+以目前的修復引擎（ItineraryGenerator._parse_content）重新解析失敗語料中的
+真實回應，回報救回率（解析並驗證成功）、完整率（每一天都救回）與解析時間，
+修改 utils/json_repair.py 前後各跑一次即可比較
+
+執行方式：
+1. 重播並顯示結果：python replay_failure_corpus.py
+2. 儲存為比較基準：python replay_failure_corpus.py --save-report replay_baseline.json
+3. 與基準比較（救回率下降時以非零退出碼結束）：python replay_failure_corpus.py --baseline replay_baseline.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from utils.failure_corpus import FailureCorpus
+from utils.itinerary_generator import ItineraryGenerator
+
+DEFAULT_CORPUS = "user_data/failure_corpus"
+
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def replay(records):
+    """
+    重新解析每一筆失敗回應
+
+    Returns:
+        dict: 筆數、救回率、完整率、解析時間（毫秒）分位數與仍失敗的原因統計
+    """
+    durations_ns = []
+    recovered = 0
+    complete = 0
+    reasons = Counter()
+
+    for record in records:
+        content = record.get("content") or ""
+        start = time.perf_counter_ns()
+        try:
+            # 修復引擎會印出修復報告，重播時不需要
+            with contextlib.redirect_stdout(io.StringIO()):
+                itinerary = ItineraryGenerator._parse_content(content)
+        except Exception as e:
+            durations_ns.append(time.perf_counter_ns() - start)
+            reasons[f"{type(e).__name__}: {str(e)[:40]}"] += 1
+            continue
+        durations_ns.append(time.perf_counter_ns() - start)
+
+        recovered += 1
+        expected = record.get("duration") or itinerary.get("duration") or 0
+        if len(itinerary["daily_itinerary"]) >= expected:
+            complete += 1
+
+    ordered = sorted(durations_ns)
+    count = len(ordered)
+    return {
+        "corpus_size": count,
+        "recovery_rate": recovered / count if count else 0.0,
+        "complete_rate": complete / count if count else 0.0,
+        "parse_ms": {
+            "p50": _percentile(ordered, 0.50) / 1e6,
+            "p95": _percentile(ordered, 0.95) / 1e6,
+            "max": (ordered[-1] / 1e6) if ordered else 0.0,
+            "total": sum(ordered) / 1e6
+        },
+        "failures": dict(reasons.most_common(10))
+    }
+
+
+def print_results(results):
+    parse = results["parse_ms"]
+    print(f"\n📊 失敗語料 {results['corpus_size']:,} 筆")
+    print(f"  救回率 {results['recovery_rate']:.2%}，完整率 {results['complete_rate']:.2%}")
+    print(f"  解析時間 p50 {parse['p50']:.3f} ms、p95 {parse['p95']:.3f} ms、最大 {parse['max']:.3f} ms")
+    if results["failures"]:
+        print("  仍無法救回：")
+        for reason, count in results["failures"].items():
+            print(f"    • {reason}（{count} 筆）")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="以修復引擎重播失敗語料")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="失敗語料目錄")
+    parser.add_argument("--limit", type=int, default=None, help="最多重播幾筆（預設全部）")
+    parser.add_argument("--save-report", help="將本次結果寫入 JSON")
+    parser.add_argument("--baseline", help="與先前儲存的結果比較")
+    args = parser.parse_args(argv)
+
+    corpus = FailureCorpus(args.corpus)
+    records = list(corpus.records())[:args.limit]
+    if not records:
+        print(f"⚠️ {args.corpus} 沒有失敗語料")
+        return 0
+
+    print(f"🔁 重播 {len(records):,} 筆失敗回應（{len(corpus.segments())} 個分段）...")
+    results = replay(records)
+    print_results(results)
+
+    if args.save_report:
+        with open(args.save_report, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 已寫入：{args.save_report}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+        if baseline.get("corpus_size") != results["corpus_size"]:
+            print("\n⚠️ 語料筆數與基準不同，比較結果僅供參考")
+
+        # 救回率是正確性指標（容許 0.1 個百分點的浮動）
+        regressions = [
+            f"{name}: {baseline[name]:.2%} → {results[name]:.2%}"
+            for name in ("recovery_rate", "complete_rate")
+            if name in baseline and results[name] < baseline[name] - 0.001
+        ]
+        if regressions:
+            print("\n❌ 救回率下降：")
+            for line in regressions:
+                print(f"  • {line}")
+            return 1
+        print(f"\n✅ 救回率未下降（基準 p95 {baseline['parse_ms']['p95']:.3f} ms → 本次 {results['parse_ms']['p95']:.3f} ms）")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
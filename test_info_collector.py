@@ -5,12 +5,16 @@ TripInfoCollector 測試套件
 1. 基本測試：python test_info_collector.py
 2. 詳細測試：python test_info_collector.py --verbose
 3. 性能測試：python test_info_collector.py --performance
+4. 基準測試（10 萬則合成語料）：python benchmark_info_collector.py
 """
 
 import sys
 import os
+import json
 import time
+import threading
 from datetime import datetime
+from types import SimpleNamespace
 
 # 添加 utils 到路徑
 sys.path.append(os.path.join(os.path.dirname(__file__), 'utils'))
@@ -109,6 +113,70 @@ def assert_not_none(value, test_name):
         counter.add_fail(test_name, error)
         return False
 
+# === 假的 vLLM client ===
+class FakeVLLMClient:
+    """模擬 OpenAI 相容 client，依 prompt 內容回覆"""
+    
+    def __init__(self, replies, delay=0):
+        self.replies = replies
+        self.delay = delay
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0
+        self.last_kwargs = None
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+    
+    def create(self, **kwargs):
+        with self._lock:
+            self.calls += 1
+            self.last_kwargs = kwargs
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        
+        try:
+            time.sleep(self.delay)
+            prompt = kwargs["messages"][-1]["content"]
+            content = next(
+                (reply for keyword, reply in self.replies.items() if keyword in prompt),
+                "unknown"
+            )
+            if kwargs.get("stream"):
+                return self._stream(content)
+            message = SimpleNamespace(content=content)
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+        finally:
+            with self._lock:
+                self.active -= 1
+    
+    def _stream(self, content, size=2):
+        """模擬串流：每個 chunk 送出幾個字元，並記錄實際送出的 chunk 數"""
+        self.streamed = 0
+        for start in range(0, len(content), size):
+            self.streamed += 1
+            delta = SimpleNamespace(content=content[start:start + size])
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+class FakeAsyncVLLMClient(FakeVLLMClient):
+    """模擬 AsyncOpenAI client"""
+    
+    def __init__(self, replies, delay=0):
+        super().__init__(replies, delay)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.acreate))
+    
+    async def acreate(self, **kwargs):
+        import asyncio
+        await asyncio.sleep(self.delay)
+        response = FakeVLLMClient.create(self, **{**kwargs})
+        if not kwargs.get("stream"):
+            return response
+        
+        async def stream():
+            for chunk in response:
+                yield chunk
+        
+        return stream()
+
 # === 單元測試 ===
 def test_extract_location():
     """測試地點提取"""
@@ -139,9 +207,21 @@ def test_extract_duration():
     test_cases = [
         ("玩3天", 3),
         ("5天4夜", 5),
-        ("兩天一夜", None),  # 中文數字暫不支援
+        ("兩天一夜", 2),
+        ("三天兩夜", 3),
+        ("一週", 7),
+        ("週末去", 2),
+        ("玩個三四天", 3),
         ("預計玩7天", 7),
         ("10日遊", 10),
+        # 序數或相對時間不是行程長度
+        ("第一天想去九份", None),
+        ("第二天想去九份", None),
+        ("第十二天", None),
+        ("這兩天想去台南", None),
+        ("前兩天去過台北，這次想去花蓮", None),
+        ("頭兩天住市區", None),
+        ("前兩週去過", None),
     ]
     
     for message, expected_duration in test_cases:
@@ -151,6 +231,11 @@ def test_extract_duration():
             expected_duration, 
             f"提取天數：{message}"
         )
+    
+    # 多輪對話：之後提到「第二天」不覆蓋已知天數
+    info = TripInfoCollector._rule_extract("台北三天")
+    info = TripInfoCollector.merge_info(info, TripInfoCollector._rule_extract("第二天想去淡水"))
+    assert_equal(info.get("duration"), 3, "提取天數：序數不覆蓋已知天數")
 
 def test_extract_people():
     """測試人數提取"""
@@ -162,6 +247,7 @@ def test_extract_people():
         ("一個人", 1),
         ("兩人", 2),
         ("10人團體", 10),
+        ("十二人", 12),
     ]
     
     for message, expected_people in test_cases:
@@ -182,6 +268,8 @@ def test_extract_budget():
         ("2萬元", 20000),
         ("1.5萬", 15000),
         ("預算15000", 15000),
+        ("五千元", 5000),
+        ("一萬五", 15000),
     ]
     
     for message, expected_budget in test_cases:
@@ -260,6 +348,26 @@ def test_extract_special_needs():
             f"提取特殊需求：{message}"
         )
 
+def test_keyword_matcher():
+    """測試多關鍵字自動機"""
+    print("\n🔤 測試多關鍵字自動機")
+    
+    from utils.keyword_matcher import KeywordMatcher
+    
+    matcher = KeywordMatcher()
+    for keyword in ["he", "she", "his", "hers"]:
+        matcher.add(keyword, keyword.upper())
+    
+    matches = [(start, keyword) for start, keyword, _ in matcher.iter_matches("ushers")]
+    assert_equal(matches, [(1, "she"), (2, "he"), (2, "hers")], "自動機：重疊關鍵字")
+    
+    # 同一關鍵字同時屬於類型與特殊需求
+    result = TripInfoCollector._rule_extract("帶小孩去日月潭和台北")
+    other = result.get("other_requirements", {})
+    assert_equal(result.get("location"), "台北", "自動機：地點依城市清單順序")
+    assert_equal(other.get("trip_type"), "親子旅遊", "自動機：類型")
+    assert_in("有小孩同行", other.get("special_needs", []), "自動機：特殊需求")
+
 # === 整合測試 ===
 def test_complete_extraction():
     """測試完整提取"""
@@ -414,6 +522,1268 @@ def test_format_display():
     assert_in("情侶出遊", formatted, "格式化：包含類型")
     assert_in("美食", formatted, "格式化：包含偏好")
 
+def test_extract_info_batch():
+    """測試批次提取"""
+    print("\n📦 測試批次提取")
+    
+    client = FakeVLLMClient({
+        "知本溫泉": "Location: 台東\nDuration: unknown",
+        "南部看看": "Location: unknown\nDuration: 3",
+        "想去花蓮": "4",
+    }, delay=0.05)
+    
+    messages = ["我想去台北玩3天", "知本溫泉好像不錯", "想去南部看看", "想去花蓮", "台南2天"]
+    results = TripInfoCollector.extract_info_batch(messages, client, max_concurrency=2)
+    
+    assert_equal(len(results), len(messages), "批次：結果數量")
+    assert_equal(client.calls, 3, "批次：只有不完整的訊息呼叫 LLM")
+    assert_true(client.max_active <= 2, "批次：並行數受限")
+    assert_equal([r.get("location") for r in results], ["台北", "台東", None, "花蓮", "台南"], "批次：地點依輸入順序")
+    assert_equal([r.get("duration") for r in results], [3, None, 3, 4, 2], "批次：天數依輸入順序")
+
+def test_llm_cache():
+    """測試 LLM 提取快取"""
+    print("\n⚡ 測試 LLM 提取快取")
+    
+    import tempfile
+    from utils.result_cache import ResultCache
+    
+    # LRU 淘汰
+    cache = ResultCache(max_size=2, ttl=60)
+    cache.set("a", {"v": 1})
+    cache.set("b", {"v": 2})
+    cache.get("a")
+    cache.set("c", {"v": 3})
+    assert_equal(cache.get("b"), None, "快取：淘汰最久未使用")
+    assert_equal(cache.get("a"), {"v": 1}, "快取：保留最近使用")
+    
+    # TTL 過期
+    cache = ResultCache(max_size=2, ttl=0.05)
+    cache.set("a", {"v": 1})
+    time.sleep(0.1)
+    assert_equal(cache.get("a"), None, "快取：TTL 過期")
+    
+    # SQLite 磁碟層（模擬重啟）
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "cache.db")
+        ResultCache(db_path=db_path, table="llm_extract").set("k", {"location": "台東"})
+        
+        restarted = ResultCache(db_path=db_path, table="llm_extract")
+        assert_equal(restarted.get("k"), {"location": "台東"}, "快取：重啟後從磁碟讀取")
+        assert_equal(restarted.stats()["disk_hits"], 1, "快取：磁碟命中計數")
+        restarted._db.close()
+    
+    # 重複訊息只呼叫一次 LLM
+    original_cache = TripInfoCollector.llm_cache
+    TripInfoCollector.llm_cache = ResultCache(max_size=16, ttl=60)
+    try:
+        client = FakeVLLMClient({"知本溫泉": "Location: 台東\nDuration: unknown"})
+        first = TripInfoCollector.extract_info_from_message("知本溫泉好像不錯", client)
+        second = TripInfoCollector.extract_info_from_message("  知本溫泉好像不錯 ", client)
+        
+        assert_equal(client.calls, 1, "快取：相同訊息只呼叫一次 LLM")
+        assert_equal(second.get("location"), first.get("location"), "快取：命中結果一致")
+        
+        stats = TripInfoCollector.llm_cache.stats()
+        assert_equal((stats["hits"], stats["misses"]), (1, 1), "快取：命中／未命中計數")
+    finally:
+        TripInfoCollector.llm_cache = original_cache
+
+def test_async_extraction():
+    """測試非同步提取與逾時"""
+    print("\n⏳ 測試非同步提取與逾時")
+    
+    import asyncio
+    from utils.circuit_breaker import CircuitBreaker
+    from utils.result_cache import ResultCache
+    
+    original_cache = TripInfoCollector.llm_cache
+    original_breaker = TripInfoCollector.llm_breaker
+    original_follow_up = TripInfoCollector.follow_up_cache
+    TripInfoCollector.llm_cache = ResultCache(max_size=16, ttl=60)
+    TripInfoCollector.follow_up_cache = ResultCache(max_size=16, ttl=60)
+    TripInfoCollector.llm_breaker = CircuitBreaker()
+    try:
+        # AsyncOpenAI 風格的 client
+        client = FakeAsyncVLLMClient({"想去宜蘭": "2"})
+        result = asyncio.run(TripInfoCollector.aextract_info_from_message("想去宜蘭走走", client))
+        assert_equal(result.get("duration"), 2, "非同步：提取天數")
+        
+        question = asyncio.run(TripInfoCollector.agenerate_follow_up_question(
+            [("duration", "天數")], {"location": "宜蘭"}, FakeAsyncVLLMClient({"天數": "想在宜蘭待幾天呢？"})
+        ))
+        assert_equal(question, "想在宜蘭待幾天呢？", "非同步：LLM 追問")
+        
+        # 逾時時立即使用規則結果
+        slow_client = FakeVLLMClient({"想去新竹": "3"}, delay=0.5)
+        start_time = time.time()
+        result = TripInfoCollector.extract_info_from_message("想去新竹晃晃", slow_client, timeout=0.05)
+        elapsed = time.time() - start_time
+        assert_equal(result.get("duration"), None, "逾時：使用規則結果")
+        assert_true(elapsed < 0.4, "逾時：不等待完整回應")
+        assert_equal(slow_client.last_kwargs.get("timeout"), 0.05, "逾時：傳給 create 讓阻塞的呼叫結束")
+        
+        # 同步包裝共用常駐事件迴圈（同一個 AsyncOpenAI client 可跨呼叫重複使用）
+        from utils.info_collector import _run_sync
+        
+        async def current_loop():
+            return asyncio.get_running_loop()
+        
+        assert_true(_run_sync(current_loop()) is _run_sync(current_loop()), "同步包裝：共用事件迴圈")
+        client = FakeAsyncVLLMClient({"想去苗栗": "3", "想去雲林": "4"})
+        first = TripInfoCollector.extract_info_from_message("想去苗栗走走", client)
+        second = TripInfoCollector.extract_info_from_message("想去雲林走走", client)
+        assert_equal((first.get("duration"), second.get("duration")), (3, 4), "同步包裝：重複使用 AsyncOpenAI client")
+        
+        # 呼叫端取消
+        async def cancel_follow_up():
+            task = asyncio.create_task(TripInfoCollector.agenerate_follow_up_question(
+                [("location", "目的地")], {}, FakeAsyncVLLMClient({}, delay=1)
+            ))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                return True
+            return False
+        
+        assert_true(asyncio.run(cancel_follow_up()), "取消：追問可被取消")
+    finally:
+        TripInfoCollector.llm_cache = original_cache
+        TripInfoCollector.llm_breaker = original_breaker
+        TripInfoCollector.follow_up_cache = original_follow_up
+
+def test_garbage_detection():
+    """測試串流垃圾偵測與提前中止"""
+    print("\n🗑️ 測試串流垃圾偵測")
+    
+    from utils.circuit_breaker import CircuitBreaker
+    from utils.garbage_detector import GarbageDetector
+    from utils.result_cache import ResultCache
+    
+    assert_true(GarbageDetector.check("!!!!!!!!!!!!"), "垃圾：重複驚嘆號")
+    assert_true(GarbageDetector.check("abababababababababab"), "垃圾：低 bigram 熵")
+    assert_true(not GarbageDetector.check("Location: 台東\nDuration: 3"), "垃圾：正常回應不誤判")
+    assert_true(not GarbageDetector.check("想在宜蘭待幾天呢？"), "垃圾：正常追問不誤判")
+    
+    original_cache = TripInfoCollector.llm_cache
+    original_breaker = TripInfoCollector.llm_breaker
+    original_follow_up = TripInfoCollector.follow_up_cache
+    TripInfoCollector.llm_cache = ResultCache(max_size=16, ttl=60)
+    TripInfoCollector.follow_up_cache = ResultCache(max_size=16, ttl=60)
+    TripInfoCollector.llm_breaker = CircuitBreaker()
+    try:
+        client = FakeVLLMClient({"想去嘉義": "!" * 200})
+        result = TripInfoCollector.extract_info_from_message("想去嘉義玩3天", client)
+        assert_equal(result.get("duration"), 3, "垃圾：改用規則結果")
+        
+        client = FakeVLLMClient({"想去苗栗": "!" * 200})
+        result = TripInfoCollector.extract_info_from_message("想去苗栗走走", client)
+        assert_equal(result.get("duration"), None, "垃圾：不採用 LLM 結果")
+        assert_true(client.streamed <= 5, "垃圾：串流提前中止")
+        
+        client = FakeAsyncVLLMClient({"天數": "!" * 200})
+        question = TripInfoCollector.generate_follow_up_question(
+            [("duration", "天數")], {"location": "宜蘭"}, client
+        )
+        assert_true(question.startswith("請問預計玩幾天呢？"), "垃圾：追問使用預設問題")
+        assert_true(client.streamed <= 5, "垃圾：非同步串流提前中止")
+    finally:
+        TripInfoCollector.llm_cache = original_cache
+        TripInfoCollector.llm_breaker = original_breaker
+        TripInfoCollector.follow_up_cache = original_follow_up
+
+def test_follow_up_cache():
+    """測試追問庫"""
+    print("\n💬 測試追問庫")
+    
+    from utils.circuit_breaker import CircuitBreaker
+    from utils.result_cache import ResultCache
+    
+    original_breaker = TripInfoCollector.llm_breaker
+    original_warm_breaker = TripInfoCollector.warm_breaker
+    original_follow_up = TripInfoCollector.follow_up_cache
+    TripInfoCollector.llm_breaker = CircuitBreaker()
+    TripInfoCollector.warm_breaker = CircuitBreaker()
+    TripInfoCollector.follow_up_cache = ResultCache(max_size=16, ttl=60)
+    try:
+        info = {"location": "台南", "other_requirements": {"trip_type": "情侶出遊"}}
+        signature = TripInfoCollector._follow_up_signature("duration", info)
+        assert_equal(signature, "duration|台南||情侶出遊", "追問庫：情境簽章")
+        
+        # 未見過的情境才呼叫 LLM，之後直接使用追問庫
+        client = FakeVLLMClient({"天數": "想在台南待幾天呢？"})
+        first = TripInfoCollector.generate_follow_up_question([("duration", "天數")], info, client)
+        second = TripInfoCollector.generate_follow_up_question([("duration", "天數")], info, client)
+        assert_equal(first, "想在台南待幾天呢？", "追問庫：首次由 LLM 生成")
+        assert_equal(second, first, "追問庫：命中時回傳庫存問題")
+        assert_equal(client.calls, 1, "追問庫：命中時不呼叫 LLM")
+        
+        # 預熱後隨機輪替
+        replies = iter(["想去哪裡玩呢？", "這次想去哪座城市？", "有想去的地方嗎？"])
+        client = FakeVLLMClient({})
+        
+        def create(**kwargs):
+            client.replies = {"目的地": next(replies)}
+            return FakeVLLMClient.create(client, **kwargs)
+        
+        client.chat.completions.create = create
+        added = TripInfoCollector.warm_follow_up_questions(client, contexts=[("location", {})], variants=3)
+        assert_equal(added, 3, "追問庫：預熱新增變體")
+        
+        questions = {
+            TripInfoCollector.generate_follow_up_question([("location", "目的地")], {}, client)
+            for _ in range(30)
+        }
+        assert_equal(len(questions), 3, "追問庫：隨機輪替變體")
+        assert_equal(client.calls, 3, "追問庫：預熱後不再呼叫 LLM")
+        
+        # 預熱失敗只記在預熱斷路器；線上斷路器未關閉時不預熱
+        client = FakeVLLMClient({"天數": "!" * 200})
+        contexts = [("duration", {"location": city}) for city in ("花蓮", "台東", "宜蘭")]
+        TripInfoCollector.warm_follow_up_questions(client, contexts=contexts)
+        assert_equal(TripInfoCollector.llm_breaker.state, "closed", "追問庫：預熱失敗不開啟線上斷路器")
+        assert_true(TripInfoCollector.warm_breaker.state != "closed", "追問庫：預熱失敗記在預熱斷路器")
+        
+        for _ in range(3):
+            TripInfoCollector.llm_breaker.record_failure()
+        client = FakeVLLMClient({"天數": "想在花蓮待幾天呢？"})
+        added = TripInfoCollector.warm_follow_up_questions(client, contexts=[("duration", {"location": "花蓮"})])
+        assert_equal((added, client.calls), (0, 0), "追問庫：線上斷路器未關閉時略過預熱")
+    finally:
+        TripInfoCollector.llm_breaker = original_breaker
+        TripInfoCollector.warm_breaker = original_warm_breaker
+        TripInfoCollector.follow_up_cache = original_follow_up
+
+def test_circuit_breaker():
+    """測試 vLLM 斷路器"""
+    print("\n🔌 測試 vLLM 斷路器")
+    
+    from utils.circuit_breaker import CircuitBreaker
+    from utils.result_cache import ResultCache
+    
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=3, window=10, cooldown=5, clock=lambda: now[0])
+    
+    # 視窗外的失敗不累計
+    breaker.record_failure()
+    now[0] = 11
+    breaker.record_failure()
+    breaker.record_failure()
+    assert_equal(breaker.state, "closed", "斷路器：視窗外失敗不累計")
+    
+    breaker.record_failure()
+    assert_equal(breaker.state, "open", "斷路器：連續失敗後開啟")
+    assert_true(not breaker.allow_request(), "斷路器：開啟時跳過請求")
+    
+    # 冷卻後只放行一個探測請求
+    now[0] = 17
+    assert_equal(breaker.state, "half_open", "斷路器：冷卻後半開")
+    assert_true(breaker.allow_request(), "斷路器：放行探測請求")
+    assert_true(not breaker.allow_request(), "斷路器：探測期間不放行其他請求")
+    
+    breaker.record_failure()
+    assert_equal(breaker.state, "open", "斷路器：探測失敗重新開啟")
+    
+    now[0] = 23
+    assert_true(breaker.allow_request(), "斷路器：再次探測")
+    breaker.record_success()
+    assert_equal(breaker.state, "closed", "斷路器：探測成功後關閉")
+    assert_equal(breaker.stats()["trips"], 2, "斷路器：開啟次數")
+    
+    # 開啟後不再呼叫 vLLM
+    original_cache = TripInfoCollector.llm_cache
+    original_breaker = TripInfoCollector.llm_breaker
+    original_follow_up = TripInfoCollector.follow_up_cache
+    TripInfoCollector.llm_cache = ResultCache(max_size=16, ttl=60)
+    TripInfoCollector.follow_up_cache = ResultCache(max_size=16, ttl=60)
+    TripInfoCollector.llm_breaker = CircuitBreaker(failure_threshold=2, window=60, cooldown=60)
+    try:
+        client = FakeVLLMClient({"User says": "!" * 200})
+        for message in ["想去嘉義走走", "想去苗栗走走", "想去雲林走走", "想去屏東走走"]:
+            TripInfoCollector.extract_info_from_message(message, client)
+        
+        assert_equal(client.calls, 2, "斷路器：開啟後跳過 LLM")
+        
+        question = TripInfoCollector.generate_follow_up_question([("duration", "天數")], {}, client)
+        assert_equal(client.calls, 2, "斷路器：追問也跳過 LLM")
+        assert_true(question.startswith("請問預計玩幾天呢？"), "斷路器：使用預設問題")
+    finally:
+        TripInfoCollector.llm_cache = original_cache
+        TripInfoCollector.llm_breaker = original_breaker
+        TripInfoCollector.follow_up_cache = original_follow_up
+
+def test_speculative_itinerary():
+    """測試推測式行程生成"""
+    print("\n🚀 測試推測式行程生成")
+    
+    from utils.speculative_generator import SpeculativeItinerary
+    
+    calls = []
+    
+    def fake_generate(client, location, duration, budget=None, preferences=None):
+        calls.append((location, duration))
+        time.sleep(0.05)
+        return {"success": True, "data": {"location": location, "days": duration}}
+    
+    speculative = SpeculativeItinerary(generate=fake_generate)
+    assert_true(speculative.start(None, "台南", 3), "推測：送出背景生成")
+    assert_true(not speculative.start(None, "台南", 3), "推測：相同參數不重複送出")
+    
+    result = speculative.result(None, "台南", 3)
+    assert_equal(result["data"], {"location": "台南", "days": 3}, "推測：使用背景結果")
+    assert_equal((len(calls), speculative.hits), (1, 1), "推測：參數未改變不重新生成")
+    
+    # 參數改變：捨棄背景生成並重新生成
+    speculative.start(None, "台南", 3)
+    result = speculative.result(None, "台南", 4)
+    assert_equal(result["data"]["days"], 4, "推測：參數改變時重新生成")
+    assert_equal(speculative.cancelled, 1, "推測：捨棄過期的背景生成")
+    assert_true(not speculative.pending, "推測：取用後清除")
+    
+    # 取消後背景串流不再拉取後續回應，並關閉串流
+    pulled = []
+    closed = threading.Event()
+    
+    def slow_stream(client, location, duration, budget=None, preferences=None):
+        try:
+            for day in range(1, 100):
+                time.sleep(0.02)
+                pulled.append(day)
+                yield "day", {"day": day}
+            yield "done", {"success": True}
+        finally:
+            closed.set()
+    
+    speculative = SpeculativeItinerary(stream=slow_stream)
+    speculative.start(None, "台東", 5)
+    time.sleep(0.1)
+    speculative.cancel()
+    assert_true(closed.wait(1.0), "推測：取消時關閉串流")
+    count = len(pulled)
+    time.sleep(0.1)
+    assert_true(len(pulled) == count and count < 99, f"推測：取消後停止拉取（{count} 段）")
+
+def test_benchmark_gate():
+    """測試效能基準比較"""
+    print("\n📈 測試效能基準比較")
+    
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from benchmark_info_collector import compare, generate_corpus, run_benchmark
+    
+    corpus = generate_corpus(200, seed=7)
+    assert_equal(corpus, generate_corpus(200, seed=7), "基準：語料可重現")
+    
+    results = run_benchmark(corpus)
+    assert_true(0 < results["resolution_rate"] < 1, "基準：規則解析率")
+    assert_equal(compare(results, results, 0.2), [], "基準：與自身比較無退步")
+    
+    slower = json.loads(json.dumps(results))
+    slower["rule_extract"]["p95_us"] *= 2
+    slower["resolution_rate"] -= 0.05
+    regressions = compare(slower, results, 0.2)
+    assert_equal(len(regressions), 2, "基準：偵測延遲與解析率退步")
+    
+    # 整台機器變慢（參考迴圈也變慢）不算退步
+    loaded = json.loads(json.dumps(results))
+    loaded["reference_us"] *= 2
+    for name in ("rule_extract", "merge_info", "is_info_complete"):
+        for metric in ("p50_us", "p95_us", "p99_us"):
+            loaded[name][metric] *= 2
+        loaded[name]["throughput"] /= 2
+    assert_true(results["reference_us"] > 0, "基準：量測參考迴圈")
+    assert_equal(compare(loaded, results, 0.2), [], "基準：依參考迴圈換算機器速度")
+
+def test_stand_in_server():
+    """測試本地 LLM 替身伺服器"""
+    print("\n🧪 測試本地 LLM 替身伺服器")
+    
+    import urllib.request
+    from utils.itinerary_generator import ItineraryGenerator
+    from utils.stand_in_llm import FakeGeminiModel, StandInConfig, create_server
+    
+    def post(url, payload):
+        request = urllib.request.Request(
+            url, data=json.dumps(payload).encode("utf-8"), headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.read().decode("utf-8")
+    
+    server = create_server(StandInConfig(seed=1), port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    try:
+        body = json.loads(post(f"{base_url}/chat/completions", {
+            "messages": [{"role": "user", "content": 'User says: "想去台東玩3天"\n\nNow extract'}]
+        }))
+        content = body["choices"][0]["message"]["content"]
+        assert_equal(content, "Location: 台東\nDuration: 3", "替身：OpenAI 相容提取回應")
+        
+        stream = post(f"{base_url}/chat/completions", {
+            "messages": [{"role": "user", "content": "Missing: 天數\n\nQuestion:"}],
+            "stream": True,
+            "max_tokens": 3
+        })
+        chunks = [
+            json.loads(line[len("data: "):]) for line in stream.splitlines()
+            if line.startswith("data: {")
+        ]
+        text = "".join(chunk["choices"][0]["delta"].get("content", "") for chunk in chunks)
+        assert_equal(len(text), 3, "替身：串流依 max_tokens 截斷")
+        assert_equal(chunks[-1]["choices"][0]["finish_reason"], "length", "替身：截斷時 finish_reason 為 length")
+        
+        server.responder.config.garbage_rate = 1.0
+        body = json.loads(post(f"{base_url}/chat/completions", {
+            "messages": [{"role": "user", "content": "test"}], "max_tokens": 20
+        }))
+        assert_equal(body["choices"][0]["message"]["content"], "!" * 20, "替身：垃圾輸出模式")
+    finally:
+        server.shutdown()
+        server.server_close()
+    
+    # Gemini 替身：模板行程與損毀 JSON
+    result = ItineraryGenerator.generate_itinerary(FakeGeminiModel(), "台北", 3)
+    assert_true(result["success"] and result["data"]["location"] == "台北", "替身：Gemini 回傳模板行程")
+    
+    broken = FakeGeminiModel(StandInConfig(malformed_json_rate=1.0, seed=1))
+    response = broken.generate_content("目的地：台北\n天數：3天\nJSON")
+    try:
+        json.loads(response.text)
+        parsed = True
+    except json.JSONDecodeError:
+        parsed = False
+    assert_true(not parsed, "替身：損毀 JSON 模式")
+
+def test_streaming_itinerary():
+    """測試串流行程生成"""
+    print("\n📡 測試串流行程生成")
+    
+    from utils.itinerary_generator import ItineraryGenerator
+    from utils.json_stream import DailyItineraryParser
+    from utils.speculative_generator import SpeculativeItinerary
+    from utils.stand_in_llm import FakeGeminiModel, StandInConfig
+    
+    # 逐字元餵入：字串中的括號、巢狀陣列、其他陣列都不影響
+    text = '```json\n{"note": "a:[{", "daily_itinerary": [{"day": 1, "theme": "}\\"", "x": [{"y": 2}]}, {"day": 2}], "tips": [{"z": 1}]}'
+    parser = DailyItineraryParser()
+    days = [day for char in text for day in parser.feed(char)]
+    assert_equal([day["day"] for day in days], [1, 2], "串流：逐日取出 daily_itinerary")
+    assert_equal(days[0]["theme"], '}"', "串流：字串中的括號不影響解析")
+    
+    # 第一天在整份行程完成前就產出（清除行程快取，確保實際生成）
+    ItineraryGenerator.result_cache.clear()
+    client = FakeGeminiModel(StandInConfig(token_delay=0.0002))
+    start_time = time.time()
+    arrivals = []
+    for event, payload in ItineraryGenerator.stream_itinerary(client, "台北", 3):
+        arrivals.append((event, time.time() - start_time))
+        if event == "done":
+            result = payload
+    
+    assert_equal([event for event, _ in arrivals], ["day", "day", "day", "done"], "串流：逐日產出後完成")
+    assert_true(arrivals[0][1] < arrivals[-1][1] * 0.6, "串流：第一天提早產出")
+    assert_true(result["success"] and len(result["data"]["daily_itinerary"]) == 3, "串流：最終結果完整")
+    
+    # 沒有文字的 chunk（存取 .text 丟 ValueError）直接略過
+    class TextlessChunk:
+        candidates = []
+        
+        @property
+        def text(self):
+            raise ValueError("The `response.text` quick accessor requires a valid `Part`")
+    
+    class TextlessChunkModel(FakeGeminiModel):
+        def generate_content(self, prompt, generation_config=None, stream=False, **kwargs):
+            response = super().generate_content(prompt, generation_config, stream, **kwargs)
+            return [TextlessChunk(), *response, TextlessChunk()] if stream else response
+    
+    ItineraryGenerator.result_cache.clear()
+    events = list(ItineraryGenerator.stream_itinerary(TextlessChunkModel(), "台北", 3))
+    assert_true(events[-1][1]["success"] and len(events[-1][1]["data"]["daily_itinerary"]) == 3, "串流：略過沒有文字的 chunk")
+    
+    # 推測式生成接續背景進度
+    speculative = SpeculativeItinerary()
+    speculative.start(FakeGeminiModel(), "台北", 3)
+    events = list(speculative.events(FakeGeminiModel(), "台北", 3))
+    assert_equal([event for event, _ in events], ["day", "day", "day", "done"], "串流：推測式生成逐日產出")
+    assert_equal(speculative.hits, 1, "串流：使用推測式生成進度")
+
+def test_json_repair():
+    """測試容錯 JSON 修復"""
+    print("\n🩹 測試容錯 JSON 修復")
+    
+    from utils.itinerary_generator import ItineraryGenerator
+    from utils.json_repair import repair_json
+    from utils.stand_in_llm import FakeGeminiModel, StandInConfig
+    
+    itinerary = {
+        "trip_name": "台北3日遊", "location": "台北", "duration": 3,
+        "daily_itinerary": [
+            {"day": day, "theme": "括號 {[ 與 \\\" 引號", "activities": [
+                {"time": "09:00", "name": f"景點{index}", "cost": 100} for index in range(3)
+            ]}
+            for day in range(1, 4)
+        ]
+    }
+    text = "```json\n" + json.dumps(itinerary, ensure_ascii=False, indent=2) + "\n```"
+    
+    data, report = repair_json(text)
+    assert_equal((data, report["complete"]), (itinerary, True), "修復：完整 JSON 原樣解析")
+    
+    # 任意位置截斷都能得到合法結果，且不留下半個活動或空的一天
+    valid = True
+    for cut in range(text.index("{") + 1, len(text)):
+        data, report = repair_json(text[:cut])
+        for day in data.get("daily_itinerary", []):
+            if not day.get("activities") or any("cost" not in a for a in day["activities"]):
+                valid = False
+    assert_true(valid, "修復：任意截斷點都保留完整的天與活動")
+    
+    data, report = repair_json(text[:text.index("景點1", text.index('"day": 2'))])
+    assert_equal([len(day["activities"]) for day in data["daily_itinerary"]], [3, 1], "修復：保留到最後一個完整活動")
+    assert_equal(report["dropped"], ["daily_itinerary[1].activities[1]"], "修復：回報捨棄的活動")
+    
+    # 捨棄的物件內部結構不列為未關閉
+    data, report = repair_json('{"daily_itinerary": [{"day": 1, "activities": [')
+    assert_equal(report["unclosed"], ["$", "daily_itinerary"], "修復：未關閉路徑不含捨棄的結構")
+    
+    data, report = repair_json(text.replace('"cost": 100\n        },', '"cost": 100\n        }', 1))
+    assert_equal(report["reason"], "syntax_error", "修復：語法錯誤時保留錯誤前的內容")
+    
+    # 截斷的 Gemini 回應不再整份改用模板
+    ItineraryGenerator.result_cache.clear()
+    result = ItineraryGenerator.generate_itinerary(FakeGeminiModel(StandInConfig(truncate_tokens=1500)), "台北", 3)
+    assert_true(result["success"] and result["data"]["daily_itinerary"], "修復：截斷回應仍可使用")
+    
+    # 30 KB 回應線性時間內完成
+    large = json.dumps({"daily_itinerary": [
+        {"day": day, "activities": [{"name": "景點" * 20, "note": "說明\\\"" * 10} for _ in range(10)]}
+        for day in range(1, 16)
+    ]}, ensure_ascii=False)
+    start_time = time.time()
+    repair_json(large[:-3])
+    assert_true(time.time() - start_time < 0.1, "修復：30 KB 回應快速完成")
+
+def test_parallel_itinerary():
+    """測試分日並行行程生成"""
+    print("\n🧵 測試分日並行行程生成")
+    
+    from utils.itinerary_generator import ItineraryGenerator
+    from utils.stand_in_llm import FakeGeminiModel, StandInConfig
+    
+    # 骨架一次 + 各天同時進行：總時間約兩次請求，而非 1 + 6 次
+    ItineraryGenerator.result_cache.clear()
+    client = FakeGeminiModel(StandInConfig(latency_mean=0.1))
+    start_time = time.time()
+    events = list(ItineraryGenerator.stream_itinerary_parallel(client, "台北", 6, max_concurrency=6))
+    elapsed = time.time() - start_time
+    
+    result = events[-1][1]
+    days = result["data"]["daily_itinerary"]
+    assert_equal([event for event, _ in events], ["day"] * 6 + ["done"], "並行：逐日產出後完成")
+    assert_equal([day["day"] for day in days], list(range(1, 7)), "並行：合併後依天數排序")
+    assert_true(all(day["activities"] for day in days), "並行：每天都有活動")
+    assert_true(elapsed < 0.4, f"並行：各天同時生成（{elapsed:.2f}s）")
+    
+    # 主要 client 失敗時骨架改用預設主題，各天改由其他 client 生成
+    class BrokenModel:
+        def generate_content(self, prompt, generation_config=None, stream=False):
+            raise ConnectionError("down")
+    
+    result = ItineraryGenerator.generate_itinerary_parallel(
+        BrokenModel(), "台南", 4, extra_clients=[FakeGeminiModel()]
+    )
+    days = result["data"]["daily_itinerary"]
+    assert_equal([day["day"] for day in days], [1, 2, 3, 4], "並行：失敗時由其他 client 分擔")
+    assert_true(result["success"] and all(day["activities"] for day in days), "並行：失敗時仍完整")
+
+def test_itinerary_cache():
+    """測試行程結果快取"""
+    print("\n🗄️ 測試行程結果快取")
+    
+    import tempfile
+    from utils.itinerary_generator import ItineraryGenerator
+    from utils.result_cache import ResultCache
+    from utils.stand_in_llm import FakeGeminiModel
+    
+    key = ItineraryGenerator._result_cache_key
+    assert_equal(key("台南", 3, 20000, ["美食", "文化"]), key(" 台南", 3, 21000, ["文化", "美食"]), "行程快取：預算級距與偏好順序正規化")
+    assert_true(key("台南", 3, 20000) != key("台南", 3, 40000), "行程快取：預算差距大時不同")
+    assert_true(key("台南", 3) != key("台南", 4), "行程快取：天數不同時不同")
+    
+    original_cache = ItineraryGenerator.result_cache
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "itinerary_cache.db")
+        ItineraryGenerator.result_cache = ResultCache(max_size=8, ttl=60, db_path=db_path, table="itinerary")
+        try:
+            model = FakeGeminiModel()
+            first = ItineraryGenerator.generate_itinerary(model, "台南", 3, 20000, ["美食"])
+            second = ItineraryGenerator.generate_itinerary(model, "台南", 3, 21000, ["美食"])
+            assert_equal(model.responder.stats["requests"], 1, "行程快取：相同請求只呼叫一次")
+            assert_equal((first["cache"]["hit"], second["cache"]["hit"]), (False, True), "行程快取：回傳命中資訊")
+            
+            # 呼叫端修改結果（例如 convert_to_trip_format 之後的處理）不影響快取
+            second["data"]["daily_itinerary"][0]["activities"].clear()
+            third = ItineraryGenerator.generate_itinerary(model, "台南", 3, 20000, ["美食"])
+            assert_true(third["data"]["daily_itinerary"][0]["activities"], "行程快取：回傳深拷貝")
+            
+            # 串流命中時逐日產出快取內容
+            events = list(ItineraryGenerator.stream_itinerary(model, "台南", 3, 20000, ["美食"]))
+            assert_equal([event for event, _ in events], ["day", "day", "day", "done"], "行程快取：串流命中逐日產出")
+            
+            # 重啟後（新的實例）從磁碟讀回
+            ItineraryGenerator.result_cache = ResultCache(max_size=8, ttl=60, db_path=db_path, table="itinerary")
+            restarted = ItineraryGenerator.generate_itinerary(model, "台南", 3, 20000, ["美食"])
+            assert_true(restarted["cache"]["hit"], "行程快取：重啟後從磁碟命中")
+            assert_equal(model.responder.stats["requests"], 1, "行程快取：重啟後不重新生成")
+        finally:
+            ItineraryGenerator.result_cache._db.close()
+            ItineraryGenerator.result_cache = original_cache
+
+def test_semantic_cache():
+    """測試語意行程快取"""
+    print("\n🧭 測試語意行程快取")
+    
+    import tempfile
+    from utils.itinerary_generator import ItineraryGenerator
+    from utils.result_cache import ResultCache
+    from utils.semantic_cache import SemanticItineraryCache, cosine, embed, request_text
+    from utils.stand_in_llm import FakeGeminiModel
+    
+    base = embed(request_text("台南", 3, 20000, ["美食", "文化"]))
+    assert_true(cosine(base, embed(request_text("台南", 3, 21000, ["文化", "美食"]))) > 0.99, "語意快取：相同請求向量一致")
+    assert_true(cosine(base, embed(request_text("台南", 4, 20000, ["美食", "文化"]))) > 0.8, "語意快取：天數相近時相似")
+    assert_true(cosine(base, embed(request_text("花蓮", 5, 50000, ["自然"]))) < 0.5, "語意快取：不同請求不相似")
+    
+    cache = SemanticItineraryCache()
+    entry = {"location": "台南", "duration": 3, "preferences": ["文化", "美食"]}
+    assert_true(cache.accepts(entry, "台南", 4, ["美食", "文化"]), "語意快取：天數差一天可接受")
+    assert_true(not cache.accepts(entry, "台北", 3, ["美食", "文化"]), "語意快取：不同城市不接受")
+    assert_true(not cache.accepts(entry, "台南", 3, ["購物"]), "語意快取：偏好不重疊不接受")
+    
+    # 改寫：補足天數並依預算重算
+    result = {"success": True, "data": ItineraryGenerator._create_fallback_itinerary("台南", 3, 30000)}
+    adapted = SemanticItineraryCache.adapt(result, "台南", 4, 40000)
+    assert_equal([day["day"] for day in adapted["data"]["daily_itinerary"]], [1, 2, 3, 4], "語意快取：補足天數")
+    assert_equal(adapted["data"]["total_budget"], 40000, "語意快取：依新預算重算")
+    assert_equal(len(result["data"]["daily_itinerary"]), 3, "語意快取：不修改原本行程")
+    
+    if not cache.available:
+        assert_equal(cache.lookup("台南", 3), None, "語意快取：缺少 faiss 時停用")
+        return
+    
+    original_cache = ItineraryGenerator.result_cache
+    original_semantic = ItineraryGenerator.semantic_cache
+    with tempfile.TemporaryDirectory() as directory:
+        index_path = os.path.join(directory, "itinerary.faiss")
+        ItineraryGenerator.result_cache = ResultCache(max_size=8, ttl=60)
+        ItineraryGenerator.semantic_cache = SemanticItineraryCache(index_path, flush_delay=60)
+        try:
+            model = FakeGeminiModel()
+            ItineraryGenerator.generate_itinerary(model, "台南", 3, 20000, ["美食", "文化"])
+            similar = ItineraryGenerator.generate_itinerary(model, "台南", 4, 20000, ["美食", "文化"])
+            assert_equal(model.responder.stats["requests"], 1, "語意快取：相似請求不呼叫 LLM")
+            assert_true(similar["cache"]["semantic"] and similar["data"]["duration"] == 4, "語意快取：改寫成新天數")
+            assert_true(not os.path.exists(index_path), "語意快取：新增時不在請求執行緒寫入磁碟")
+            
+            # 背景寫入後，重啟時以記憶體映射載入，新增只附加不複製載入的索引
+            ItineraryGenerator.semantic_cache.flush()
+            reloaded = SemanticItineraryCache(index_path, flush_delay=60)
+            assert_equal(len(reloaded), 1, "語意快取：重啟後載入索引")
+            assert_true(reloaded.lookup("台南", 3, 20000, ["文化", "美食"]) is not None, "語意快取：載入後可查詢")
+            reloaded.add("花蓮", 5, 50000, ["自然"], similar)
+            assert_equal((reloaded._base.ntotal, reloaded._delta.ntotal), (1, 1), "語意快取：新增只附加到記憶體")
+            assert_true(reloaded.lookup("花蓮", 5, 50000, ["自然"]) is not None, "語意快取：可查詢尚未寫入的行程")
+            
+            # 超過上限時在背景捨棄最舊的行程
+            reloaded.max_entries = 1
+            reloaded.flush()
+            restarted = SemanticItineraryCache(index_path, flush_delay=60)
+            assert_equal([entry["location"] for entry in restarted._entries], ["花蓮"], "語意快取：捨棄最舊的行程")
+            assert_true(restarted.lookup("台南", 3, 20000, ["文化", "美食"]) is None, "語意快取：捨棄的行程不再命中")
+        finally:
+            ItineraryGenerator.result_cache = original_cache
+            ItineraryGenerator.semantic_cache = original_semantic
+
+def test_template_index():
+    """測試行程模板索引"""
+    print("\n📚 測試行程模板索引")
+    
+    import copy
+    import tempfile
+    from utils.itinerary_generator import ItineraryGenerator
+    from utils.template_index import TemplateIndex
+    
+    index = ItineraryGenerator.template_index
+    first = ItineraryGenerator._create_fallback_itinerary("台北", 5, 50000)
+    second = ItineraryGenerator._create_fallback_itinerary("台北", 5, None)
+    assert_equal([day["day"] for day in first["daily_itinerary"]], [1, 2, 3, 4, 5], "模板索引：補足天數")
+    assert_equal(first["total_budget"], 50000, "模板索引：依預算調整")
+    assert_true(second["total_budget"] != 50000, "模板索引：預算調整不影響共用資料")
+    assert_true(first["daily_itinerary"] is second["daily_itinerary"], "模板索引：共用內部結構")
+    
+    # 共用資料唯讀，複製後可修改
+    try:
+        first["daily_itinerary"][0]["activities"].append({})
+        mutated = True
+    except TypeError:
+        mutated = False
+    assert_true(not mutated, "模板索引：共用資料不可修改")
+    
+    copied = copy.deepcopy(first)
+    copied["daily_itinerary"][0]["activities"].append({})
+    assert_equal(type(copied["daily_itinerary"][0]), dict, "模板索引：深拷貝還原成一般 dict")
+    assert_equal(json.loads(json.dumps(first, ensure_ascii=False))["trip_name"], first["trip_name"], "模板索引：可直接序列化")
+    
+    trip = ItineraryGenerator.convert_to_trip_format(ItineraryGenerator._create_fallback_itinerary("台南", 3, None))
+    trip["itinerary"][0]["activities"].pop()
+    assert_equal(type(trip["itinerary"][0]["activities"]), list, "模板索引：轉換後的行程可編輯")
+    
+    # 任意天數從單日模板池組合，天不重複
+    long_trip = ItineraryGenerator._create_fallback_itinerary("台北", 7, None)
+    themes = [day["theme"] for day in long_trip["daily_itinerary"]]
+    assert_equal(len(set(themes)), 7, "模板池：七天主題不重複")
+    names = [tuple(a["name"] for a in day["activities"]) for day in long_trip["daily_itinerary"]]
+    assert_equal(len(set(names)), 7, "模板池：七天活動不重複")
+    assert_equal(sum(long_trip["budget_breakdown"].values()), long_trip["total_budget"], "模板池：預算分配加總等於總預算")
+    assert_true(long_trip["total_budget"] > 15000, "模板池：預算依天數調整")
+    
+    shopping = ItineraryGenerator._create_fallback_itinerary("台北", 1, None, ["購物"])
+    assert_equal(shopping["daily_itinerary"][0]["theme"], "老街與購物", "模板池：依偏好挑選")
+    assert_true(all("購物" in {a["type"] for a in day["activities"]} for day in index.pool("台北", activity_type="購物")), "模板池：依活動類型查詢")
+    
+    # 沒有模板的地點也從通用單日行程組合，不重複同一天
+    generic_trip = ItineraryGenerator._create_fallback_itinerary("花蓮", 6, None, ["自然"])
+    themes = [day["theme"] for day in generic_trip["daily_itinerary"]]
+    assert_equal(len(set(themes)), 6, "模板池：沒有模板的地點主題不重複")
+    assert_equal([day["day"] for day in generic_trip["daily_itinerary"]], [1, 2, 3, 4, 5, 6], "模板池：沒有模板的地點天數連續")
+    nature = ItineraryGenerator._create_fallback_itinerary("花蓮", 1, None, ["自然"])
+    assert_equal(nature["daily_itinerary"][0]["theme"], "花蓮近郊自然", "模板池：沒有模板的地點依偏好挑選")
+    basic = ItineraryGenerator._create_basic_itinerary("花蓮", 2, None)
+    assert_equal(basic["daily_itinerary"][0]["activities"], generic_trip["daily_itinerary"][0]["activities"], "模板池：基本架構與通用單日行程同一來源")
+    
+    # 檔案修改時間改變時重新載入
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "templates.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"花蓮": {"2天": {"trip_name": "花蓮2日遊", "duration": 2, "daily_itinerary": []}}}, f, ensure_ascii=False)
+        local = TemplateIndex(path)
+        assert_equal(local.lookup("花蓮", 2)["trip_name"], "花蓮2日遊", "模板索引：載入模板")
+        
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"花蓮": {"2天": {"trip_name": "花東2日遊", "duration": 2, "daily_itinerary": []}}}, f, ensure_ascii=False)
+        os.utime(path, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+        assert_equal(local.lookup("花蓮", 2)["trip_name"], "花東2日遊", "模板索引：檔案修改後重新載入")
+        generic = local.lookup("台東", 2)
+        assert_equal([day["theme"] for day in generic["daily_itinerary"]], ["台東在地探索", "台東近郊自然"], "模板索引：沒有該地點時以通用單日行程組合")
+    
+    # 不再每次讀檔
+    loads = index.loads
+    start_time = time.time()
+    for _ in range(10000):
+        ItineraryGenerator._create_fallback_itinerary("高雄", 2, 20000)
+    elapsed = time.time() - start_time
+    assert_equal(index.loads, loads, "模板索引：不重複載入")
+    assert_true(elapsed < 0.5, f"模板索引：10000 次備案 {elapsed * 1000:.0f}ms")
+
+def test_token_planner():
+    """測試輸出 token 上限規劃"""
+    print("\n📏 測試輸出 token 上限規劃")
+    
+    from utils.itinerary_generator import ItineraryGenerator
+    from utils.result_cache import ResultCache
+    from utils.stand_in_llm import FakeGeminiModel
+    from utils.token_planner import TokenBudgetPlanner, is_truncated
+    
+    planner = TokenBudgetPlanner(min_samples=5)
+    assert_equal(planner.plan("gemini", 3, default=2400), 2400, "token 規劃：樣本不足時使用預設值")
+    
+    for _ in range(20):
+        planner.record("gemini", 3, 1, 1500, False)
+    planned = planner.plan("gemini", 3, 1)
+    assert_true(1500 < planned < 2400, f"token 規劃：依實際輸出收緊（{planned}）")
+    assert_true(planner.plan("gemini", 6, 1) > planned, "token 規劃：天數越多上限越高")
+    
+    for _ in range(10):
+        planner.record("gemini", 3, 1, planned, True)
+    widened = planner.plan("gemini", 3, 1)
+    assert_true(widened > planned, f"token 規劃：截斷率升高時放寬（{planned} → {widened}）")
+    assert_true(planner.stats("gemini")["truncation_rate"] > 0.05, "token 規劃：統計截斷率")
+    
+    assert_true(is_truncated("MAX_TOKENS") and is_truncated("length") and not is_truncated("STOP"), "token 規劃：辨識截斷原因")
+    
+    # 實際生成時記錄輸出並用於下一次規劃
+    original_planner = ItineraryGenerator.token_planner
+    original_cache = ItineraryGenerator.result_cache
+    ItineraryGenerator.token_planner = TokenBudgetPlanner(min_samples=3)
+    ItineraryGenerator.result_cache = ResultCache(max_size=0, ttl=60)
+    try:
+        model = FakeGeminiModel()
+        for _ in range(3):
+            ItineraryGenerator.generate_itinerary(model, "台北", 3)
+        list(ItineraryGenerator.stream_itinerary(model, "台北", 3))
+        stats = ItineraryGenerator.token_planner.stats("gemini")
+        assert_equal((stats["samples"], stats["truncation_rate"]), (4, 0.0), "token 規劃：記錄一般與串流生成")
+        
+        observed = model.generate_content(ItineraryGenerator._build_prompt("台北", 3)).usage_metadata.candidates_token_count
+        planned = ItineraryGenerator._planned_max_tokens(model, 3)
+        assert_true(observed < planned <= observed * 1.2, f"token 規劃：依實際輸出規劃（{observed} → {planned}）")
+        result = ItineraryGenerator.generate_itinerary(model, "台北", 3)
+        assert_true(result["success"] and len(result["data"]["daily_itinerary"]) == 3, "token 規劃：收緊後不截斷")
+    finally:
+        ItineraryGenerator.token_planner = original_planner
+        ItineraryGenerator.result_cache = original_cache
+
+def test_compact_schema():
+    """測試精簡行程輸出格式"""
+    print("\n🗜️ 測試精簡行程輸出格式")
+    
+    from utils.compact_schema import compact_itinerary, expand_itinerary, is_compact
+    from utils.itinerary_generator import ItineraryGenerator
+    from utils.result_cache import ResultCache
+    from utils.stand_in_llm import FakeGeminiModel, StandInConfig, tokenize
+    
+    itinerary = json.loads(json.dumps(ItineraryGenerator._create_fallback_itinerary("台南", 5, None), ensure_ascii=False))
+    compact = compact_itinerary(itinerary)
+    assert_true(is_compact(compact) and not is_compact(itinerary), "精簡格式：辨識格式")
+    assert_equal(expand_itinerary(compact), itinerary, "精簡格式：展開後與原結構相同")
+    
+    # 依圖例對應欄位；截斷的半個活動捨棄，缺少的尾端欄位補預設值
+    legend = {"activity_fields": ["name", "time", "cost"], "daily_itinerary": [
+        {"day": 1, "activities": [["赤崁樓", "09:00", "NT$50"], ["安平"]]}
+    ]}
+    activities = expand_itinerary(legend)["daily_itinerary"][0]["activities"]
+    assert_equal(activities, [{"name": "赤崁樓", "time": "09:00", "cost": 50}], "精簡格式：依圖例展開")
+    
+    # 替身伺服器：精簡輸出的 token 數明顯較少，解析結果相同
+    model = FakeGeminiModel()
+    verbose_text = model.generate_content(ItineraryGenerator._build_prompt("台南", 5)).text
+    compact_text = model.generate_content(ItineraryGenerator._build_prompt("台南", 5, compact=True)).text
+    saving = 1 - len(tokenize(compact_text)) / len(tokenize(verbose_text))
+    assert_true(saving > 0.25, f"精簡格式：輸出 token 減少 {saving:.0%}")
+    assert_equal(ItineraryGenerator._parse_content(compact_text), ItineraryGenerator._parse_content(verbose_text), "精簡格式：解析結果相同")
+    
+    original_cache = ItineraryGenerator.result_cache
+    ItineraryGenerator.result_cache = ResultCache(max_size=0, ttl=60)
+    ItineraryGenerator.compact_output = True
+    try:
+        events = list(ItineraryGenerator.stream_itinerary(FakeGeminiModel(StandInConfig(token_delay=0.0001)), "台北", 3))
+        days = [payload for event, payload in events if event == "day"]
+        assert_true(len(days) == 3 and all(isinstance(a, dict) for day in days for a in day["activities"]), "精簡格式：串流逐日展開")
+        
+        # 截斷在活動中間：保留完整的活動
+        result = ItineraryGenerator.generate_itinerary(FakeGeminiModel(StandInConfig(truncate_tokens=700)), "台北", 3)
+        activities = [a for day in result["data"]["daily_itinerary"] for a in day["activities"]]
+        assert_true(result["success"] and all(a["name"] and "cost" in a for a in activities), "精簡格式：截斷時保留完整活動")
+    finally:
+        ItineraryGenerator.compact_output = False
+        ItineraryGenerator.result_cache = original_cache
+
+def test_hedged_generation():
+    """測試對沖多後端行程生成"""
+    print("\n🏁 測試對沖多後端行程生成")
+    
+    from utils.itinerary_generator import ItineraryGenerator
+    from utils.latency_tracker import LatencyTracker
+    from utils.result_cache import ResultCache
+    from utils.stand_in_llm import FakeGeminiModel, StandInConfig
+    
+    tracker = LatencyTracker(min_samples=3, default=10.0)
+    assert_equal(tracker.delay("gemini"), 10.0, "對沖：樣本不足時使用預設延遲")
+    for seconds in [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]:
+        tracker.record("gemini", seconds)
+    assert_equal(tracker.delay("gemini"), 9, "對沖：延遲取 p90")
+    
+    original_cache = ItineraryGenerator.result_cache
+    original_tracker = ItineraryGenerator.latency_tracker
+    ItineraryGenerator.result_cache = ResultCache(max_size=0, ttl=60)
+    ItineraryGenerator.latency_tracker = LatencyTracker()
+    try:
+        # 主要後端太慢：超過對沖延遲後送出備援，備援先完成
+        slow = FakeGeminiModel(StandInConfig(latency_mean=0.5))
+        start = time.time()
+        result = ItineraryGenerator.generate_itinerary_hedged(
+            slow, "台北", 2, secondary=FakeGeminiModel(), hedge_delay=0.05
+        )
+        elapsed = time.time() - start
+        assert_true(result["success"] and len(result["data"]["daily_itinerary"]) == 2, "對沖：備援結果完整")
+        assert_equal(result["hedge"]["winner"], "secondary", "對沖：慢的主要後端輸給備援")
+        assert_true(elapsed < 0.4, f"對沖：不必等主要後端（{elapsed:.2f}s）")
+        
+        # 輸掉的主要後端也記錄延遲（以被取消時已花的時間為下限），對沖延遲不會只從快的樣本學習
+        ItineraryGenerator.latency_tracker = LatencyTracker(min_samples=1)
+        start = time.time()
+        ItineraryGenerator.generate_itinerary_hedged(slow, "台北", 2, secondary=FakeGeminiModel(), hedge_delay=0.05)
+        elapsed = time.time() - start
+        assert_equal(ItineraryGenerator.latency_tracker.stats("gemini")["samples"], 2, "對沖：輸掉的後端也記錄延遲")
+        assert_true(ItineraryGenerator.latency_tracker.delay("gemini") >= elapsed * 0.9,
+                    "對沖：輸掉後的對沖延遲不低於整場競速時間")
+        
+        # 主要後端在延遲內完成：不送出備援
+        result = ItineraryGenerator.generate_itinerary_hedged(
+            FakeGeminiModel(), "台北", 2, secondary=FakeGeminiModel(), hedge_delay=5.0
+        )
+        assert_equal(result["hedge"], {"winner": "primary", "hedged": False, "delay": 5.0}, "對沖：快的主要後端不對沖")
+        assert_true(ItineraryGenerator.latency_tracker.stats("gemini")["samples"] >= 1, "對沖：記錄成功延遲")
+        
+        # 主要後端失敗：立即改送備援，不等對沖延遲
+        class BrokenModel:
+            def generate_content(self, prompt, generation_config=None, stream=False):
+                raise ConnectionError("down")
+        
+        start = time.time()
+        result = ItineraryGenerator.generate_itinerary_hedged(
+            BrokenModel(), "台北", 2, secondary=FakeGeminiModel(), hedge_delay=5.0
+        )
+        assert_true(result["success"] and result["hedge"]["winner"] == "secondary", "對沖：主要後端失敗改用備援")
+        assert_true(time.time() - start < 1.0, "對沖：失敗時不等對沖延遲")
+        
+        # 兩者都失敗：回傳主要後端的錯誤
+        result = ItineraryGenerator.generate_itinerary_hedged(BrokenModel(), "台北", 2, secondary=BrokenModel())
+        assert_true(not result["success"] and "down" in result["error"], "對沖：皆失敗時回傳錯誤")
+    finally:
+        ItineraryGenerator.result_cache = original_cache
+        ItineraryGenerator.latency_tracker = original_tracker
+
+def test_truncation_continuation():
+    """測試截斷行程的接續生成"""
+    print("\n🔁 測試截斷行程的接續生成")
+    
+    from utils.itinerary_generator import ItineraryGenerator
+    from utils.result_cache import ResultCache
+    from utils.stand_in_llm import FakeGeminiModel, StandInConfig
+    
+    original_cache = ItineraryGenerator.result_cache
+    ItineraryGenerator.result_cache = ResultCache(max_size=0, ttl=60)
+    try:
+        # 截斷在第 3 天中間：保留前兩天，只接續請求第 3 天
+        model = FakeGeminiModel(StandInConfig(truncate_tokens=1500))
+        result = ItineraryGenerator.generate_itinerary(model, "台北", 3)
+        days = result["data"]["daily_itinerary"]
+        assert_true(result["success"], "接續：生成成功")
+        assert_equal([day["day"] for day in days], [1, 2, 3], "接續：補齊缺少的天")
+        assert_equal(model.responder.stats["requests"], 2, "接續：只多一次接續請求")
+        assert_true(all(day["activities"] for day in days), "接續：每天都有活動")
+        
+        # 接續的 prompt 帶入旅程條件與最後完成的一天
+        prompts = []
+        
+        class RecordingModel(FakeGeminiModel):
+            def generate_content(self, prompt, generation_config=None, stream=False, **kwargs):
+                prompts.append(prompt)
+                return super().generate_content(prompt, generation_config, stream, **kwargs)
+        
+        ItineraryGenerator.generate_itinerary(RecordingModel(StandInConfig(truncate_tokens=1500)), "台北", 3, 30000, ["美食"])
+        assert_true(len(prompts) == 2 and "第 3 天" in prompts[1] and "NT$ 30,000" in prompts[1] and "美食" in prompts[1],
+                    "接續：prompt 帶入旅程條件")
+        assert_true('"day": 2' in prompts[1], "接續：prompt 帶入最後完成的一天")
+        
+        # 串流：接續補上的天也逐日產出
+        events = list(ItineraryGenerator.stream_itinerary(FakeGeminiModel(StandInConfig(truncate_tokens=1500)), "台北", 3))
+        assert_equal([payload["day"] for event, payload in events if event == "day"], [1, 2, 3], "接續：串流補上缺少的天")
+        
+        # 一天都沒完成也從第 1 天接續，不改用模板
+        result = ItineraryGenerator.generate_itinerary(FakeGeminiModel(StandInConfig(truncate_tokens=250)), "台北", 2)
+        assert_true(result["success"] and not result["data"].get("fallback"), "接續：沒有完整的天也不改用模板")
+        
+        # 接續請求失敗：保留已完成的天
+        class FailingContinuation(FakeGeminiModel):
+            def generate_content(self, prompt, generation_config=None, stream=False, **kwargs):
+                if "請接續規劃" in prompt:
+                    raise ConnectionError("down")
+                return super().generate_content(prompt, generation_config, stream, **kwargs)
+        
+        result = ItineraryGenerator.generate_itinerary(FailingContinuation(StandInConfig(truncate_tokens=1500)), "台北", 3)
+        days = result["data"]["daily_itinerary"]
+        assert_equal([day["day"] for day in days], [1, 2, 3], "接續：失敗時保留已完成的天與截斷的那一天")
+        assert_true(0 < len(days[2]["activities"]) < len(days[0]["activities"]), "接續：截斷的那一天保留已完成的活動")
+        
+        # 一天行程被截斷且接續失敗：仍使用截斷前完成的活動，不改用模板
+        result = ItineraryGenerator.generate_itinerary(FailingContinuation(StandInConfig(truncate_tokens=350)), "台北", 1)
+        assert_true(result["success"] and result["data"]["daily_itinerary"][0]["activities"], "接續：一天行程失敗時保留截斷的天")
+        
+        events = list(ItineraryGenerator.stream_itinerary(FailingContinuation(StandInConfig(truncate_tokens=1500)), "台北", 3))
+        assert_equal([payload["day"] for event, payload in events if event == "day"], [1, 2, 3], "接續：串流也產出保留的截斷天")
+    finally:
+        ItineraryGenerator.result_cache = original_cache
+
+def test_quota_scheduler():
+    """測試 Gemini 配額排程"""
+    print("\n🎟️ 測試 Gemini 配額排程")
+    
+    import tempfile
+    from utils.itinerary_generator import ItineraryGenerator
+    from utils.quota_scheduler import QuotaExceeded, QuotaScheduler, ScheduledModel, is_quota_error
+    from utils.result_cache import ResultCache
+    from utils.stand_in_llm import FakeGeminiModel
+    
+    now = [0.0]
+    day = ["2026-01-01"]
+    
+    def rejected(scheduler, tokens, deadline=None):
+        try:
+            scheduler.acquire(tokens, deadline)
+            return None
+        except QuotaExceeded as e:
+            return e
+    
+    # 每分鐘 2 次：第 3 次預計等待 30 秒，超過期限直接拒絕
+    scheduler = QuotaScheduler(requests_per_minute=2, tokens_per_minute=1000, deadline=5,
+                               clock=lambda: now[0], today=lambda: day[0])
+    scheduler.acquire(100)
+    scheduler.acquire(100)
+    error = rejected(scheduler, 100)
+    assert_true(error is not None and 29 < error.wait <= 30, "配額：每分鐘請求數超過時拒絕")
+    now[0] += 30
+    assert_equal(scheduler.acquire(100), 100, "配額：令牌補充後放行")
+    
+    # token 桶：預估 token 數超過剩餘額度時依補充速度計算等待
+    now[0] += 60
+    scheduler.acquire(900)
+    error = rejected(scheduler, 500)
+    assert_true(error is not None and abs(error.wait - 24) < 0.01, "配額：token 數不足時計算等待")
+    scheduler.settle(900, 100)
+    assert_true(rejected(scheduler, 500) is None, "配額：以實際用量退回多預約的 token")
+    
+    # 每日上限與跨日重置
+    daily = QuotaScheduler(requests_per_day=2, clock=lambda: now[0], today=lambda: day[0])
+    daily.acquire(10)
+    daily.acquire(10)
+    assert_true("今日" in str(rejected(daily, 10)), "配額：每日請求用盡時拒絕")
+    day[0] = "2026-01-02"
+    assert_true(rejected(daily, 10) is None, "配額：跨日重置每日用量")
+    
+    # 每日用量寫入磁碟，重啟後延續
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "quota.db")
+        first = QuotaScheduler(db_path=db_path, today=lambda: day[0])
+        first.acquire(300)
+        first.acquire(200)
+        restarted = QuotaScheduler(db_path=db_path, today=lambda: day[0])
+        assert_equal((restarted.daily_requests, restarted.daily_tokens), (2, 500), "配額：重啟後保留今日用量")
+        first._db.close()
+        restarted._db.close()
+    
+    # 包裝的 model：以實際用量修正，API 回報配額錯誤後暫停呼叫
+    scheduler = QuotaScheduler(deadline=5)
+    model = ScheduledModel(FakeGeminiModel(), scheduler)
+    model.generate_content("台北", generation_config={"max_output_tokens": 2000})
+    assert_true(scheduler.daily_tokens < 2000, f"配額：以實際用量修正預約（{scheduler.daily_tokens}）")
+    
+    class ResourceExhausted(RuntimeError):
+        code = 429
+    
+    class ExhaustedModel:
+        def generate_content(self, prompt, generation_config=None, stream=False):
+            raise ResourceExhausted("429 Resource has been exhausted")
+    
+    assert_true(is_quota_error(ResourceExhausted("quota")), "配額：辨識 ResourceExhausted")
+    assert_true(is_quota_error(SimpleNamespace(code=429)), "配額：辨識狀態碼 429")
+    assert_true(not is_quota_error(RuntimeError("request 4291 failed")), "配額：訊息含 429 不視為配額錯誤")
+    
+    model = ScheduledModel(ExhaustedModel(), scheduler)
+    try:
+        model.generate_content("test")
+    except RuntimeError:
+        pass
+    assert_true(isinstance(rejected(scheduler, 10), QuotaExceeded), "配額：API 回報配額錯誤後暫停呼叫")
+    
+    # 行程生成：配額不足時立即改用模板，不等待也不呼叫 API
+    original_cache = ItineraryGenerator.result_cache
+    ItineraryGenerator.result_cache = ResultCache(max_size=0, ttl=60)
+    try:
+        start = time.time()
+        result = ItineraryGenerator.generate_itinerary(model, "台北", 2)
+        assert_true(not result["success"] and result["fallback"]["daily_itinerary"], "配額：不足時改用模板")
+        assert_true(time.time() - start < 0.5, "配額：不足時立即回傳")
+    finally:
+        ItineraryGenerator.result_cache = original_cache
+
+def test_single_flight():
+    """測試相同請求的合併"""
+    print("\n🔗 測試相同請求的合併")
+    
+    from utils.itinerary_generator import ItineraryGenerator
+    from utils.result_cache import ResultCache
+    from utils.single_flight import SingleFlight
+    from utils.stand_in_llm import FakeGeminiModel, StandInConfig
+    
+    def run_concurrently(count, target):
+        results = [None] * count
+        
+        def worker(index):
+            results[index] = target()
+        
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.01)
+        for thread in threads:
+            thread.join()
+        return results
+    
+    # 同時的相同呼叫只執行一次，各自取得深拷貝
+    flight = SingleFlight()
+    calls = []
+    
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return {"days": [1, 2, 3]}
+    
+    results = run_concurrently(5, lambda: flight.do("台北|3", slow))
+    assert_equal(len(calls), 1, "合併：同時的相同呼叫只執行一次")
+    assert_true(all(r == {"days": [1, 2, 3]} for r in results), "合併：每個呼叫取得相同結果")
+    assert_equal(len({id(r) for r in results}), 5, "合併：每個呼叫取得獨立的拷貝")
+    
+    # follower 各自逾時，不影響 leader
+    def leader():
+        return flight.do("台中|2", slow)
+    
+    def follower():
+        time.sleep(0.05)
+        start = time.time()
+        try:
+            flight.do("台中|2", slow, timeout=0.05)
+            return "done"
+        except TimeoutError:
+            return time.time() - start
+    
+    thread_results = [None, None]
+    threads = [
+        threading.Thread(target=lambda: thread_results.__setitem__(0, leader())),
+        threading.Thread(target=lambda: thread_results.__setitem__(1, follower()))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert_true(isinstance(thread_results[1], float) and thread_results[1] < 0.15, "合併：follower 各自逾時")
+    assert_equal(thread_results[0], {"days": [1, 2, 3]}, "合併：follower 逾時不影響 leader")
+    
+    original_cache = ItineraryGenerator.result_cache
+    original_flight = ItineraryGenerator.single_flight
+    ItineraryGenerator.result_cache = ResultCache(max_size=0, ttl=60)
+    ItineraryGenerator.single_flight = SingleFlight()
+    try:
+        # 同時生成相同行程：只送出一次 LLM 請求，修改一份結果不影響其他
+        model = FakeGeminiModel(StandInConfig(latency_mean=0.2))
+        results = run_concurrently(4, lambda: ItineraryGenerator.generate_itinerary(model, "台北", 3))
+        assert_equal(model.responder.stats["requests"], 1, "合併：同時的相同行程只呼叫一次 LLM")
+        assert_true(all(r["success"] and r["data"] == results[0]["data"] for r in results), "合併：每個 session 取得相同行程")
+        results[0]["data"]["daily_itinerary"].clear()
+        assert_true(all(r["data"]["daily_itinerary"] for r in results[1:]), "合併：結果彼此獨立")
+        
+        # 串流：follower 也逐日取得每一天
+        model = FakeGeminiModel(StandInConfig(latency_mean=0.2))
+        streams = run_concurrently(3, lambda: list(ItineraryGenerator.stream_itinerary(model, "台南", 2, None, ["美食"])))
+        assert_equal(model.responder.stats["requests"], 1, "合併：同時的相同串流只呼叫一次 LLM")
+        assert_true(all([p["day"] for e, p in events if e == "day"] == [1, 2] for events in streams), "合併：串流 follower 逐日產出")
+        
+        # leader 在完成前停止：follower 改為自行生成
+        model = FakeGeminiModel(StandInConfig(latency_mean=0.1, token_delay=0.0005))
+        
+        def abandoning_leader():
+            stream = ItineraryGenerator.stream_itinerary(model, "高雄", 2)
+            next(stream)
+            stream.close()
+        
+        def patient_follower():
+            time.sleep(0.05)
+            return ItineraryGenerator.generate_itinerary(model, "高雄", 2)
+        
+        thread_results = [None]
+        threads = [
+            threading.Thread(target=abandoning_leader),
+            threading.Thread(target=lambda: thread_results.__setitem__(0, patient_follower()))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert_true(thread_results[0]["success"] and len(thread_results[0]["data"]["daily_itinerary"]) == 2,
+                    "合併：leader 停止時 follower 自行生成")
+    finally:
+        ItineraryGenerator.result_cache = original_cache
+        ItineraryGenerator.single_flight = original_flight
+
+def test_failure_corpus():
+    """測試解析失敗語料"""
+    print("\n🗃️ 測試解析失敗語料")
+    
+    import gzip
+    import tempfile
+    import replay_failure_corpus
+    from utils.failure_corpus import FailureCorpus
+    from utils.itinerary_generator import ItineraryGenerator
+    from utils.result_cache import ResultCache
+    
+    with tempfile.TemporaryDirectory() as directory:
+        corpus = FailureCorpus(os.path.join(directory, "corpus"), max_bytes=6000, segment_bytes=1500)
+        
+        # 擷取不阻塞；JSONDecodeError 記錄錯誤位置
+        try:
+            json.loads('{"trip_name": "台北" "duration": 3}')
+        except json.JSONDecodeError as e:
+            error = e
+        start = time.time()
+        assert_true(corpus.capture('{"trip_name": "台北" "duration": 3}', prompt="p", error=error, duration=3), "語料：排入佇列")
+        assert_true(time.time() - start < 0.05, "語料：擷取立即返回")
+        assert_true(corpus.flush(), "語料：背景寫入完成")
+        record = next(corpus.records())
+        assert_equal((record["error_pos"], record["lineno"], record["prompt"]), (error.pos, 1, "p"), "語料：記錄錯誤位置與 prompt")
+        
+        # 分段輪替、總量上限內刪除最舊的分段，每個分段都是 gzip
+        for i in range(60):
+            corpus.capture(f"{{\"index\": {i}, \"noise\": \"{os.urandom(200).hex()}\"", duration=2)
+            if i % 5 == 0:
+                corpus.flush()
+        corpus.flush()
+        stats = corpus.stats()
+        assert_true(stats["segments"] > 1, f"語料：依大小輪替（{stats['segments']} 個分段）")
+        assert_true(stats["bytes"] <= 6000 + 1500 + 2000, f"語料：總大小有上限（{stats['bytes']} bytes）")
+        with gzip.open(corpus.segments()[-1], "rt", encoding="utf-8") as f:
+            last = [json.loads(line) for line in f][-1]
+        assert_true('"index": 59' in last["content"], "語料：保留最新的紀錄")
+        
+        # 佇列已滿時捨棄，不阻塞
+        full = FailureCorpus(os.path.join(directory, "full"), queue_size=1)
+        full._ensure_writer = lambda: None
+        assert_true(full.capture("a") and not full.capture("b"), "語料：佇列已滿時捨棄")
+        
+        # 行程生成：無法解析的回應排入語料，不再寫 debug_json_error.txt
+        class GarbageModel:
+            def generate_content(self, prompt, generation_config=None, stream=False):
+                return SimpleNamespace(text='{"trip_name": "台北", "daily_itinerary": [', candidates=None, usage_metadata=None)
+        
+        captured = FailureCorpus(os.path.join(directory, "generator"))
+        original_cache = ItineraryGenerator.result_cache
+        original_corpus = ItineraryGenerator.failure_corpus
+        ItineraryGenerator.result_cache = ResultCache(max_size=0, ttl=60)
+        ItineraryGenerator.failure_corpus = captured
+        try:
+            result = ItineraryGenerator.generate_itinerary(GarbageModel(), "台北", 2)
+            captured.flush()
+            records = list(captured.records())
+            assert_true(not result["success"] and len(records) == 1, "語料：生成失敗時擷取原始回應")
+            assert_true(records[0]["location"] == "台北" and "台北" in records[0]["prompt"], "語料：記錄請求與 prompt")
+        finally:
+            ItineraryGenerator.result_cache = original_cache
+            ItineraryGenerator.failure_corpus = original_corpus
+        
+        # 重播：以修復引擎重新解析並回報救回率
+        itinerary = ItineraryGenerator._create_fallback_itinerary("台南", 2, None)
+        text = json.dumps(itinerary, ensure_ascii=False, indent=2)
+        replayed = replay_failure_corpus.replay([
+            {"content": text[:text.index('"day": 2')], "duration": 2},
+            {"content": text, "duration": 2},
+            {"content": "!!!!", "duration": 2}
+        ])
+        assert_equal((replayed["corpus_size"], round(replayed["recovery_rate"], 2), round(replayed["complete_rate"], 2)),
+                     (3, 0.67, 0.33), "語料：重播回報救回率與完整率")
+        assert_true(replayed["parse_ms"]["max"] > 0, "語料：重播回報解析時間")
+
 # === 邊界測試 ===
 def test_edge_cases():
     """測試邊界情況"""
@@ -442,6 +1812,11 @@ def test_edge_cases():
     result = TripInfoCollector._rule_extract("預算100")
     budget = result.get("other_requirements", {}).get("budget")
     assert_equal(budget, None, "無效預算：不提取")
+    
+    # 日期與年份不是天數或預算
+    result = TripInfoCollector._rule_extract("2025年12月3日出發")
+    assert_equal(result.get("duration"), None, "日期：不當作天數")
+    assert_equal(result.get("other_requirements", {}).get("budget"), None, "年份：不當作預算")
 
 # === 性能測試 ===
 def test_performance():
@@ -592,6 +1967,7 @@ def run_all_tests():
     test_extract_trip_type()
     test_extract_preferences()
     test_extract_special_needs()
+    test_keyword_matcher()
     
     # 整合測試
     print("\n🔄 整合測試")
@@ -601,6 +1977,28 @@ def run_all_tests():
     test_is_complete()
     test_follow_up_question()
     test_format_display()
+    test_extract_info_batch()
+    test_llm_cache()
+    test_async_extraction()
+    test_garbage_detection()
+    test_follow_up_cache()
+    test_circuit_breaker()
+    test_speculative_itinerary()
+    test_benchmark_gate()
+    test_stand_in_server()
+    test_streaming_itinerary()
+    test_json_repair()
+    test_parallel_itinerary()
+    test_itinerary_cache()
+    test_semantic_cache()
+    test_template_index()
+    test_token_planner()
+    test_compact_schema()
+    test_hedged_generation()
+    test_truncation_continuation()
+    test_quota_scheduler()
+    test_single_flight()
+    test_failure_corpus()
     
     # 邊界測試
     print("\n🔬 邊界測試")
@@ -0,0 +1,130 @@
+"""
+斷路器模組
+vLLM 過載時連續失敗或回傳垃圾，斷路器開啟後在冷卻期間直接跳過 LLM，
+冷卻結束後只放行一個探測請求（半開），成功才恢復
+"""
+
+import threading
+import time
+from collections import deque
+
+
+class CircuitBreaker:
+    """三態斷路器（closed → open → half_open → closed）"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=3, window=60, cooldown=30, clock=time.monotonic):
+        """
+        初始化斷路器
+
+        Args:
+            failure_threshold: 視窗內連續失敗幾次後開啟
+            window: 計算連續失敗的時間視窗（秒）
+            cooldown: 開啟後跳過請求的冷卻時間（秒）
+            clock: 取得目前時間的函式（測試時可替換）
+        """
+        self.failure_threshold = failure_threshold
+        self.window = window
+        self.cooldown = cooldown
+        self._clock = clock
+
+        self._state = self.CLOSED
+        self._failures = deque()  # 連續失敗的時間戳
+        self._opened_at = None
+        self._probe_started_at = None
+        self._lock = threading.Lock()
+
+        self.rejected = 0
+        self.trips = 0
+
+    # === 公開介面 ===
+
+    def allow_request(self):
+        """
+        是否放行這次請求
+
+        開啟狀態下冷卻結束後轉為半開，只放行一個探測請求；
+        探測請求若超過冷卻時間仍未回報（例如被取消），再放行下一個
+        """
+        with self._lock:
+            now = self._clock()
+
+            if self._state == self.CLOSED:
+                return True
+
+            if self._state == self.OPEN and now - self._opened_at >= self.cooldown:
+                self._state = self.HALF_OPEN
+                self._probe_started_at = None
+
+            if self._state == self.HALF_OPEN:
+                if self._probe_started_at is None or now - self._probe_started_at >= self.cooldown:
+                    self._probe_started_at = now
+                    return True
+
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        """回報成功：清除失敗紀錄並關閉"""
+        with self._lock:
+            self._failures.clear()
+            self._state = self.CLOSED
+            self._opened_at = None
+            self._probe_started_at = None
+
+    def record_failure(self):
+        """回報失敗（錯誤、逾時或垃圾回應）"""
+        with self._lock:
+            now = self._clock()
+
+            if self._state == self.HALF_OPEN:
+                self._open(now)
+                return
+
+            self._failures.append(now)
+            while self._failures and now - self._failures[0] > self.window:
+                self._failures.popleft()
+
+            if self._state == self.CLOSED and len(self._failures) >= self.failure_threshold:
+                self._open(now)
+
+    def reset(self):
+        """手動重設為關閉狀態並清除統計"""
+        self.record_success()
+        with self._lock:
+            self.rejected = 0
+            self.trips = 0
+
+    @property
+    def state(self):
+        """目前狀態（冷卻結束但尚未有請求時回報 half_open）"""
+        with self._lock:
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self.cooldown:
+                return self.HALF_OPEN
+            return self._state
+
+    def stats(self):
+        """取得狀態與統計"""
+        state = self.state
+        with self._lock:
+            remaining = 0.0
+            if state == self.OPEN:
+                remaining = max(0.0, self.cooldown - (self._clock() - self._opened_at))
+
+            return {
+                "state": state,
+                "failures": len(self._failures),
+                "rejected": self.rejected,
+                "trips": self.trips,
+                "cooldown_remaining": remaining
+            }
+
+    def _open(self, now):
+        self._state = self.OPEN
+        self._opened_at = now
+        self._probe_started_at = None
+        self._failures.clear()
+        self.trips += 1
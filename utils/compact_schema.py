@@ -0,0 +1,89 @@
+"""
+精簡行程輸出格式
+每個活動以固定順序的陣列（位置元組）表示，不再重複 "time"、"name" 等鍵名，
+減少約三成以上的輸出 token。回應頂層的 activity_fields 為欄位圖例；
+解碼後還原成原本的 dict 結構，之後的流程（convert_to_trip_format 等）不需要改變
+"""
+
+ACTIVITY_FIELDS = ("time", "name", "type", "location", "duration", "cost", "note", "icon")
+LEGEND_KEY = "activity_fields"
+
+# 至少要有到 cost 的欄位才視為完整的活動（note、icon 可省略；更短的通常是截斷的半個活動）
+_MIN_FIELDS = ACTIVITY_FIELDS.index("cost") + 1
+
+_DEFAULTS = {"cost": 0, "note": "", "icon": "📍"}
+
+
+def is_compact(itinerary):
+    """是否為精簡格式（有圖例，或任一活動是陣列）"""
+    if not isinstance(itinerary, dict):
+        return False
+    if LEGEND_KEY in itinerary:
+        return True
+    return any(
+        isinstance(activity, list)
+        for day in itinerary.get("daily_itinerary", []) if isinstance(day, dict)
+        for activity in day.get("activities", [])
+    )
+
+
+def expand_activity(row, fields=ACTIVITY_FIELDS):
+    """
+    位置元組 → 活動 dict（已是 dict 則原樣回傳）
+
+    Returns:
+        dict: 活動；欄位不足（截斷）時回傳 None
+    """
+    if isinstance(row, dict):
+        return row
+    if not isinstance(row, list) or len(row) < min(_MIN_FIELDS, len(fields)):
+        return None
+
+    activity = {field: _DEFAULTS.get(field, "") for field in fields}
+    activity.update(zip(fields, row))
+
+    if "cost" in activity and not isinstance(activity["cost"], (int, float)):
+        digits = "".join(char for char in str(activity["cost"]) if char.isdigit())
+        activity["cost"] = int(digits) if digits else 0
+
+    return activity
+
+
+def expand_day(day, fields=ACTIVITY_FIELDS):
+    """展開單日行程的活動（不修改傳入的 dict）"""
+    if not isinstance(day, dict) or not any(isinstance(a, list) for a in day.get("activities", [])):
+        return day
+
+    activities = [expand_activity(row, fields) for row in day["activities"]]
+    return dict(day, activities=[activity for activity in activities if activity is not None])
+
+
+def expand_itinerary(itinerary):
+    """
+    精簡格式 → 原本的行程結構（依圖例對應欄位，沒有圖例時使用預設順序）
+
+    展開後沒有任何完整活動的天會被捨棄
+    """
+    if not is_compact(itinerary):
+        return itinerary
+
+    legend = itinerary.get(LEGEND_KEY)
+    fields = tuple(legend) if isinstance(legend, list) and legend else ACTIVITY_FIELDS
+
+    expanded = {key: value for key, value in itinerary.items() if key != LEGEND_KEY}
+    days = [expand_day(day, fields) for day in itinerary.get("daily_itinerary", [])]
+    expanded["daily_itinerary"] = [day for day in days if isinstance(day, dict) and day.get("activities")]
+    return expanded
+
+
+def compact_itinerary(itinerary, fields=ACTIVITY_FIELDS):
+    """原本的行程結構 → 精簡格式（替身伺服器與測試用）"""
+    compact = {LEGEND_KEY: list(fields)}
+    for key, value in itinerary.items():
+        if key == "daily_itinerary":
+            value = [
+                dict(day, activities=[[activity.get(field, "") for field in fields] for activity in day.get("activities", [])])
+                for day in value
+            ]
+        compact[key] = value
+    return compact
@@ -0,0 +1,170 @@
+"""
+解析失敗語料
+行程回應無法解析時，將原始回應、prompt 與錯誤位置放進佇列，由背景執行緒
+批次寫入壓縮的語料目錄（不阻塞請求執行緒，也不互相覆蓋）。
+語料依大小輪替並有總量上限，可用 replay_failure_corpus.py 重播，
+量測修復引擎對真實失敗案例的救回率與解析時間
+"""
+
+import glob
+import gzip
+import json
+import os
+import queue
+import threading
+import time
+
+
+class FailureCorpus:
+    """有上限、非阻塞的失敗語料（gzip 壓縮的 JSON Lines 分段檔）"""
+
+    def __init__(self, directory, max_bytes=20 * 1024 * 1024, segment_bytes=1024 * 1024, queue_size=256):
+        """
+        Args:
+            directory: 語料目錄
+            max_bytes: 語料總大小上限（超過時刪除最舊的分段）
+            segment_bytes: 單一分段的大小（超過時換新的分段）
+            queue_size: 等待寫入的筆數上限（佇列滿時捨棄新的紀錄，不阻塞呼叫端）
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._writer = None
+        self._segment = None
+
+        self.captured = 0
+        self.dropped = 0
+        self.written = 0
+
+    # === 擷取（請求執行緒）===
+
+    def capture(self, content, prompt=None, error=None, **metadata):
+        """
+        將一次失敗放進寫入佇列（立即返回）
+
+        Args:
+            content: 原始回應
+            prompt: 送出的 prompt
+            error: 解析時的例外（JSONDecodeError 會記錄錯誤位置）
+            metadata: 其他資訊（地點、天數等）
+
+        Returns:
+            bool: 是否成功排入佇列（佇列已滿時捨棄並回傳 False）
+        """
+        record = {
+            "captured_at": time.time(),
+            "error_type": type(error).__name__ if error is not None else None,
+            "error": str(error) if error is not None else None,
+            "error_pos": getattr(error, "pos", None),
+            "lineno": getattr(error, "lineno", None),
+            "colno": getattr(error, "colno", None),
+            "content": content,
+            "prompt": prompt,
+            **metadata
+        }
+
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+        with self._lock:
+            self.captured += 1
+        return True
+
+    def flush(self, timeout=5.0):
+        """等待佇列中的紀錄寫完（測試與重播前使用）"""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    # === 背景寫入 ===
+
+    def _ensure_writer(self):
+        with self._lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._run, name="failure-corpus-writer", daemon=True)
+                self._writer.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self._write(batch)
+            except (OSError, TypeError, ValueError) as e:
+                print(f"⚠️ 失敗語料寫入失敗: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch):
+        """整批壓縮成一個 gzip 成員附加到目前的分段（中斷時最多損失最後一批）"""
+        os.makedirs(self.directory, exist_ok=True)
+
+        if self._segment is None or not os.path.exists(self._segment) or os.path.getsize(self._segment) >= self.segment_bytes:
+            self._segment = os.path.join(self.directory, f"failures-{time.time_ns()}.jsonl.gz")
+
+        lines = "".join(json.dumps(record, ensure_ascii=False, default=str) + "\n" for record in batch)
+        with open(self._segment, "ab") as f:
+            f.write(gzip.compress(lines.encode("utf-8")))
+
+        with self._lock:
+            self.written += len(batch)
+        self._enforce_limit()
+
+    def _enforce_limit(self):
+        """刪除最舊的分段直到總大小不超過上限（目前寫入中的分段保留）"""
+        segments = self.segments()
+        sizes = {path: os.path.getsize(path) for path in segments}
+        total = sum(sizes.values())
+        for path in segments:
+            if total <= self.max_bytes or path == self._segment:
+                break
+            os.remove(path)
+            total -= sizes[path]
+
+    # === 讀取 ===
+
+    def segments(self):
+        """分段檔（由舊到新）"""
+        return sorted(glob.glob(os.path.join(self.directory, "failures-*.jsonl.gz")))
+
+    def records(self):
+        """依序讀出所有紀錄（略過寫到一半的分段結尾與損毀的行）"""
+        for path in self.segments():
+            try:
+                with gzip.open(path, "rt", encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            yield json.loads(line)
+                        except json.JSONDecodeError:
+                            continue
+            except (OSError, EOFError):
+                continue
+
+    def stats(self):
+        segments = self.segments()
+        with self._lock:
+            return {
+                "captured": self.captured,
+                "dropped": self.dropped,
+                "written": self.written,
+                "pending": self._queue.qsize(),
+                "segments": len(segments),
+                "bytes": sum(os.path.getsize(path) for path in segments)
+            }
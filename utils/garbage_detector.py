@@ -0,0 +1,88 @@
+"""
+垃圾輸出偵測器
+vLLM 過載時會回傳大量重複字元（例如 !!!!!!!!），串流時邊收邊檢查，
+一旦確定是垃圾就提前中止，不必等到 max_tokens 生成完畢
+"""
+
+import math
+from collections import Counter
+
+
+class GarbageDetector:
+    """串流垃圾輸出偵測（重複字元比例 + 字元 bigram 熵）"""
+
+    def __init__(self, min_chars=8, max_char_ratio=0.5, entropy_chars=16, min_entropy=1.5):
+        """
+        Args:
+            min_chars: 至少收到幾個字元才判斷重複比例
+            max_char_ratio: 單一字元佔比上限
+            entropy_chars: 至少收到幾個字元才判斷 bigram 熵
+            min_entropy: bigram 熵下限（bits）
+        """
+        self.min_chars = min_chars
+        self.max_char_ratio = max_char_ratio
+        self.entropy_chars = entropy_chars
+        self.min_entropy = min_entropy
+
+        self._chars = Counter()
+        self._bigrams = Counter()
+        self._total = 0
+        self._meaningful = 0
+        self._previous = None
+        self.reason = None
+
+    def feed(self, text):
+        """
+        加入新收到的文字
+
+        Returns:
+            bool: 是否已判定為垃圾輸出
+        """
+        if self.reason:
+            return True
+
+        for char in text:
+            if char.isspace():
+                continue
+
+            self._chars[char] += 1
+            self._total += 1
+            if char.isalnum():
+                self._meaningful += 1
+
+            if self._previous is not None:
+                self._bigrams[self._previous + char] += 1
+            self._previous = char
+
+        self.reason = self._check()
+        return self.reason is not None
+
+    def _check(self):
+        if self._total >= 3 and self._meaningful == 0:
+            return "只有符號"
+
+        if self._total >= self.min_chars:
+            top_count = self._chars.most_common(1)[0][1]
+            if top_count > self._total * self.max_char_ratio:
+                return f"重複字元比例 {top_count / self._total:.0%}"
+
+        if self._total >= self.entropy_chars:
+            bigram_total = sum(self._bigrams.values())
+            entropy = -sum(
+                count / bigram_total * math.log2(count / bigram_total)
+                for count in self._bigrams.values()
+            )
+            if entropy < self.min_entropy:
+                return f"bigram 熵過低 ({entropy:.2f} bits)"
+
+        return None
+
+    @property
+    def is_garbage(self):
+        return self.reason is not None
+
+    @staticmethod
+    def check(text):
+        """檢查完整文字是否為垃圾輸出"""
+        detector = GarbageDetector()
+        return detector.feed(text)
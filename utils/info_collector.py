@@ -1,7 +1,153 @@
+import asyncio
+import inspect
 import json
-import re
+import random
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 
+from utils import quantity_lexer
+from utils.circuit_breaker import CircuitBreaker
+from utils.garbage_detector import GarbageDetector
+from utils.keyword_matcher import KeywordMatcher
+from utils.result_cache import ResultCache
+
+# 同步 client 的阻塞呼叫在此執行緒池中進行
+_SYNC_CLIENT_EXECUTOR = ThreadPoolExecutor(max_workers=16, thread_name_prefix="vllm-sync")
+
+# 同步包裝共用的常駐事件迴圈（AsyncOpenAI 的連線綁定建立時的迴圈，每次換新迴圈會留下失效的連線）
+_SYNC_LOOP = None
+_SYNC_LOOP_LOCK = threading.Lock()
+
+# 追問庫的讀改寫需互斥（預熱與對話可能同時寫入）
+_FOLLOW_UP_LOCK = threading.Lock()
+
+
+def _sync_loop():
+    """取得（必要時啟動）常駐事件迴圈執行緒"""
+    global _SYNC_LOOP
+    with _SYNC_LOOP_LOCK:
+        if _SYNC_LOOP is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="vllm-loop", daemon=True).start()
+            _SYNC_LOOP = loop
+        return _SYNC_LOOP
+
+
+def _run_sync(coroutine):
+    """
+    在同步程式中執行協程
+
+    所有呼叫交給同一個常駐事件迴圈，同一個 AsyncOpenAI client 可以跨呼叫重複使用；
+    從常駐迴圈內部呼叫時等待自己會死結，改在新執行緒執行
+    """
+    loop = _sync_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    
+    if running is loop:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, coroutine).result()
+    return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+
+def _chunk_text(chunk):
+    """取出串流 chunk 的文字內容"""
+    if not chunk.choices:
+        return ""
+    return chunk.choices[0].delta.content or ""
+
+
+async def _aclose_stream(stream):
+    """關閉串流（AsyncStream.close 為協程，Stream.close 為一般函式）"""
+    close = getattr(stream, "close", None)
+    if close is not None:
+        result = close()
+        if inspect.isawaitable(result):
+            await result
+
+
+def _consume_stream(stream, cancelled):
+    """在背景執行緒讀取同步串流，偵測到垃圾或被取消時立即關閉"""
+    detector = GarbageDetector()
+    parts = []
+    
+    try:
+        for chunk in stream:
+            if cancelled.is_set():
+                break
+            
+            text = _chunk_text(chunk)
+            if not text:
+                continue
+            
+            parts.append(text)
+            if detector.feed(text):
+                break
+    finally:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+    
+    return "".join(parts), detector.reason
+
+
+async def _astream_completion(client, timeout, **kwargs):
+    """
+    以串流呼叫 chat.completions.create，邊收邊做垃圾偵測
+    
+    AsyncOpenAI 直接 await；同步的 OpenAI client 改在背景執行緒執行，
+    不佔用事件迴圈。逾時或被取消時，await 端會立即返回並關閉串流；
+    timeout 也傳給 create，卡在連線或等待下一個 chunk 的同步呼叫會由 HTTP client 結束，
+    不會佔住執行緒池直到 openai 預設的 600 秒逾時
+    
+    Returns:
+        tuple: (已收到的文字, 垃圾原因或 None)
+    """
+    create = client.chat.completions.create
+    
+    # openai 的 create 外層有同步裝飾器，需 unwrap 才看得出是否為協程函式
+    if inspect.iscoroutinefunction(inspect.unwrap(create)):
+        async def consume():
+            stream = await create(stream=True, timeout=timeout, **kwargs)
+            detector = GarbageDetector()
+            parts = []
+            
+            try:
+                async for chunk in stream:
+                    text = _chunk_text(chunk)
+                    if not text:
+                        continue
+                    
+                    parts.append(text)
+                    if detector.feed(text):
+                        break
+            finally:
+                await _aclose_stream(stream)
+            
+            return "".join(parts), detector.reason
+        
+        return await asyncio.wait_for(consume(), timeout)
+    
+    # 使用獨立執行緒池：asyncio.run 結束時不會等待逾時的請求
+    cancelled = threading.Event()
+    
+    def consume_sync():
+        return _consume_stream(create(stream=True, timeout=timeout, **kwargs), cancelled)
+    
+    loop = asyncio.get_running_loop()
+    try:
+        return await asyncio.wait_for(
+            loop.run_in_executor(_SYNC_CLIENT_EXECUTOR, consume_sync),
+            timeout
+        )
+    finally:
+        cancelled.set()
+
+
 class TripInfoCollector:
     """旅遊資訊收集器（規則 + LLM 混合版）"""
     
@@ -17,14 +163,82 @@ class TripInfoCollector:
         "一個人旅行", "蜜月旅行", "親子旅遊", "員工旅遊"
     ]
     
+    # === 規則提取詞彙表（匯入時編譯成單一自動機）===
+    CITIES = [
+        "台北", "台南", "高雄", "花蓮", "台中", "墾丁", "台東", "宜蘭",
+        "南投", "嘉義", "彰化", "新竹", "基隆", "桃園", "苗栗", "雲林",
+        "屏東", "澎湖", "金門", "馬祖", "綠島", "蘭嶼", "日月潭", "阿里山",
+        "九份", "太魯閣", "清境", "合歡山"
+    ]
+    
+    TRIP_TYPE_KEYWORDS = {
+        "家族旅遊": ["家族", "家人", "爸媽", "父母", "長輩"],
+        "畢業旅行": ["畢業", "畢旅", "同學"],
+        "情侶出遊": ["情侶", "男友", "女友", "兩個人", "約會"],
+        "朋友聚會": ["朋友", "好友", "閨蜜", "兄弟"],
+        "一個人旅行": ["一個人", "自己", "solo", "獨自"],
+        "蜜月旅行": ["蜜月", "新婚", "結婚"],
+        "親子旅遊": ["親子", "小孩", "孩子", "寶寶", "兒童"],
+        "員工旅遊": ["員工", "公司", "團體", "員旅"]
+    }
+    
+    PREFERENCE_KEYWORDS = {
+        "美食": ["美食", "吃", "小吃", "餐廳", "夜市", "美味"],
+        "自然": ["自然", "風景", "山", "海", "戶外", "大自然", "風光"],
+        "文化": ["文化", "歷史", "古蹟", "博物館", "廟宇", "老街"],
+        "放鬆": ["放鬆", "慢活", "悠閒", "休息", "度假", "舒壓"],
+        "冒險": ["冒險", "刺激", "挑戰", "極限", "運動"],
+        "購物": ["購物", "買", "逛街", "商圈", "百貨"],
+        "拍照": ["拍照", "打卡", "網美", "攝影", "IG"]
+    }
+    
+    SPECIAL_NEEDS_KEYWORDS = {
+        "需要無障礙設施": ["輪椅", "行動不便", "無障礙"],
+        "素食": ["素食", "吃素", "vegetarian"],
+        "攜帶寵物": ["寵物", "狗", "貓", "毛小孩"],
+        "有小孩同行": ["小孩", "孩子", "baby", "寶寶", "嬰兒"]
+    }
+    
+    # === 單次 LLM 呼叫逾時（秒）===
+    LLM_TIMEOUT = 20
+    
+    # === LLM 提取快取（可在頁面中換成帶 SQLite 磁碟層的實例）===
+    llm_cache = ResultCache(max_size=1024, ttl=7 * 24 * 3600, table="llm_extract")
+    
+    # === vLLM 斷路器（連續失敗或垃圾回應時暫時跳過 LLM）===
+    llm_breaker = CircuitBreaker(failure_threshold=3, window=60, cooldown=30)
+    
+    # === 追問預熱專用斷路器（預熱失敗不影響線上請求的斷路器）===
+    warm_breaker = CircuitBreaker(failure_threshold=3, window=60, cooldown=300)
+    
+    # === 追問庫（情境簽章 → 預先生成的追問變體）===
+    FOLLOW_UP_VARIANTS = 3
+    follow_up_cache = ResultCache(max_size=512, ttl=30 * 24 * 3600, table="follow_up")
+    
     @staticmethod
-    def extract_info_from_message(message, vllm_client=None):
+    def extract_info_from_message(message, vllm_client=None, timeout=None):
         """
-        智能提取：規則優先，LLM 輔助
+        智能提取：規則優先，LLM 輔助（aextract_info_from_message 的同步包裝）
         
         Args:
             message: 用戶訊息
             vllm_client: vLLM client（可選）
+            timeout: LLM 呼叫逾時秒數（預設 LLM_TIMEOUT）
+            
+        Returns:
+            dict: 提取的資訊
+        """
+        return _run_sync(TripInfoCollector.aextract_info_from_message(message, vllm_client, timeout))
+    
+    @staticmethod
+    async def aextract_info_from_message(message, vllm_client=None, timeout=None):
+        """
+        非同步智能提取：規則優先，LLM 輔助
+        
+        Args:
+            message: 用戶訊息
+            vllm_client: AsyncOpenAI 或 OpenAI client（可選）
+            timeout: LLM 呼叫逾時秒數（預設 LLM_TIMEOUT），逾時則使用規則結果
             
         Returns:
             dict: 提取的資訊
@@ -50,21 +264,14 @@ class TripInfoCollector:
         print("🤖 規則提取不完整，使用 LLM 輔助...")
         
         try:
-            llm_result = TripInfoCollector._llm_extract(
+            llm_result = await TripInfoCollector._acached_llm_extract(
                 vllm_client, 
                 message, 
-                rule_extracted
+                rule_extracted,
+                timeout
             )
             
-            # 合併結果：規則優先
-            final_result = {**llm_result, **rule_extracted}
-            
-            # 確保 other_requirements 合併
-            if "other_requirements" in llm_result or "other_requirements" in rule_extracted:
-                final_result["other_requirements"] = {
-                    **llm_result.get("other_requirements", {}),
-                    **rule_extracted.get("other_requirements", {})
-                }
+            final_result = TripInfoCollector._combine_results(rule_extracted, llm_result)
             
             print("✅ LLM 輔助完成")
             return final_result
@@ -74,141 +281,172 @@ class TripInfoCollector:
             return rule_extracted
     
     @staticmethod
-    def _rule_extract(message):
-        """純規則提取（快速、穩定）"""
-        extracted = {
-            "other_requirements": {}
-        }
-        
-        # === 1. 提取地點 ===
-        cities = [
-            "台北", "台南", "高雄", "花蓮", "台中", "墾丁", "台東", "宜蘭",
-            "南投", "嘉義", "彰化", "新竹", "基隆", "桃園", "苗栗", "雲林",
-            "屏東", "澎湖", "金門", "馬祖", "綠島", "蘭嶼", "日月潭", "阿里山",
-            "九份", "太魯閣", "清境", "合歡山"
-        ]
-        
-        for city in cities:
-            if city in message:
-                extracted["location"] = city
-                break
-        
-        # === 2. 提取天數 ===
-        duration_patterns = [
-            r'(\d+)\s*天',
-            r'(\d+)\s*日'
-        ]
+    def extract_info_batch(messages, vllm_client=None, max_concurrency=4):
+        """
+        批次提取：先對全部訊息跑規則，只有缺地點或天數的訊息才送 LLM
         
-        for pattern in duration_patterns:
-            match = re.search(pattern, message)
-            if match:
-                extracted["duration"] = int(match.group(1))
-                break
+        Args:
+            messages: 用戶訊息列表
+            vllm_client: vLLM client（可選）
+            max_concurrency: 同時進行的 LLM 請求上限
+            
+        Returns:
+            list[dict]: 與輸入順序相同的提取結果
+        """
+        results = [TripInfoCollector._rule_extract(message) for message in messages]
         
-        # 特殊處理：X天Y夜
-        if "天" in message and "夜" in message:
-            match = re.search(r'(\d+)\s*天\s*(\d+)\s*夜', message)
-            if match:
-                extracted["duration"] = int(match.group(1))
-        
-        # === 3. 提取人數 ===
-        people_patterns = [
-            r'(\d+)\s*人',
-            r'(\d+)\s*位',
-            r'(一|兩|二|三|四|五|六|七|八|九|十)人'
+        pending = [
+            index for index, result in enumerate(results)
+            if result.get("location") is None or result.get("duration") is None
         ]
         
-        chinese_numbers = {
-            '一': 1, '兩': 2, '二': 2, '三': 3, '四': 4, 
-            '五': 5, '六': 6, '七': 7, '八': 8, '九': 9, '十': 10
-        }
+        print(f"📦 批次提取 {len(messages)} 則，{len(pending)} 則需要 LLM 輔助")
         
-        for pattern in people_patterns:
-            match = re.search(pattern, message)
-            if match:
-                num = match.group(1)
-                if num in chinese_numbers:
-                    extracted["other_requirements"]["people"] = chinese_numbers[num]
-                else:
-                    extracted["other_requirements"]["people"] = int(num)
-                break
+        if vllm_client is None or not pending:
+            return results
         
-        # === 4. 提取預算 ===
-        if "萬" in message:
-            budget_match = re.search(r'(\d+(?:\.\d+)?)\s*萬', message)
-            if budget_match:
-                extracted["other_requirements"]["budget"] = int(float(budget_match.group(1)) * 10000)
-        elif re.search(r'\d{4,}', message):
-            budget_match = re.search(r'(\d{4,})', message)
-            if budget_match:
-                extracted["other_requirements"]["budget"] = int(budget_match.group(1))
-        
-        # === 5. 提取旅遊類型 ===
-        trip_type_keywords = {
-            "家族旅遊": ["家族", "家人", "爸媽", "父母", "長輩"],
-            "畢業旅行": ["畢業", "畢旅", "同學"],
-            "情侶出遊": ["情侶", "男友", "女友", "兩個人", "約會"],
-            "朋友聚會": ["朋友", "好友", "閨蜜", "兄弟"],
-            "一個人旅行": ["一個人", "自己", "solo", "獨自"],
-            "蜜月旅行": ["蜜月", "新婚", "結婚"],
-            "親子旅遊": ["親子", "小孩", "孩子", "寶寶", "兒童"],
-            "員工旅遊": ["員工", "公司", "團體", "員旅"]
-        }
+        workers = max(1, min(max_concurrency, len(pending)))
         
-        for trip_type, keywords in trip_type_keywords.items():
-            if any(keyword in message for keyword in keywords):
-                extracted["other_requirements"]["trip_type"] = trip_type
-                break
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(
+                    TripInfoCollector._cached_llm_extract,
+                    vllm_client,
+                    messages[index],
+                    results[index]
+                ): index
+                for index in pending
+            }
+            
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    llm_result = future.result()
+                except Exception as e:
+                    print(f"❌ LLM 失敗: {e}，使用規則結果")
+                    continue
+                
+                results[index] = TripInfoCollector._combine_results(results[index], llm_result)
         
-        # === 6. 提取偏好 ===
-        preference_keywords = {
-            "美食": ["美食", "吃", "小吃", "餐廳", "夜市", "美味"],
-            "自然": ["自然", "風景", "山", "海", "戶外", "大自然", "風光"],
-            "文化": ["文化", "歷史", "古蹟", "博物館", "廟宇", "老街"],
-            "放鬆": ["放鬆", "慢活", "悠閒", "休息", "度假", "舒壓"],
-            "冒險": ["冒險", "刺激", "挑戰", "極限", "運動"],
-            "購物": ["購物", "買", "逛街", "商圈", "百貨"],
-            "拍照": ["拍照", "打卡", "網美", "攝影", "IG"]
+        return results
+    
+    @staticmethod
+    def _combine_results(rule_extracted, llm_result):
+        """合併規則與 LLM 結果（規則優先）"""
+        final_result = {**llm_result, **rule_extracted}
+        
+        # 確保 other_requirements 合併
+        if "other_requirements" in llm_result or "other_requirements" in rule_extracted:
+            final_result["other_requirements"] = {
+                **llm_result.get("other_requirements", {}),
+                **rule_extracted.get("other_requirements", {})
+            }
+        
+        return final_result
+    
+    @staticmethod
+    def _rule_extract(message):
+        """純規則提取（快速、穩定）"""
+        extracted = {
+            "other_requirements": {}
         }
         
-        preferences = []
-        for pref, keywords in preference_keywords.items():
-            if any(keyword in message for keyword in keywords):
-                preferences.append(pref)
+        # === 1. 單次掃描：地點、旅遊類型、偏好、特殊需求 ===
+        location = None
+        trip_type = None
+        preferences = {}
+        special_needs = {}
+        
+        for _, _, (category, label, priority) in _KEYWORD_MATCHER.iter_matches(message):
+            if category == "location":
+                if location is None or priority < location[0]:
+                    location = (priority, label)
+            elif category == "trip_type":
+                if trip_type is None or priority < trip_type[0]:
+                    trip_type = (priority, label)
+            elif category == "preference":
+                preferences[label] = priority
+            else:
+                special_needs[label] = priority
+        
+        if location:
+            extracted["location"] = location[1]
+        
+        # === 2. 天數 / 人數 / 預算（數量詞法分析，取第一個出現的 token）===
+        quantities = {}
+        for token in quantity_lexer.tokenize(message):
+            quantities.setdefault(token.kind, token.value)
+        
+        if "duration" in quantities:
+            extracted["duration"] = quantities["duration"]
+        
+        if "people" in quantities:
+            extracted["other_requirements"]["people"] = quantities["people"]
+        
+        if "budget" in quantities:
+            extracted["other_requirements"]["budget"] = quantities["budget"]
+        
+        # === 3. 旅遊類型 / 偏好 / 特殊需求（已於步驟 1 掃描）===
+        if trip_type:
+            extracted["other_requirements"]["trip_type"] = trip_type[1]
         
         if preferences:
-            extracted["other_requirements"]["preferences"] = preferences
+            extracted["other_requirements"]["preferences"] = sorted(preferences, key=preferences.get)
         
-        # === 7. 提取特殊需求 ===
-        special_needs = []
-        
-        if any(word in message for word in ["輪椅", "行動不便", "無障礙"]):
-            special_needs.append("需要無障礙設施")
+        if special_needs:
+            extracted["other_requirements"]["special_needs"] = sorted(special_needs, key=special_needs.get)
         
-        if any(word in message for word in ["素食", "吃素", "vegetarian"]):
-            special_needs.append("素食")
+        # === 4. 保存原始輸入 ===
+        extracted["other_requirements"]["raw_input"] = message
         
-        if any(word in message for word in ["寵物", "狗", "貓", "毛小孩"]):
-            special_needs.append("攜帶寵物")
+        return extracted
+    
+    @staticmethod
+    def _llm_cache_key(message, rule_result):
+        """快取鍵：正規化訊息 + 規則已找到的欄位"""
+        normalized = " ".join(unicodedata.normalize("NFKC", message).lower().split())
+        found = [field for field in TripInfoCollector.REQUIRED_FIELDS if rule_result.get(field) is not None]
+        return f"{','.join(found)}|{normalized}"
+    
+    @staticmethod
+    def _cached_llm_extract(vllm_client, message, rule_result, timeout=None):
+        """_acached_llm_extract 的同步包裝"""
+        return _run_sync(TripInfoCollector._acached_llm_extract(vllm_client, message, rule_result, timeout))
+    
+    @staticmethod
+    async def _acached_llm_extract(vllm_client, message, rule_result, timeout=None):
+        """先查快取，未命中才呼叫 LLM（只快取有內容的結果）"""
+        cache = TripInfoCollector.llm_cache
+        key = TripInfoCollector._llm_cache_key(message, rule_result)
         
-        if any(word in message for word in ["小孩", "孩子", "baby", "寶寶", "嬰兒"]):
-            special_needs.append("有小孩同行")
+        cached = cache.get(key)
+        if cached is not None:
+            print(f"⚡ LLM 快取命中：{cached}")
+            return cached
         
-        if special_needs:
-            extracted["other_requirements"]["special_needs"] = special_needs
+        llm_result = await TripInfoCollector._allm_extract(vllm_client, message, rule_result, timeout)
         
-        # === 8. 保存原始輸入 ===
-        extracted["other_requirements"]["raw_input"] = message
+        if llm_result:
+            cache.set(key, llm_result)
         
-        return extracted
+        return llm_result
+    
+    @staticmethod
+    def _llm_extract(vllm_client, message, rule_result, timeout=None):
+        """LLM 輔助提取（_allm_extract 的同步包裝）"""
+        return _run_sync(TripInfoCollector._allm_extract(vllm_client, message, rule_result, timeout))
     
     @staticmethod
-    def _llm_extract(vllm_client, message, rule_result):
+    async def _allm_extract(vllm_client, message, rule_result, timeout=None):
         """
         LLM 輔助提取（只提取規則沒找到的）
         
         重要：讓 LLM 專注於「理解意圖」，不要做結構化輸出
         """
+        breaker = TripInfoCollector.llm_breaker
+        if not breaker.allow_request():
+            print("🔌 vLLM 斷路器開啟，跳過 LLM，使用規則結果")
+            return {}
         
         # 構建簡單的 Prompt
         has_location = rule_result.get("location") is not None
@@ -270,7 +508,9 @@ Examples:
 Number of days:"""
         
         try:
-            response = vllm_client.chat.completions.create(
+            content, garbage_reason = await _astream_completion(
+                vllm_client,
+                timeout or TripInfoCollector.LLM_TIMEOUT,
                 model="openai/gpt-oss-120b",
                 messages=[
                     {
@@ -287,12 +527,13 @@ Number of days:"""
                 stop=["\n\n"]
             )
             
-            content = response.choices[0].message.content.strip()
+            content = content.strip()
             print(f"[LLM 回應] {content}")
             
-            # 驗證回應是否有效（不是全是特殊字符）
-            if not content or len(content) < 1 or content.count('!') > len(content) * 0.5:
-                print(f"\n⚠️  vLLM 回應無效（返回了 {content.count('!')} 個驚嘆號）")
+            # 驗證回應是否有效（串流中偵測到垃圾會提前中止）
+            if garbage_reason or not content:
+                breaker.record_failure()
+                print(f"\n⚠️  vLLM 回應無效（{garbage_reason or '空白回應'}），已中止串流")
                 print(f"💡 可能原因：")
                 print(f"   - vLLM 模型資源不足或過載")
                 print(f"   - 模型配置錯誤")
@@ -300,6 +541,8 @@ Number of days:"""
                 print(f"✅ 系統將使用基於規則的提取結果\n")
                 return {}
             
+            breaker.record_success()
+            
             # 解析回應
             extracted = {}
             
@@ -334,7 +577,12 @@ Number of days:"""
             
             return extracted
             
+        except asyncio.TimeoutError:
+            breaker.record_failure()
+            print("⏱️ LLM 提取逾時，使用規則結果")
+            return {}
         except Exception as e:
+            breaker.record_failure()
             print(f"❌ LLM 提取錯誤: {e}")
             return {}
     
@@ -381,11 +629,33 @@ Number of days:"""
         return missing
     
     @staticmethod
-    def generate_follow_up_question(missing_fields, current_info, client=None):
+    def generate_follow_up_question(missing_fields, current_info, client=None, timeout=None):
+        """
+        生成追問問題（agenerate_follow_up_question 的同步包裝）
+        
+        Args:
+            missing_fields: get_missing_fields 的結果
+            current_info: 已收集資訊
+            client: vLLM client（可選）
+            timeout: LLM 呼叫逾時秒數（預設 LLM_TIMEOUT）
+        """
+        return _run_sync(
+            TripInfoCollector.agenerate_follow_up_question(missing_fields, current_info, client, timeout)
+        )
+    
+    @staticmethod
+    async def agenerate_follow_up_question(missing_fields, current_info, client=None, timeout=None):
         """
-        生成追問問題
+        非同步生成追問問題
         
-        可以選擇性使用 LLM 生成更自然的追問
+        先從預先生成的追問庫隨機取一個變體；只有沒見過的情境才呼叫 LLM，
+        生成結果會存回追問庫供之後使用
+        
+        Args:
+            missing_fields: get_missing_fields 的結果
+            current_info: 已收集資訊
+            client: AsyncOpenAI 或 OpenAI client（可選）
+            timeout: LLM 呼叫逾時秒數（預設 LLM_TIMEOUT），逾時則使用預設問題
         """
         if not missing_fields:
             return None
@@ -401,23 +671,82 @@ Number of days:"""
         
         default_question = default_questions.get(field, f"請提供您的{label}資訊")
         
+        # === 追問庫命中：直接隨機輪替，不呼叫 LLM ===
+        signature = TripInfoCollector._follow_up_signature(field, current_info)
+        variants = TripInfoCollector.follow_up_cache.get(signature)
+        
+        if variants:
+            question = random.choice(variants)
+            print(f"⚡ 追問庫命中（{len(variants)} 個變體）：{question}")
+            return question
+        
         # === 如果有 LLM，生成更自然的追問 ===
         if client is not None:
-            try:
-                # 根據已知資訊生成個性化追問
-                context = []
-                if current_info.get("location"):
-                    context.append(f"目的地是{current_info['location']}")
-                if current_info.get("duration"):
-                    context.append(f"玩{current_info['duration']}天")
-                
-                other = current_info.get("other_requirements", {})
-                if other.get("trip_type"):
-                    context.append(f"是{other['trip_type']}")
-                
-                context_str = "、".join(context) if context else "還沒有資訊"
-                
-                prompt = f"""You are a friendly travel assistant.
+            llm_question = await TripInfoCollector._agenerate_llm_question(
+                field, label, current_info, client, timeout
+            )
+            
+            if llm_question:
+                TripInfoCollector._add_follow_up_variant(signature, llm_question)
+                return llm_question
+        
+        # 返回預設問題
+        return default_question
+    
+    @staticmethod
+    def _follow_up_signature(field, current_info):
+        """追問情境簽章：缺少的欄位 + 地點 + 天數 + 旅遊類型"""
+        other = current_info.get("other_requirements", {})
+        return "|".join(str(part or "") for part in (
+            field,
+            current_info.get("location"),
+            current_info.get("duration"),
+            other.get("trip_type")
+        ))
+    
+    @staticmethod
+    def _add_follow_up_variant(signature, question):
+        """將追問加入追問庫（去重、保留最多 FOLLOW_UP_VARIANTS 個）"""
+        with _FOLLOW_UP_LOCK:
+            cache = TripInfoCollector.follow_up_cache
+            variants = cache.get(signature) or []
+            
+            if question not in variants:
+                variants.append(question)
+                cache.set(signature, variants[-TripInfoCollector.FOLLOW_UP_VARIANTS:])
+    
+    @staticmethod
+    async def _agenerate_llm_question(field, label, current_info, client, timeout=None, breaker=None):
+        """
+        呼叫 LLM 生成一個追問
+        
+        Args:
+            breaker: 使用的斷路器（預設 llm_breaker）
+        
+        Returns:
+            str: 追問內容；斷路器開啟、逾時、垃圾或不合格的回應則回傳 None
+        """
+        breaker = breaker or TripInfoCollector.llm_breaker
+        
+        if not breaker.allow_request():
+            print("🔌 vLLM 斷路器開啟，使用預設問題")
+            return None
+        
+        try:
+            # 根據已知資訊生成個性化追問
+            context = []
+            if current_info.get("location"):
+                context.append(f"目的地是{current_info['location']}")
+            if current_info.get("duration"):
+                context.append(f"玩{current_info['duration']}天")
+            
+            other = current_info.get("other_requirements", {})
+            if other.get("trip_type"):
+                context.append(f"是{other['trip_type']}")
+            
+            context_str = "、".join(context) if context else "還沒有資訊"
+            
+            prompt = f"""You are a friendly travel assistant.
 
 Known: {context_str}
 Missing: {label}
@@ -426,34 +755,110 @@ Generate ONE friendly question in Traditional Chinese asking for the {label}.
 Keep it under 30 characters. Be warm and encouraging.
 
 Question:"""
+            
+            llm_question, garbage_reason = await _astream_completion(
+                client,
+                timeout or TripInfoCollector.LLM_TIMEOUT,
+                model="openai/gpt-oss-120b",
+                messages=[
+                    {"role": "system", "content": "You are a friendly assistant. Reply in Traditional Chinese."},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.7,
+                max_tokens=80,
+                stop=["\n"]
+            )
+            
+            llm_question = llm_question.strip()
+            
+            # 驗證回應（串流中偵測到垃圾會提前中止）
+            if garbage_reason:
+                breaker.record_failure()
+                print(f"⚠️ LLM 追問無效（{garbage_reason}），使用預設問題")
+                return None
+            
+            breaker.record_success()
+            if llm_question and 5 <= len(llm_question) <= 100:
+                print(f"✅ LLM 生成追問：{llm_question}")
+                return llm_question
+            
+        except asyncio.TimeoutError:
+            breaker.record_failure()
+            print("⏱️ LLM 追問逾時，使用預設問題")
+        except Exception as e:
+            breaker.record_failure()
+            print(f"⚠️ LLM 追問生成失敗: {e}")
+        
+        return None
+    
+    @staticmethod
+    def warm_follow_up_questions(client, contexts=None, variants=None, max_concurrency=4, timeout=None):
+        """
+        預先生成追問變體（awarm_follow_up_questions 的同步包裝）
+        
+        可在離線腳本或背景執行緒中呼叫
+        """
+        return _run_sync(TripInfoCollector.awarm_follow_up_questions(
+            client, contexts, variants, max_concurrency, timeout
+        ))
+    
+    @staticmethod
+    async def awarm_follow_up_questions(client, contexts=None, variants=None, max_concurrency=4, timeout=None):
+        """
+        預先生成追問變體並存入追問庫
+        
+        使用獨立的 warm_breaker 計算失敗；線上的 llm_breaker 不是關閉狀態（vLLM 不穩定）時不預熱，
+        預熱途中開啟則停止
+        
+        Args:
+            client: AsyncOpenAI 或 OpenAI client
+            contexts: (field, current_info) 列表（預設：缺地點，以及每個城市缺天數）
+            variants: 每個情境生成幾個變體（預設 FOLLOW_UP_VARIANTS）
+            max_concurrency: 同時進行的 LLM 請求上限
+            timeout: LLM 呼叫逾時秒數（預設 LLM_TIMEOUT）
+            
+        Returns:
+            int: 新增的變體數
+        """
+        live_breaker = TripInfoCollector.llm_breaker
+        if live_breaker.state != live_breaker.CLOSED:
+            print("🔌 vLLM 斷路器未關閉，略過追問庫預熱")
+            return 0
+        
+        if contexts is None:
+            contexts = [("location", {})] + [
+                ("duration", {"location": city}) for city in TripInfoCollector.CITIES
+            ]
+        
+        variants = variants or TripInfoCollector.FOLLOW_UP_VARIANTS
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        added = 0
+        
+        async def warm(field, current_info):
+            nonlocal added
+            signature = TripInfoCollector._follow_up_signature(field, current_info)
+            label = TripInfoCollector.REQUIRED_FIELDS.get(field, field)
+            
+            existing = TripInfoCollector.follow_up_cache.get(signature) or []
+            for _ in range(variants - len(existing)):
+                async with semaphore:
+                    if live_breaker.state != live_breaker.CLOSED:
+                        return
+                    question = await TripInfoCollector._agenerate_llm_question(
+                        field, label, current_info, client, timeout, breaker=TripInfoCollector.warm_breaker
+                    )
                 
-                response = client.chat.completions.create(
-                    model="openai/gpt-oss-120b",
-                    messages=[
-                        {"role": "system", "content": "You are a friendly assistant. Reply in Traditional Chinese."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.7,
-                    max_tokens=80,
-                    stop=["\n"]
-                )
-                
-                llm_question = response.choices[0].message.content.strip()
-                
-                # 驗證回應（檢查是否為垃圾輸出）
-                if llm_question and 5 <= len(llm_question) <= 100:
-                    # 檢查是否全是特殊字符
-                    if llm_question.count('!') > len(llm_question) * 0.5:
-                        print(f"⚠️ LLM 追問無效（特殊字符過多），使用預設問題")
-                    else:
-                        print(f"✅ LLM 生成追問：{llm_question}")
-                        return llm_question
+                if question is None:
+                    return
                 
-            except Exception as e:
-                print(f"⚠️ LLM 追問生成失敗: {e}")
-        
-        # 返回預設問題
-        return default_question
+                before = len(TripInfoCollector.follow_up_cache.get(signature) or [])
+                TripInfoCollector._add_follow_up_variant(signature, question)
+                if len(TripInfoCollector.follow_up_cache.get(signature) or []) > before:
+                    added += 1
+        
+        await asyncio.gather(*(warm(field, info) for field, info in contexts))
+        print(f"🔥 追問庫預熱完成，新增 {added} 個變體")
+        return added
     
     @staticmethod
     def is_info_complete(info):
@@ -537,4 +942,28 @@ Question:"""
             "preferences": other.get("preferences", []),
             "special_needs": other.get("special_needs", []),
             "date": other.get("date")
-        }
\ No newline at end of file
+        }
+
+
+def _build_keyword_matcher():
+    """將所有詞彙表編譯成單一 Aho-Corasick 自動機（priority 保留原本的比對順序）"""
+    matcher = KeywordMatcher()
+    
+    for priority, city in enumerate(TripInfoCollector.CITIES):
+        matcher.add(city, ("location", city, priority))
+    
+    vocabularies = [
+        ("trip_type", TripInfoCollector.TRIP_TYPE_KEYWORDS),
+        ("preference", TripInfoCollector.PREFERENCE_KEYWORDS),
+        ("special_need", TripInfoCollector.SPECIAL_NEEDS_KEYWORDS)
+    ]
+    
+    for category, vocabulary in vocabularies:
+        for priority, (label, keywords) in enumerate(vocabulary.items()):
+            for keyword in keywords:
+                matcher.add(keyword, (category, label, priority))
+    
+    return matcher.build()
+
+
+_KEYWORD_MATCHER = _build_keyword_matcher()
@@ -1,9 +1,45 @@
 from datetime import datetime, timedelta
 import json
+import re
+import time
+import unicodedata
+
+from utils.compact_schema import ACTIVITY_FIELDS, LEGEND_KEY, expand_day, expand_itinerary
+from utils.latency_tracker import LatencyTracker
+from utils.result_cache import ResultCache
+from utils.semantic_cache import normalize_preferences
+from utils.single_flight import FlightAbandoned, SingleFlight
+from utils.template_index import TemplateIndex, generic_template
+from utils.token_planner import TokenBudgetPlanner, is_truncated
 
 class ItineraryGenerator:
     """AI 行程生成器"""
     
+    # === 行程結果快取（可在頁面中換成帶 SQLite 磁碟層的實例）===
+    BUDGET_BUCKET = 5000  # 預算相差不到一個級距視為相同請求
+    result_cache = ResultCache(max_size=128, ttl=3 * 24 * 3600, table="itinerary")
+    
+    # === 備用行程模板（載入一次，檔案修改時自動重新載入）===
+    template_index = TemplateIndex("data/trip_templates.json")
+    
+    # === 精簡輸出格式（活動以位置元組表示，減少輸出 token；解析時自動展開）===
+    compact_output = False
+    
+    # === 輸出 token 上限（依實際輸出統計調整，每個後端各自統計）===
+    token_planner = TokenBudgetPlanner()
+    
+    # === 各後端完成行程生成的延遲（對沖請求的等待時間取 p90）===
+    latency_tracker = LatencyTracker()
+    
+    # === 語意行程快取（相似請求改寫既有行程；預設停用，由頁面換成 SemanticItineraryCache）===
+    semantic_cache = None
+    
+    # === 解析失敗語料（預設停用，由頁面換成 FailureCorpus；背景寫入，不阻塞請求）===
+    failure_corpus = None
+    
+    # === 合併同時進行的相同請求（只有一個實際呼叫 LLM，其他各自取得深拷貝）===
+    single_flight = SingleFlight(timeout=120)
+    
     @staticmethod
     def generate_itinerary(client, location, duration, budget=None, preferences=None):
         """
@@ -16,6 +52,544 @@ class ItineraryGenerator:
             budget: 預算（可選）
             preferences: 偏好列表（可選）
         """
+        request = (location, duration, budget, preferences)
+        key = ItineraryGenerator._result_cache_key(*request)
+        cached = ItineraryGenerator._cached_result(key, request)
+        if cached is not None:
+            return cached
+        
+        def generate():
+            return ItineraryGenerator._store_result(key, request, ItineraryGenerator._generate_itinerary_uncached(
+                client, location, duration, budget, preferences
+            ))
+        
+        try:
+            return ItineraryGenerator.single_flight.do(key, generate)
+        except FlightAbandoned:
+            # 合併的串流在完成前被停止：自行生成
+            return generate()
+        except TimeoutError as e:
+            return ItineraryGenerator._coalesce_timeout_result(e, *request)
+    
+    @staticmethod
+    def _generate_itinerary_uncached(client, location, duration, budget=None, preferences=None):
+        """generate_itinerary 的實際生成（不經快取與請求合併）"""
+        prompt = ItineraryGenerator._build_prompt(location, duration, budget, preferences)
+        content = ""
+        
+        try:
+            content = ItineraryGenerator._request_content(
+                client, prompt, duration, preference_count=len(preferences or [])
+            )
+            itinerary, _ = ItineraryGenerator._complete_itinerary(client, content, location, duration, budget, preferences)
+            
+            return {
+                "success": True,
+                "data": itinerary
+            }
+            
+        except json.JSONDecodeError as e:
+            return ItineraryGenerator._json_error_result(e, content, location, duration, budget, preferences, prompt)
+        except Exception as e:
+            print(f"生成錯誤: {e}")
+            if content:
+                # 有回應但無法解析或驗證（例如修復後缺少必要欄位）
+                ItineraryGenerator._capture_failure(e, content, prompt, location, duration, budget, preferences)
+            
+            return {
+                "success": False,
+                "error": str(e),
+                "fallback": ItineraryGenerator._create_fallback_itinerary(location, duration, budget, preferences)
+            }
+    
+    @staticmethod
+    def stream_itinerary(client, location, duration, budget=None, preferences=None):
+        """
+        串流生成行程：每一天的行程一收到結尾的 } 就先產出
+        
+        Args: 同 generate_itinerary
+        
+        Yields:
+            tuple: ("day", 單日行程 dict)，最後是 ("done", 與 generate_itinerary 相同格式的結果)
+        """
+        request = (location, duration, budget, preferences)
+        yield from ItineraryGenerator._cached_stream(request, ItineraryGenerator._stream_itinerary_uncached(
+            client, location, duration, budget, preferences
+        ))
+    
+    @staticmethod
+    def _stream_itinerary_uncached(client, location, duration, budget=None, preferences=None):
+        """stream_itinerary 的實際生成（不經快取）"""
+        from utils.json_stream import DailyItineraryParser
+        
+        prompt = ItineraryGenerator._build_prompt(location, duration, budget, preferences)
+        parser = DailyItineraryParser()
+        parts = []
+        content = ""
+        
+        try:
+            for piece in ItineraryGenerator._stream_content(
+                client, prompt, duration, preference_count=len(preferences or [])
+            ):
+                parts.append(piece)
+                for day in parser.feed(piece):
+                    yield "day", expand_day(day)
+            
+            content = "".join(parts).strip()
+            print(f"✅ 串流完成，共 {len(content)} 字元，{parser.days_emitted} 天")
+            
+            # 截斷時只補生成缺少的天
+            itinerary, added = ItineraryGenerator._complete_itinerary(client, content, location, duration, budget, preferences)
+            for day in added:
+                yield "day", day
+            
+            yield "done", {
+                "success": True,
+                "data": itinerary
+            }
+            
+        except json.JSONDecodeError as e:
+            yield "done", ItineraryGenerator._json_error_result(e, content, location, duration, budget, preferences, prompt)
+        except Exception as e:
+            print(f"生成錯誤: {e}")
+            if content:
+                ItineraryGenerator._capture_failure(e, content, prompt, location, duration, budget, preferences)
+            
+            yield "done", {
+                "success": False,
+                "error": str(e),
+                "fallback": ItineraryGenerator._create_fallback_itinerary(location, duration, budget, preferences)
+            }
+    
+    @staticmethod
+    def generate_itinerary_hedged(client, location, duration, budget=None, preferences=None,
+                                  secondary=None, hedge_delay=None):
+        """
+        對沖生成：先送主要後端，超過近期 p90 延遲仍未完成才同時送備援後端，先成功者勝出
+        
+        Args: 同 generate_itinerary，另外
+            secondary: 備援 client（例如 vLLM；None 表示不對沖）
+            hedge_delay: 送出備援前等待的秒數（None 表示使用主要後端的 p90 延遲）
+        
+        Returns:
+            dict: 與 generate_itinerary 相同格式，另含 hedge（勝出者、是否送出備援、等待秒數）
+        """
+        for event, payload in ItineraryGenerator.stream_itinerary_hedged(
+            client, location, duration, budget, preferences, secondary, hedge_delay
+        ):
+            if event == "done":
+                return payload
+    
+    @staticmethod
+    def stream_itinerary_hedged(client, location, duration, budget=None, preferences=None,
+                                secondary=None, hedge_delay=None):
+        """
+        對沖串流生成：每一天取先送達的後端，最終結果取第一個解析並驗證成功的後端
+        
+        Yields:
+            tuple: ("day", 單日行程 dict)，最後是 ("done", 與 generate_itinerary 相同格式的結果)
+        """
+        request = (location, duration, budget, preferences)
+        yield from ItineraryGenerator._cached_stream(request, ItineraryGenerator._stream_itinerary_hedged_uncached(
+            client, location, duration, budget, preferences, secondary, hedge_delay
+        ))
+    
+    @staticmethod
+    def _stream_itinerary_hedged_uncached(client, location, duration, budget=None, preferences=None,
+                                          secondary=None, hedge_delay=None):
+        """stream_itinerary_hedged 的實際生成（不經快取）"""
+        import queue
+        import threading
+        
+        if secondary is None:
+            yield from ItineraryGenerator._stream_itinerary_uncached(client, location, duration, budget, preferences)
+            return
+        
+        tracker = ItineraryGenerator.latency_tracker
+        providers = {"primary": client, "secondary": secondary}
+        backends = {name: "gemini" if hasattr(provider, 'generate_content') else "vllm" for name, provider in providers.items()}
+        delay = hedge_delay if hedge_delay is not None else tracker.delay(backends["primary"])
+        
+        events = queue.Queue()
+        cancelled = {name: threading.Event() for name in providers}
+        starts = {}
+        recorded = set()
+        
+        def run(name):
+            """在背景執行一個後端的串流；被取消時在下一段回應到達時關閉串流"""
+            stream = ItineraryGenerator._stream_itinerary_uncached(
+                providers[name], location, duration, budget, preferences
+            )
+            try:
+                for event, payload in stream:
+                    if cancelled[name].is_set():
+                        return
+                    if event == "done" and payload.get("success"):
+                        tracker.record(backends[name], time.monotonic() - starts[name])
+                        recorded.add(name)
+                    events.put((name, event, payload))
+            except Exception as e:
+                events.put((name, "done", {"success": False, "error": str(e)}))
+            finally:
+                stream.close()
+        
+        def launch(name):
+            starts[name] = time.monotonic()
+            threading.Thread(target=run, args=(name,), name=f"hedged-{name}", daemon=True).start()
+        
+        launch("primary")
+        started = {"primary"}
+        deadline = time.monotonic() + delay
+        failures = {}
+        shown_days = set()
+        
+        try:
+            while True:
+                timeout = None if "secondary" in started else max(0.0, deadline - time.monotonic())
+                try:
+                    name, event, payload = events.get(timeout=timeout)
+                except queue.Empty:
+                    print(f"⏱️ 主要後端超過 {delay:.1f} 秒未完成，同時送出備援請求")
+                    launch("secondary")
+                    started.add("secondary")
+                    continue
+                
+                if event == "day":
+                    # 每一天取先送達的版本（預覽用，最終以勝出者的完整結果為準）
+                    if payload.get("day") not in shown_days:
+                        shown_days.add(payload.get("day"))
+                        yield "day", payload
+                    continue
+                
+                if payload.get("success"):
+                    payload["hedge"] = {"winner": name, "hedged": "secondary" in started, "delay": delay}
+                    print(f"🏁 對沖生成由 {name}（{backends[name]}）勝出")
+                    yield "done", payload
+                    return
+                
+                failures[name] = payload
+                if "secondary" not in started:
+                    # 主要後端已失敗：不必等到對沖延遲，立即送出備援
+                    launch("secondary")
+                    started.add("secondary")
+                elif len(failures) == len(providers):
+                    result = failures["primary"]
+                    result["hedge"] = {"winner": None, "hedged": True, "delay": delay}
+                    yield "done", result
+                    return
+        finally:
+            # 勝出、兩者皆失敗或呼叫端提前停止時，取消仍在進行的後端
+            for event in cancelled.values():
+                event.set()
+            
+            # 被取消的後端以目前已花的時間作為延遲下限記錄（否則 p90 只從快的樣本學習，對沖會越來越早送出）
+            now = time.monotonic()
+            for name in started:
+                if name not in recorded and name not in failures:
+                    tracker.record(backends[name], now - starts[name])
+    
+    @staticmethod
+    def generate_itinerary_parallel(client, location, duration, budget=None, preferences=None,
+                                    extra_clients=None, max_concurrency=4):
+        """
+        分日並行生成行程：先生成每天的主題與區域（骨架），再同時生成各天的活動
+        
+        Args: 同 generate_itinerary，另外
+            extra_clients: 其他可分擔每日生成的 client（例如 vLLM），依天數輪流使用
+            max_concurrency: 同時進行的每日生成請求上限
+        
+        Returns:
+            dict: 與 generate_itinerary 相同格式
+        """
+        for event, payload in ItineraryGenerator.stream_itinerary_parallel(
+            client, location, duration, budget, preferences, extra_clients, max_concurrency
+        ):
+            if event == "done":
+                return payload
+    
+    @staticmethod
+    def stream_itinerary_parallel(client, location, duration, budget=None, preferences=None,
+                                  extra_clients=None, max_concurrency=4):
+        """
+        分日並行生成，每完成一天就先產出（完成順序不一定依天數）
+        
+        Yields:
+            tuple: ("day", 單日行程 dict)，最後是 ("done", 與 generate_itinerary 相同格式的結果)
+        """
+        request = (location, duration, budget, preferences)
+        yield from ItineraryGenerator._cached_stream(request, ItineraryGenerator._stream_itinerary_parallel_uncached(
+            client, location, duration, budget, preferences, extra_clients, max_concurrency
+        ))
+    
+    @staticmethod
+    def _stream_itinerary_parallel_uncached(client, location, duration, budget=None, preferences=None,
+                                            extra_clients=None, max_concurrency=4):
+        """stream_itinerary_parallel 的實際生成（不經快取）"""
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+        
+        clients = [client] + [c for c in (extra_clients or []) if c is not None]
+        total_budget = budget if budget else duration * 10000
+        
+        skeleton = ItineraryGenerator._generate_skeleton(client, location, duration, budget, preferences)
+        plans = {plan["day"]: plan for plan in skeleton["daily_plan"]}
+        
+        days = {}
+        workers = max(1, min(max_concurrency, duration))
+        
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="itinerary-day") as executor:
+            futures = {
+                executor.submit(
+                    ItineraryGenerator._generate_day,
+                    [clients[(day - 1 + offset) % len(clients)] for offset in range(len(clients))],
+                    location, duration, day, plans, total_budget // duration, preferences
+                ): day
+                for day in range(1, duration + 1)
+            }
+            
+            for future in as_completed(futures):
+                day = futures[future]
+                try:
+                    days[day] = future.result()
+                except Exception as e:
+                    print(f"⚠️ 第 {day} 天生成失敗: {e}，使用模板")
+                    days[day] = ItineraryGenerator._template_day(location, duration, budget, day, plans)
+                yield "day", days[day]
+        
+        itinerary = {
+            "trip_name": skeleton.get("trip_name") or f"{location}{duration}日遊",
+            "location": location,
+            "duration": duration,
+            "total_budget": total_budget,
+            "budget_breakdown": {
+                "accommodation": int(total_budget * 0.3),
+                "food": int(total_budget * 0.3),
+                "transport": int(total_budget * 0.2),
+                "activities": int(total_budget * 0.2)
+            },
+            "daily_itinerary": [days[day] for day in sorted(days)],
+            "accommodation_suggestions": skeleton.get("accommodation_suggestions", []),
+            "transport_tips": skeleton.get("transport_tips", "建議使用大眾運輸工具"),
+            "packing_list": skeleton.get("packing_list", ["輕便服裝", "防曬用品"]),
+            "important_notes": skeleton.get("important_notes", ["注意天氣變化"])
+        }
+        
+        yield "done", {
+            "success": True,
+            "data": itinerary
+        }
+    
+    # === 行程結果快取 ===
+    
+    @staticmethod
+    def _result_cache_key(location, duration, budget=None, preferences=None):
+        """快取鍵：正規化地點、天數、預算級距、排序後的偏好"""
+        location = unicodedata.normalize("NFKC", str(location or "")).strip()
+        bucket = "any" if not budget else str(round(budget / ItineraryGenerator.BUDGET_BUCKET))
+        return f"{location}|{duration}|{bucket}|{','.join(normalize_preferences(preferences))}"
+    
+    @staticmethod
+    def _cached_result(key, request):
+        """
+        查詢快取（完全相同的請求優先，其次是語意快取中的相似行程）
+        
+        Args:
+            request: (location, duration, budget, preferences)
+        
+        Returns:
+            dict: 快取結果的深拷貝（含 cache 命中資訊）；未命中則回傳 None
+        """
+        entry = ItineraryGenerator.result_cache.get_entry(key)
+        if entry is None:
+            semantic = ItineraryGenerator.semantic_cache
+            return semantic.lookup(*request) if semantic is not None else None
+        
+        created_at, result = entry
+        age = max(0.0, time.time() - created_at)
+        result["cache"] = {"hit": True, "key": key, "age": age}
+        print(f"⚡ 行程快取命中：{key}（{age / 3600:.1f} 小時前生成）")
+        return result
+    
+    @staticmethod
+    def _store_result(key, request, result):
+        """
+        寫入快取（含語意快取）並標記為未命中
+        
+        只快取成功且每一天都有行程的結果（模板備案與截斷後只剩部分天數的結果不快取）
+        """
+        data = result.get("data") or {}
+        if result.get("success") and len(data.get("daily_itinerary", [])) >= (data.get("duration") or 0):
+            ItineraryGenerator.result_cache.set(key, result)
+            if ItineraryGenerator.semantic_cache is not None:
+                ItineraryGenerator.semantic_cache.add(*request, result)
+        
+        result["cache"] = {"hit": False, "key": key, "age": 0.0}
+        return result
+    
+    @staticmethod
+    def _cached_stream(request, events):
+        """
+        串流版本的快取：命中時直接逐日產出快取結果，否則在完成時寫入
+        
+        相同請求同時進行時只由第一個實際生成，其他重播它的事件
+        """
+        key = ItineraryGenerator._result_cache_key(*request)
+        cached = ItineraryGenerator._cached_result(key, request)
+        if cached is not None:
+            for day in cached["data"]["daily_itinerary"]:
+                yield "day", day
+            yield "done", cached
+            return
+        
+        def generate():
+            for event, payload in events:
+                if event == "done":
+                    payload = ItineraryGenerator._store_result(key, request, payload)
+                yield event, payload
+        
+        try:
+            yield from ItineraryGenerator.single_flight.stream(key, generate)
+        except FlightAbandoned:
+            # 合併的請求在完成前被停止：自行生成（已產出的天會再產出一次）
+            yield from generate()
+        except TimeoutError as e:
+            yield "done", ItineraryGenerator._coalesce_timeout_result(e, *request)
+    
+    @staticmethod
+    def _coalesce_timeout_result(error, location, duration, budget=None, preferences=None):
+        """等待合併的請求逾時：改用模板（不影響仍在生成的請求）"""
+        print(f"⏱️ {error}，改用模板")
+        return {
+            "success": False,
+            "error": str(error),
+            "fallback": ItineraryGenerator._create_fallback_itinerary(location, duration, budget, preferences)
+        }
+    
+    @staticmethod
+    def _generate_skeleton(client, location, duration, budget=None, preferences=None):
+        """
+        生成行程骨架（每天的主題與區域，以及住宿、交通等整體建議）
+        
+        失敗時回傳只有預設主題的骨架，不影響每日生成
+        """
+        from utils.json_repair import repair_json
+        
+        pref_text = "、".join(preferences) if isinstance(preferences, list) else (preferences or "")
+        
+        prompt = f"""
+你是專業的台灣旅遊規劃師。請先規劃行程骨架，只回傳 JSON，不要其他文字。
+
+**用戶需求**：
+- 目的地：{location}
+- 天數：{duration}天
+- 預算：{f'NT$ {budget:,}' if budget else '彈性預算'}
+- 偏好：{pref_text if pref_text else '綜合旅遊'}
+
+行程骨架格式：
+{{
+  "trip_name": "{location}{duration}日遊",
+  "daily_plan": [
+    {{"day": 1, "theme": "當天主題", "area": "主要區域"}}
+  ],
+  "accommodation_suggestions": [
+    {{"name": "住宿建議", "type": "飯店/民宿", "area": "區域", "price_range": "價格範圍", "reason": "推薦理由"}}
+  ],
+  "transport_tips": "交通方式建議",
+  "packing_list": ["必備物品1"],
+  "important_notes": ["注意事項1"]
+}}
+
+daily_plan 必須剛好 {duration} 天，各天區域不要重複，考慮地理位置和交通動線。"""
+        
+        default_plan = [{"day": day, "theme": f"{location}第{day}天", "area": location} for day in range(1, duration + 1)]
+        
+        try:
+            content = ItineraryGenerator._request_content(client, prompt, duration, max_tokens=200 + duration * 80)
+            skeleton, _ = repair_json(content)
+            
+            plans = {
+                plan.get("day"): plan for plan in skeleton.get("daily_plan", [])
+                if isinstance(plan, dict) and isinstance(plan.get("day"), int)
+            }
+            skeleton["daily_plan"] = [plans.get(default["day"], default) for default in default_plan]
+            return skeleton
+        
+        except Exception as e:
+            print(f"⚠️ 行程骨架生成失敗: {e}，使用預設主題")
+            return {"daily_plan": default_plan}
+    
+    @staticmethod
+    def _generate_day(clients, location, duration, day, plans, day_budget, preferences=None):
+        """
+        生成單日活動（依序嘗試 clients，全部失敗才拋出例外）
+        
+        Returns:
+            dict: daily_itinerary 中的一天
+        """
+        from utils.json_repair import repair_json
+        
+        plan = plans[day]
+        pref_text = "、".join(preferences) if isinstance(preferences, list) else (preferences or "")
+        others = "、".join(
+            f"第{other}天 {plans[other].get('area', '')}" for other in sorted(plans) if other != day
+        )
+        
+        prompt = f"""
+你是專業的台灣旅遊規劃師。這是{location}{duration}日遊，現在只規劃第 {day} 天，只回傳 JSON，不要其他文字。
+
+- 目的地：{location}
+- 當天主題：{plan.get('theme', '')}
+- 當天區域：{plan.get('area', location)}
+- 當天預算：約 NT$ {day_budget:,}
+- 偏好：{pref_text if pref_text else '綜合旅遊'}
+- 其他天的區域（避免重複景點）：{others if others else '無'}
+
+格式：
+{{
+  "day": {day},
+  "theme": "{plan.get('theme', '')}",
+  "activities": [
+    {{"time": "09:00", "name": "活動名稱", "type": "景點", "location": "具體地點", "duration": "2小時", "cost": 0, "note": "簡短說明", "icon": "🗺️"}}
+  ]
+}}
+
+安排 4-5 個活動，包含早中晚餐建議。"""
+        
+        last_error = None
+        for client in clients:
+            try:
+                content = ItineraryGenerator._request_content(client, prompt, 1, max_tokens=1000)
+                data, _ = repair_json(content)
+                
+                activities = data.get("activities")
+                if not isinstance(activities, list) or not activities:
+                    raise ValueError("沒有活動")
+                
+                return {
+                    "day": day,
+                    "theme": data.get("theme") or plan.get("theme", ""),
+                    "activities": activities
+                }
+            except Exception as e:
+                last_error = e
+                print(f"⚠️ 第 {day} 天生成失敗（{type(client).__name__}）: {e}")
+        
+        raise last_error or ValueError("沒有可用的 client")
+    
+    @staticmethod
+    def _template_day(location, duration, budget, day, plans):
+        """從模板取出某一天（每日生成全部失敗時使用）"""
+        template = ItineraryGenerator._create_fallback_itinerary(location, duration, budget)
+        days = template.get("daily_itinerary", [])
+        template_day = dict(days[(day - 1) % len(days)]) if days else {"activities": []}
+        template_day["day"] = day
+        template_day.setdefault("theme", plans[day].get("theme", ""))
+        return template_day
+    
+    @staticmethod
+    def _build_prompt(location, duration, budget=None, preferences=None, compact=None):
+        """建立行程生成 prompt（compact 預設依 compact_output 決定）"""
+        if compact is None:
+            compact = ItineraryGenerator.compact_output
         
         # 處理偏好
         pref_text = ""
@@ -25,6 +599,38 @@ class ItineraryGenerator:
             else:
                 pref_text = preferences
         
+        if compact:
+            fields = ", ".join(f'"{field}"' for field in ACTIVITY_FIELDS)
+            legend = f'''  "{LEGEND_KEY}": [{fields}],
+'''
+            daily_example = '''  "daily_itinerary": [
+    {"day": 1, "theme": "抵達與市區探索", "activities": [
+      ["09:00", "活動名稱", "景點", "具體地點", "2小時", 0, "簡短說明", "🗺️"]
+    ]}
+  ],'''
+            format_note = f"\n5. 活動使用精簡格式：每個活動是一個陣列，欄位順序依 {LEGEND_KEY}，不要寫出鍵名"
+        else:
+            legend = ""
+            daily_example = '''  "daily_itinerary": [
+    {
+      "day": 1,
+      "theme": "抵達與市區探索",
+      "activities": [
+        {
+          "time": "09:00",
+          "name": "活動名稱",
+          "type": "景點",
+          "location": "具體地點",
+          "duration": "2小時",
+          "cost": 0,
+          "note": "簡短說明",
+          "icon": "🗺️"
+        }
+      ]
+    }
+  ],'''
+            format_note = ""
+        
         # 簡化的 Prompt
         prompt = f"""
 你是專業的台灣旅遊規劃師。請生成完整有效的 JSON 格式行程。
@@ -39,11 +645,11 @@ class ItineraryGenerator:
 1. 只回傳完整的 JSON，不要任何其他文字
 2. 確保 JSON 語法完全正確，所有括號、引號、逗號都要完整
 3. 不要截斷，必須完整輸出到最後
-4. 不要使用 markdown 標記
+4. 不要使用 markdown 標記{format_note}
 
 JSON 格式範例：
 {{
-  "trip_name": "{location}{duration}日遊",
+{legend}  "trip_name": "{location}{duration}日遊",
   "location": "{location}",
   "duration": {duration},
   "total_budget": {budget if budget else duration * 10000},
@@ -53,24 +659,7 @@ JSON 格式範例：
     "transport": {int((budget if budget else duration * 10000) * 0.2)},
     "activities": {int((budget if budget else duration * 10000) * 0.2)}
   }},
-  "daily_itinerary": [
-    {{
-      "day": 1,
-      "theme": "抵達與市區探索",
-      "activities": [
-        {{
-          "time": "09:00",
-          "name": "活動名稱",
-          "type": "景點",
-          "location": "具體地點",
-          "duration": "2小時",
-          "cost": 0,
-          "note": "簡短說明",
-          "icon": "🗺️"
-        }}
-      ]
-    }}
-  ],
+{daily_example}
   "accommodation_suggestions": [
     {{
       "name": "住宿建議",
@@ -94,320 +683,406 @@ JSON 格式範例：
 
 現在請生成完整的 JSON："""
 
-        try:
-            # 檢測 client 類型
-            if hasattr(client, 'generate_content'):
-                # Gemini API - 根據天數調整輸出長度（增加容量避免截斷）
-                max_tokens = min(8000, duration * 800)  # 增加到每天 800 tokens
-                print(f"🤖 使用 Gemini 生成 {duration} 天行程，max_tokens: {max_tokens}")
-                response = client.generate_content(
-                    prompt,
-                    generation_config={
-                        "temperature": 0.6,  # 降低溫度提高穩定性
-                        "top_p": 0.9,
-                        "top_k": 40,
-                        "max_output_tokens": max_tokens,
-                        "response_mime_type": "application/json"  # 強制 JSON 輸出
-                    }
-                )
-                content = response.text.strip()
-                print(f"✅ Gemini 回應長度: {len(content)} 字元")
-            else:
-                # OpenAI compatible API (vLLM)
-                response = client.chat.completions.create(
-                    model="openai/gpt-oss-120b",
-                    messages=[
-                        {"role": "system", "content": "你是台灣旅遊專家。只回傳有效的 JSON 格式，不要其他內容。"},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.3,
-                    max_tokens=3000
-                )
-                content = response.choices[0].message.content.strip()
-            
-            # 更強力的清理
-            # 移除可能的 markdown 標記
-            content = content.replace("```json", "").replace("```", "").strip()
-            
-            # 更強力的清理
-            # 移除可能的 markdown 標記
-            content = content.replace("```json", "").replace("```", "").strip()
-            
-            # 移除開頭的非 JSON 字符
-            if not content.startswith("{"):
-                # 找到第一個 { 開始
-                start_idx = content.find("{")
-                if start_idx != -1:
-                    content = content[start_idx:]
-                else:
-                    raise ValueError("找不到 JSON 開始標記")
+        return prompt
+    
+    @staticmethod
+    def _generation_config(duration, max_tokens=None):
+        """Gemini 生成參數（根據天數調整輸出長度，增加容量避免截斷）"""
+        return {
+            "temperature": 0.6,  # 降低溫度提高穩定性
+            "top_p": 0.9,
+            "top_k": 40,
+            "max_output_tokens": max_tokens or min(8000, duration * 800),  # 增加到每天 800 tokens
+            "response_mime_type": "application/json"  # 強制 JSON 輸出
+        }
+    
+    @staticmethod
+    def _usage_backend(client):
+        """token 統計的分類：後端 + 輸出格式（精簡格式的輸出長度不同，分開統計）"""
+        backend = "gemini" if hasattr(client, 'generate_content') else "vllm"
+        return f"{backend}/compact" if ItineraryGenerator.compact_output else backend
+    
+    @staticmethod
+    def _planned_max_tokens(client, duration, preference_count=0):
+        """完整行程的輸出 token 上限（統計不足時：Gemini 每天 800、上限 8000；vLLM 3000）"""
+        default = min(8000, duration * 800) if hasattr(client, 'generate_content') else 3000
+        return ItineraryGenerator.token_planner.plan(
+            ItineraryGenerator._usage_backend(client), duration, preference_count, default
+        )
+    
+    @staticmethod
+    def _record_usage(client, duration, preference_count, output_tokens, finish_reason, content):
+        """記錄完整行程的實際輸出（沒有 usage 時以字元數估計 token 數）"""
+        ItineraryGenerator.token_planner.record(
+            ItineraryGenerator._usage_backend(client),
+            duration,
+            preference_count,
+            output_tokens if output_tokens is not None else len(content),
+            is_truncated(finish_reason)
+        )
+    
+    @staticmethod
+    def _request_content(client, prompt, duration, max_tokens=None, preference_count=0):
+        """
+        送出生成請求並取得完整回應文字
+        
+        未指定 max_tokens 時視為完整行程：上限由 token_planner 規劃，並記錄實際輸出
+        """
+        planned = max_tokens is None
+        if planned:
+            max_tokens = ItineraryGenerator._planned_max_tokens(client, duration, preference_count)
+        
+        # 檢測 client 類型
+        if hasattr(client, 'generate_content'):
+            # Gemini API
+            generation_config = ItineraryGenerator._generation_config(duration, max_tokens)
+            print(f"🤖 使用 Gemini 生成 {duration} 天行程，max_tokens: {generation_config['max_output_tokens']}")
+            response = client.generate_content(prompt, generation_config=generation_config)
+            content = response.text.strip()
+            print(f"✅ Gemini 回應長度: {len(content)} 字元")
             
-            # 移除結尾的非 JSON 字符
-            if not content.endswith("}"):
-                # 找到最後一個 } 結束
-                end_idx = content.rfind("}")
-                if end_idx != -1:
-                    content = content[:end_idx+1]
-                else:
-                    raise ValueError("找不到 JSON 結束標記")
+            usage = getattr(response, "usage_metadata", None)
+            output_tokens = getattr(usage, "candidates_token_count", None)
+            candidates = getattr(response, "candidates", None)
+            finish_reason = getattr(candidates[0], "finish_reason", None) if candidates else None
+        else:
+            # OpenAI compatible API (vLLM)
+            response = client.chat.completions.create(
+                model="openai/gpt-oss-120b",
+                messages=[
+                    {"role": "system", "content": "你是台灣旅遊專家。只回傳有效的 JSON 格式，不要其他內容。"},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.3,
+                max_tokens=max_tokens
+            )
+            content = response.choices[0].message.content.strip()
             
-            # 處理可能的截斷 JSON（移除不完整的最後一個屬性）
-            # 如果 JSON 在解析時失敗，嘗試修復常見問題
-            try:
-                itinerary = json.loads(content)
-            except json.JSONDecodeError as first_error:
-                print(f"第一次解析失敗: {first_error}, 嘗試修復...")
-                
-                # 策略 1: 找到錯誤位置並截斷到最近的完整結構
-                error_pos = first_error.pos
+            output_tokens = getattr(getattr(response, "usage", None), "completion_tokens", None)
+            finish_reason = getattr(response.choices[0], "finish_reason", None)
+        
+        if planned:
+            ItineraryGenerator._record_usage(client, duration, preference_count, output_tokens, finish_reason, content)
+        
+        return content
+    
+    @staticmethod
+    def _stream_content(client, prompt, duration, preference_count=0):
+        """以串流送出生成請求，逐段產出回應文字（串流結束後記錄實際輸出）"""
+        max_tokens = ItineraryGenerator._planned_max_tokens(client, duration, preference_count)
+        parts = []
+        output_tokens = None
+        finish_reason = None
+        
+        if hasattr(client, 'generate_content'):
+            generation_config = ItineraryGenerator._generation_config(duration, max_tokens)
+            print(f"🤖 使用 Gemini 串流生成 {duration} 天行程，max_tokens: {generation_config['max_output_tokens']}")
+            for chunk in client.generate_content(prompt, generation_config=generation_config, stream=True):
+                usage = getattr(chunk, "usage_metadata", None)
+                output_tokens = getattr(usage, "candidates_token_count", None) or output_tokens
+                candidates = getattr(chunk, "candidates", None)
+                if candidates and getattr(candidates[0], "finish_reason", None):
+                    finish_reason = candidates[0].finish_reason
                 
-                # 截斷到錯誤位置之前
-                truncated = content[:error_pos]
+                # 沒有文字的 chunk（例如只帶 finish_reason 或被安全過濾）存取 .text 會丟 ValueError
+                try:
+                    text = getattr(chunk, "text", "")
+                except ValueError:
+                    continue
+                if text:
+                    parts.append(text)
+                    yield text
+        else:
+            stream = client.chat.completions.create(
+                model="openai/gpt-oss-120b",
+                messages=[
+                    {"role": "system", "content": "你是台灣旅遊專家。只回傳有效的 JSON 格式，不要其他內容。"},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.3,
+                max_tokens=max_tokens,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            for chunk in stream:
+                usage = getattr(chunk, "usage", None)
+                output_tokens = getattr(usage, "completion_tokens", None) or output_tokens
+                if chunk.choices and getattr(chunk.choices[0], "finish_reason", None):
+                    finish_reason = chunk.choices[0].finish_reason
                 
-                # 向前尋找最後一個完整的 activity 或 day
-                # 先找最後一個 }
-                last_brace = truncated.rfind('}')
-                if last_brace > 0:
-                    truncated = truncated[:last_brace+1]
-                    
-                    # 補全必要的結構
-                    # 檢查是否在 daily_itinerary 陣列中
-                    if '"daily_itinerary"' in truncated:
-                        # 確保 daily_itinerary 陣列結束
-                        if truncated.count('[') > truncated.count(']'):
-                            truncated += ']' * (truncated.count('[') - truncated.count(']'))
-                        
-                        # 補充缺失的欄位
-                        if '"accommodation_suggestions"' not in truncated:
-                            truncated += ', "accommodation_suggestions": []'
-                        if '"transport_tips"' not in truncated:
-                            truncated += ', "transport_tips": "建議使用大眾運輸工具"'
-                        if '"packing_list"' not in truncated:
-                            truncated += ', "packing_list": ["輕便服裝", "防曬用品"]'
-                        if '"important_notes"' not in truncated:
-                            truncated += ', "important_notes": ["注意天氣變化"]'
-                    
-                    # 補全最外層的 }
-                    open_braces = truncated.count('{') - truncated.count('}')
-                    truncated += '}' * open_braces
-                    
-                    try:
-                        itinerary = json.loads(truncated)
-                        print("截斷修復成功！")
-                    except json.JSONDecodeError as second_error:
-                        print(f"截斷修復失敗: {second_error}, 使用模板...")
-                        raise first_error
-                else:
-                    print("找不到有效的結構，使用模板...")
-                    raise first_error
-            
-            # 驗證必要欄位
-            required_fields = ["trip_name", "location", "duration", "daily_itinerary"]
-            missing_fields = [f for f in required_fields if f not in itinerary]
-            
-            if missing_fields:
-                raise ValueError(f"缺少必要欄位: {missing_fields}")
-            
-            return {
-                "success": True,
-                "data": itinerary
-            }
-            
-        except json.JSONDecodeError as e:
-            print(f"\n❌ JSON 解析錯誤: {e}")
-            print(f"📍 錯誤位置: line {e.lineno} column {e.colno}")
-            print(f"📏 原始內容長度: {len(content)} 字元")
-            print(f"📖 內容開頭 (前300字): {content[:300]}")
-            print(f"📖 內容結尾 (後300字): {content[-300:]}")
-            print(f"\n💡 這通常表示 Gemini 生成的 JSON 不完整或格式錯誤")
-            print(f"💡 系統將使用備用模板（來自 data/trip_templates.json）\n")
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+        
+        ItineraryGenerator._record_usage(client, duration, preference_count, output_tokens, finish_reason, "".join(parts))
+    
+    @staticmethod
+    def _parse_content(content, continuation=False):
+        """
+        清理並解析回應 JSON（含截斷修復）
+        
+        Args:
+            continuation: 接續模式：被截斷的那一天從 daily_itinerary 移出另外回傳
+                （由接續請求重新生成，接續失敗時再放回），且允許沒有任何一天完整的行程
+        
+        Returns:
+            dict: 行程；接續模式回傳 (行程, 被截斷的一天或 None)
+        
+        Raises:
+            ValueError: 缺少 JSON、沒有可保留的內容或缺少必要欄位
+        """
+        from utils.json_repair import repair_json
+        
+        # 單次掃描解析；被截斷或有語法錯誤時保留最長的有效前綴（以天／活動為單位）
+        itinerary, report = repair_json(content)
+        
+        # 截斷在某一天中間：記下那一天，接續模式下整天重新生成
+        partial_day = None
+        days = itinerary.get("daily_itinerary")
+        for path in report.get("unclosed", []):
+            match = re.fullmatch(r"daily_itinerary\[(\d+)\]", path)
+            if match and isinstance(days, list) and int(match.group(1)) < len(days):
+                partial_day = days[int(match.group(1))]
+        
+        # 精簡格式展開成原本的結構（截斷的半個活動在這裡捨棄）
+        itinerary = expand_itinerary(itinerary)
+        
+        if not report["complete"]:
+            print(f"⚠️ 回應不完整（{report['reason']}），已捨棄 {report['dropped_chars']} 字元"
+                  f"{'：' + '、'.join(report['dropped']) if report['dropped'] else ''}，補上 {report['closed']}")
             
-            # 儲存完整內容到檔案以便除錯
+            # 補充缺失的欄位
+            itinerary.setdefault("accommodation_suggestions", [])
+            itinerary.setdefault("transport_tips", "建議使用大眾運輸工具")
+            itinerary.setdefault("packing_list", ["輕便服裝", "防曬用品"])
+            itinerary.setdefault("important_notes", ["注意天氣變化"])
+        
+        # 驗證必要欄位
+        required_fields = ["trip_name", "location", "duration", "daily_itinerary"]
+        missing_fields = [f for f in required_fields if f not in itinerary]
+        
+        if missing_fields:
+            raise ValueError(f"缺少必要欄位: {missing_fields}")
+        
+        if continuation:
+            partial = None
+            if isinstance(partial_day, dict):
+                print(f"✂️ 第 {partial_day.get('day')} 天被截斷，改由接續請求重新生成")
+                kept = []
+                for day in itinerary["daily_itinerary"]:
+                    if isinstance(day, dict) and day.get("day") == partial_day.get("day"):
+                        partial = day
+                    else:
+                        kept.append(day)
+                itinerary["daily_itinerary"] = kept
+            return itinerary, partial
+        
+        if not itinerary["daily_itinerary"]:
+            raise ValueError("沒有完整的每日行程")
+        
+        return itinerary
+    
+    # === 截斷接續生成 ===
+    MAX_CONTINUATIONS = 2  # 接續請求本身也可能被截斷，最多再補幾次
+    
+    @staticmethod
+    def _complete_itinerary(client, content, location, duration, budget=None, preferences=None):
+        """
+        解析完整行程回應；缺少的天（通常是輸出被截斷）以接續請求補上
+        
+        被截斷的那一天只有在接續請求真的補上同一天時才取代；接續失敗或沒有補上時，
+        放回截斷前已完成的活動
+        
+        Returns:
+            tuple: (行程 dict, 第一次解析之後才加入的天 list)
+        
+        Raises:
+            ValueError: 接續後仍沒有任何一天完整的行程
+        """
+        itinerary, partial = ItineraryGenerator._parse_content(content, continuation=True)
+        added = []
+        
+        for _ in range(ItineraryGenerator.MAX_CONTINUATIONS):
+            if not ItineraryGenerator._missing_days(itinerary, duration):
+                break
             try:
-                with open("debug_json_error.txt", "w", encoding="utf-8") as f:
-                    f.write(f"錯誤: {e}\n")
-                    f.write(f"位置: line {e.lineno} column {e.colno}\n")
-                    f.write(f"\n完整內容:\n{content}")
-                print("完整錯誤內容已儲存至 debug_json_error.txt")
-            except:
-                pass
-            
-            return {
-                "success": False,
-                "error": f"JSON 解析失敗: {str(e)}",
-                "fallback": ItineraryGenerator._create_fallback_itinerary(location, duration, budget)
-            }
-        except Exception as e:
-            print(f"生成錯誤: {e}")
-            
-            return {
-                "success": False,
-                "error": str(e),
-                "fallback": ItineraryGenerator._create_fallback_itinerary(location, duration, budget)
-            }
+                days = ItineraryGenerator._continue_itinerary(client, itinerary, location, duration, budget, preferences)
+            except Exception as e:
+                print(f"⚠️ 接續生成失敗: {e}，保留已完成的天")
+                break
+            if not days:
+                break
+            added.extend(days)
+        
+        present = {day.get("day") for day in itinerary["daily_itinerary"] if isinstance(day, dict)}
+        if partial is not None and partial.get("activities") and partial.get("day") not in present:
+            print(f"🩹 接續沒有補上第 {partial.get('day')} 天，保留截斷前完成的 {len(partial['activities'])} 個活動")
+            itinerary["daily_itinerary"] = sorted(
+                itinerary["daily_itinerary"] + [partial],
+                key=lambda day: day.get("day", 0) if isinstance(day, dict) else 0
+            )
+            added.append(partial)
+        
+        if not itinerary["daily_itinerary"]:
+            raise ValueError("沒有完整的每日行程")
+        
+        return itinerary, added
     
     @staticmethod
-    def _create_fallback_itinerary(location, duration, budget):
+    def _missing_days(itinerary, duration):
+        """行程中缺少的天（依 day 編號）"""
+        present = {day.get("day") for day in itinerary.get("daily_itinerary", []) if isinstance(day, dict)}
+        return [day for day in range(1, duration + 1) if day not in present]
+    
+    @staticmethod
+    def _continue_itinerary(client, itinerary, location, duration, budget=None, preferences=None):
         """
-        備用方案：從模板載入高品質行程
+        只請模型生成缺少的天，並依天數順序接回 daily_itinerary
+        
+        prompt 帶入旅程條件與最後完成的一天，讓接續的動線與前面一致
+        
+        Returns:
+            list: 補上的天（已展開成原本的活動結構）
         """
-        import json
-        import os
+        from utils.json_repair import repair_json
+        
+        missing = ItineraryGenerator._missing_days(itinerary, duration)
+        completed = sorted(
+            (day for day in itinerary["daily_itinerary"] if isinstance(day, dict) and isinstance(day.get("day"), int)),
+            key=lambda day: day["day"]
+        )
+        pref_text = "、".join(preferences) if isinstance(preferences, list) else (preferences or "")
+        day_text = "、".join(str(day) for day in missing)
+        done_text = "、".join(f"第{day['day']}天 {day.get('theme', '')}".strip() for day in completed)
+        last_day = json.dumps(completed[-1], ensure_ascii=False) if completed else "無（從第 1 天開始）"
+        
+        if ItineraryGenerator.compact_output:
+            fields = ", ".join(f'"{field}"' for field in ACTIVITY_FIELDS)
+            example = f'''{{
+  "{LEGEND_KEY}": [{fields}],
+  "daily_itinerary": [
+    {{"day": {missing[0]}, "theme": "當天主題", "activities": [
+      ["09:00", "活動名稱", "景點", "具體地點", "2小時", 0, "簡短說明", "🗺️"]
+    ]}}
+  ]
+}}'''
+        else:
+            example = f'''{{
+  "daily_itinerary": [
+    {{
+      "day": {missing[0]},
+      "theme": "當天主題",
+      "activities": [
+        {{"time": "09:00", "name": "活動名稱", "type": "景點", "location": "具體地點", "duration": "2小時", "cost": 0, "note": "簡短說明", "icon": "🗺️"}}
+      ]
+    }}
+  ]
+}}'''
         
-        # 載入行程模板
-        template_path = "data/trip_templates.json"
+        prompt = f"""
+你是專業的台灣旅遊規劃師。{location}{duration}日遊的行程輸出中斷了，請接續規劃第 {day_text} 天，只回傳 JSON，不要其他文字。
+
+- 目的地：{location}
+- 天數：{duration}天
+- 預算：{f'NT$ {budget:,}' if budget else '彈性預算'}
+- 偏好：{pref_text if pref_text else '綜合旅遊'}
+- 已完成的天：{done_text if done_text else '無'}
+- 最後完成的一天（接續它的動線，不要重複景點）：{last_day}
+
+格式：
+{example}
+
+只需要第 {day_text} 天，每天安排 4-5 個活動，包含早中晚餐建議。"""
+        
+        # 上限依缺少的天數規劃（不記錄到 token 統計：接續回應沒有行程的整體欄位）
+        max_tokens = ItineraryGenerator._planned_max_tokens(client, len(missing), len(preferences or []))
+        print(f"🔁 行程缺少第 {day_text} 天，送出接續請求（max_tokens: {max_tokens}）")
+        content = ItineraryGenerator._request_content(client, prompt, len(missing), max_tokens=max_tokens)
+        
+        data, _ = repair_json(content)
+        data = expand_itinerary(data) if isinstance(data, dict) else {}
         
+        wanted = set(missing)
+        added = []
+        for day in data.get("daily_itinerary", []):
+            if isinstance(day, dict) and day.get("day") in wanted and day.get("activities"):
+                wanted.discard(day["day"])
+                added.append(day)
+        
+        itinerary["daily_itinerary"] = sorted(
+            itinerary["daily_itinerary"] + added,
+            key=lambda day: day.get("day", 0) if isinstance(day, dict) else 0
+        )
+        print(f"✅ 接續補上 {len(added)} 天")
+        return added
+    
+    @staticmethod
+    def _json_error_result(e, content, location, duration, budget, preferences=None, prompt=None):
+        """JSON 解析失敗：記錄除錯資訊並回傳模板行程"""
+        print(f"\n❌ JSON 解析錯誤: {e}")
+        print(f"📍 錯誤位置: line {e.lineno} column {e.colno}")
+        print(f"📏 原始內容長度: {len(content)} 字元")
+        print(f"📖 內容開頭 (前300字): {content[:300]}")
+        print(f"📖 內容結尾 (後300字): {content[-300:]}")
+        print(f"\n💡 這通常表示 Gemini 生成的 JSON 不完整或格式錯誤")
+        print(f"💡 系統將使用備用模板（來自 data/trip_templates.json）\n")
+        
+        # 完整內容交給背景寫入失敗語料（不阻塞請求，也不覆蓋先前的案例）
+        ItineraryGenerator._capture_failure(e, content, prompt, location, duration, budget, preferences)
+        
+        return {
+            "success": False,
+            "error": f"JSON 解析失敗: {str(e)}",
+            "fallback": ItineraryGenerator._create_fallback_itinerary(location, duration, budget, preferences)
+        }
+    
+    @staticmethod
+    def _capture_failure(error, content, prompt, location, duration, budget=None, preferences=None):
+        """將無法解析的回應排入失敗語料（未設定語料時略過）"""
+        corpus = ItineraryGenerator.failure_corpus
+        if corpus is None:
+            return
+        if corpus.capture(
+            content,
+            prompt=prompt,
+            error=error,
+            location=location,
+            duration=duration,
+            budget=budget,
+            preferences=preferences,
+            compact=ItineraryGenerator.compact_output
+        ):
+            print(f"🗃️ 原始回應已排入失敗語料（{corpus.directory}）")
+    
+    @staticmethod
+    def _create_fallback_itinerary(location, duration, budget, preferences=None):
+        """
+        備用方案：從模板索引取出高品質行程（沒有該天數的模板時依偏好組合不重複的天）
+        
+        模板內部結構為共用的唯讀資料，需要修改時請先 copy.deepcopy
+        """
         try:
-            if os.path.exists(template_path):
-                with open(template_path, 'r', encoding='utf-8') as f:
-                    templates = json.load(f)
-                
-                # 尋找匹配的模板
-                if location in templates:
-                    duration_key = f"{duration}天"
-                    
-                    # 精確匹配
-                    if duration_key in templates[location]:
-                        template = templates[location][duration_key]
-                        
-                        # 調整預算
-                        if budget:
-                            template['total_budget'] = budget
-                            template['budget_breakdown'] = {
-                                "accommodation": int(budget * 0.3),
-                                "food": int(budget * 0.3),
-                                "transport": int(budget * 0.2),
-                                "activities": int(budget * 0.2)
-                            }
-                        
-                        return template
-                    
-                    # 尋找最接近的天數
-                    available_durations = list(templates[location].keys())
-                    if available_durations:
-                        # 使用第一個可用模板
-                        closest_template = templates[location][available_durations[0]]
-                        
-                        # 調整天數（簡單複製或刪減）
-                        if duration > len(closest_template['daily_itinerary']):
-                            # 需要更多天，複製最後一天
-                            while len(closest_template['daily_itinerary']) < duration:
-                                last_day = closest_template['daily_itinerary'][-1].copy()
-                                last_day['day'] = len(closest_template['daily_itinerary']) + 1
-                                closest_template['daily_itinerary'].append(last_day)
-                        elif duration < len(closest_template['daily_itinerary']):
-                            # 需要較少天，截取前N天
-                            closest_template['daily_itinerary'] = closest_template['daily_itinerary'][:duration]
-                        
-                        closest_template['duration'] = duration
-                        
-                        if budget:
-                            closest_template['total_budget'] = budget
-                        
-                        return closest_template
+            template = ItineraryGenerator.template_index.lookup(location, duration, budget, preferences)
+            if template is not None:
+                return template
         
         except Exception as e:
             print(f"載入模板失敗: {e}")
         
-        # 如果模板不存在或載入失敗，使用基本架構
+        # 模板檔載入失敗時使用基本架構
         return ItineraryGenerator._create_basic_itinerary(location, duration, budget)
     
     @staticmethod
     def _create_basic_itinerary(location, duration, budget):
-        """最基本的行程架構（終極備案）"""
-        
-        total_budget = budget if budget else duration * 5000
-        
-        daily_itinerary = []
-        for day in range(1, duration + 1):
-            daily_itinerary.append({
-                "day": day,
-                "theme": f"Day {day} - {location}探索",
-                "activities": [
-                    {
-                        "time": "09:00",
-                        "name": "早餐時光",
-                        "type": "美食",
-                        "location": location,
-                        "duration": "1小時",
-                        "cost": 150,
-                        "note": "探索在地早餐小吃",
-                        "icon": "🍳"
-                    },
-                    {
-                        "time": "10:30",
-                        "name": "上午景點",
-                        "type": "景點",
-                        "location": location,
-                        "duration": "2小時",
-                        "cost": 200,
-                        "note": "參觀當地主要景點",
-                        "icon": "🏛️"
-                    },
-                    {
-                        "time": "13:00",
-                        "name": "午餐時間",
-                        "type": "美食",
-                        "location": location,
-                        "duration": "1.5小時",
-                        "cost": 300,
-                        "note": "品嚐當地特色料理",
-                        "icon": "🍜"
-                    },
-                    {
-                        "time": "15:00",
-                        "name": "下午活動",
-                        "type": "景點",
-                        "location": location,
-                        "duration": "2小時",
-                        "cost": 150,
-                        "note": "休閒漫遊或文化體驗",
-                        "icon": "🎨"
-                    },
-                    {
-                        "time": "18:30",
-                        "name": "晚餐 & 夜市",
-                        "type": "美食",
-                        "location": location,
-                        "duration": "2小時",
-                        "cost": 400,
-                        "note": "夜市美食巡禮",
-                        "icon": "🌙"
-                    }
-                ]
-            })
-        
-        return {
-            "trip_name": f"{location}{duration}日遊",
-            "location": location,
-            "duration": duration,
-            "total_budget": total_budget,
-            "budget_breakdown": {
-                "accommodation": int(total_budget * 0.3),
-                "food": int(total_budget * 0.3),
-                "transport": int(total_budget * 0.2),
-                "activities": int(total_budget * 0.2)
-            },
-            "daily_itinerary": daily_itinerary,
-            "accommodation_suggestions": [
-                {
-                    "name": f"{location}市中心旅館",
-                    "type": "商務旅館",
-                    "area": "市中心",
-                    "price_range": f"NT$ {int(total_budget * 0.15):,}-{int(total_budget * 0.2):,}/晚",
-                    "reason": "交通便利，近主要景點"
-                }
-            ],
-            "transport_tips": "建議使用大眾運輸工具，可購買一日券較划算",
-            "packing_list": ["防曬用品", "雨具", "舒適步鞋", "相機", "充電器"],
-            "important_notes": ["注意天氣變化", "提前訂房享優惠", "夜市記得空腹去", "保持彈性調整行程"]
-        }
+        """最基本的行程架構（終極備案，模板索引無法使用時）：通用單日行程依序輪替"""
+        return generic_template(location, duration, budget if budget else duration * 5000)
     
     @staticmethod
     def convert_to_trip_format(itinerary_data):
         """將 AI 生成的行程轉換為系統格式"""
         from utils.trip_manager import TripManager
         from datetime import datetime, timedelta
+        import copy
         
         # 建立行程
         start_date = datetime.now() + timedelta(days=7)  # 預設一週後出發
@@ -429,13 +1104,13 @@ JSON 格式範例：
                 "day": day_plan['day'],
                 "date": (start_date + timedelta(days=day_plan['day']-1)).strftime("%Y-%m-%d"),
                 "theme": day_plan.get('theme', ''),
-                "activities": day_plan['activities']
+                "activities": copy.deepcopy(day_plan['activities'])
             })
         
-        # 加入其他資訊
-        trip['accommodation_suggestions'] = itinerary_data.get('accommodation_suggestions', [])
+        # 加入其他資訊（複製一份，行程之後可編輯而不影響共用的模板）
+        trip['accommodation_suggestions'] = copy.deepcopy(itinerary_data.get('accommodation_suggestions', []))
         trip['transport_tips'] = itinerary_data.get('transport_tips', '')
-        trip['packing_list'] = itinerary_data.get('packing_list', [])
+        trip['packing_list'] = list(itinerary_data.get('packing_list', []))
         trip['notes'] = "\n".join(itinerary_data.get('important_notes', []))
         
         return trip
@@ -0,0 +1,232 @@
+"""
+容錯 JSON 修復
+LLM 回應常被截斷或夾雜 markdown。以單次掃描、堆疊追蹤結構（認得字串與跳脫字元），
+遇到截斷或語法錯誤時保留最長的有效前綴：陣列中未完成的物件（某一天、某個活動）
+整個捨棄，其餘未關閉的結構依序補上結尾括號，並回報捨棄了哪些部分
+"""
+
+import json
+import re
+
+# 字串內只需要找下一個引號或反斜線
+_STRING_SPECIAL = re.compile(r'["\\]')
+_SCALAR_END = re.compile(r'[\s,\]}:"\[{]')
+_WHITESPACE = re.compile(r"\s*")
+
+
+class _Frame:
+    """一層未關閉的物件或陣列"""
+
+    __slots__ = ("kind", "path", "safe_end", "count", "expect", "key", "in_array", "nested")
+
+    def __init__(self, kind, path, start, in_array):
+        self.kind = kind            # "{" 或 "["
+        self.path = path            # 例如 daily_itinerary[1].activities
+        self.safe_end = start + 1   # 最後一個完整成員之後的位置
+        self.count = 0              # 完整成員數
+        self.expect = "key" if kind == "{" else "value"
+        self.key = None             # 物件目前成員的鍵
+        self.in_array = in_array    # 是否為陣列元素
+        self.nested = False         # 是否已有完整且非空的巢狀成員
+
+
+def repair_json(text):
+    """
+    解析（必要時修復）LLM 回應中的第一個 JSON 物件
+
+    Args:
+        text: 原始回應（可含 markdown 標記或前後說明文字）
+
+    Returns:
+        tuple: (解析後的 dict, 報告 dict)
+            報告欄位：complete（是否原本就完整）、reason（truncated / syntax_error）、
+            dropped（捨棄的路徑）、closed（補上的括號）、unclosed（補上括號的結構路徑，由外而內）、
+            dropped_chars（捨棄的字元數）
+
+    Raises:
+        ValueError: 找不到 JSON 物件，或沒有任何可保留的內容
+    """
+    start = text.find("{")
+    if start == -1:
+        raise ValueError("找不到 JSON 開始標記")
+
+    stack = []
+    length = len(text)
+    pos = start
+    reason = "syntax_error"
+
+    def complete_value(end):
+        frame = stack[-1]
+        frame.count += 1
+        frame.safe_end = end
+        frame.expect = "comma"
+
+    while pos < length:
+        char = text[pos]
+
+        if char == '"':
+            # 掃描字串到結尾引號
+            cursor = pos + 1
+            while True:
+                match = _STRING_SPECIAL.search(text, cursor)
+                if match is None:
+                    cursor = None
+                    break
+                if match.group() == "\\":
+                    cursor = match.end() + 1
+                    continue
+                cursor = match.end()
+                break
+
+            if cursor is None or cursor > length:
+                reason = "truncated"  # 截斷在字串中
+                break
+
+            frame = stack[-1] if stack else None
+            if frame is None:
+                break
+            if frame.kind == "{" and frame.expect == "key":
+                frame.key = text[pos + 1:cursor - 1]
+                frame.expect = "colon"
+            elif frame.expect == "value":
+                complete_value(cursor)
+            else:
+                break
+            pos = cursor
+            continue
+
+        if char in "{[":
+            if stack:
+                frame = stack[-1]
+                if frame.expect != "value":
+                    break
+                if frame.kind == "[":
+                    path = f"{frame.path}[{frame.count}]"
+                else:
+                    path = f"{frame.path}.{frame.key}" if frame.path else frame.key
+                stack.append(_Frame(char, path, pos, frame.kind == "["))
+            elif char == "{":
+                stack.append(_Frame(char, "", pos, False))
+            else:
+                break
+            pos += 1
+            continue
+
+        if char in "}]":
+            frame = stack[-1]
+            expected = "}" if frame.kind == "{" else "]"
+            if char != expected or not (frame.expect == "comma" or frame.count == 0 and frame.expect in ("key", "value")):
+                break
+            stack.pop()
+            if stack and frame.count:
+                stack[-1].nested = True
+            if not stack:
+                # 根物件完整
+                return json.loads(text[start:pos + 1]), {
+                    "complete": True,
+                    "reason": None,
+                    "dropped": [],
+                    "closed": "",
+                    "unclosed": [],
+                    "dropped_chars": 0
+                }
+            complete_value(pos + 1)
+            pos += 1
+            continue
+
+        if char == ":":
+            frame = stack[-1]
+            if frame.kind != "{" or frame.expect != "colon":
+                break
+            frame.expect = "value"
+            pos += 1
+            continue
+
+        if char == ",":
+            frame = stack[-1]
+            if frame.expect != "comma":
+                break
+            frame.expect = "key" if frame.kind == "{" else "value"
+            pos += 1
+            continue
+
+        if char.isspace():
+            pos = _WHITESPACE.match(text, pos).end()
+            continue
+
+        # 數字、true、false、null
+        frame = stack[-1]
+        if frame.expect != "value":
+            break
+        match = _SCALAR_END.search(text, pos)
+        if match is None:
+            reason = "truncated"  # 截斷在純量中（可能不完整）
+            break
+        try:
+            json.loads(text[pos:match.start()])
+        except json.JSONDecodeError:
+            break
+        complete_value(match.start())
+        pos = match.start()
+    else:
+        reason = "truncated"
+
+    return _close_truncated(text, start, stack, pos, reason)
+
+
+def _close_truncated(text, start, stack, stop, reason):
+    """
+    由內而外關閉未完成的結構（語法錯誤時，錯誤位置之後的內容視同截斷）
+
+    陣列中的物件若沒有保留任何非空的巢狀內容就整個捨棄（例如只寫到一半的活動），
+    其餘結構補上結尾括號
+    """
+    dropped = []
+    closed = []
+    unclosed = []
+    cut = None
+    child_kept = False
+    child_nonempty = False
+
+    for frame in reversed(stack):
+        if cut is None or not child_kept:
+            cut = frame.safe_end
+            has_content = frame.count > 0
+            progressed = frame.nested
+        else:
+            has_content = True
+            progressed = child_nonempty or frame.nested
+
+        if frame.kind == "{" and frame.in_array and not progressed:
+            # 連同已處理的子結構一起捨棄，只回報最外層
+            dropped = [path for path in dropped if not path.startswith(frame.path)]
+            dropped.append(frame.path)
+            unclosed = [path for path in unclosed if not path.startswith(frame.path)]
+            closed = []
+            child_kept = False
+            continue
+
+        closed.append("}" if frame.kind == "{" else "]")
+        unclosed.insert(0, frame.path or "$")
+        child_kept = True
+        child_nonempty = has_content
+
+    if not child_kept:
+        raise ValueError("JSON 沒有可保留的內容")
+
+    # 最內層保留結構之後的不完整成員也一併捨棄
+    if stack and text[stack[-1].safe_end:stop].strip() and not dropped:
+        innermost = stack[-1]
+        dropped.append(f"{innermost.path or '$'} 的未完成成員")
+
+    closers = "".join(closed)
+    data = json.loads(text[start:cut] + closers)
+
+    return data, {
+        "complete": False,
+        "reason": reason,
+        "dropped": dropped,
+        "closed": closers,
+        "unclosed": unclosed,
+        "dropped_chars": len(text) - cut
+    }
@@ -0,0 +1,109 @@
+"""
+增量 JSON 解析
+串流生成行程時逐段餵入文字，daily_itinerary 中每一天的物件
+一收到結尾的 } 就解析並產出，不必等整份 JSON 完成
+"""
+
+import json
+
+
+class DailyItineraryParser:
+    """從串流文字中取出 daily_itinerary 陣列的每個元素"""
+
+    TARGET_KEY = "daily_itinerary"
+
+    def __init__(self, target_key=TARGET_KEY):
+        """
+        Args:
+            target_key: 要逐一產出元素的陣列鍵名
+        """
+        self.target_key = target_key
+
+        self._buffer = []         # 目前元素的字元（只在元素內累積）
+        self._stack = []          # 括號堆疊：'{' 或 '['
+        self._in_string = False
+        self._escape = False
+        self._string_chars = []   # 目前字串內容（只在元素外記錄，用來辨識鍵名）
+        self._last_string = None  # 元素外最近一個完整字串
+        self._pending_key = None  # 剛讀到「鍵:」，等待值開始
+        self._array_depth = None  # 目標陣列在堆疊中的深度
+        self._item_depth = None   # 目前元素在堆疊中的深度
+
+        self.days_emitted = 0
+
+    def feed(self, text):
+        """
+        餵入新收到的文字
+
+        Returns:
+            list: 本次完成的元素（已解析成 dict）
+        """
+        completed = []
+
+        for char in text:
+            in_item = self._item_depth is not None
+            if in_item:
+                self._buffer.append(char)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if not in_item:
+                        self._last_string = "".join(self._string_chars)
+                elif not in_item:
+                    self._string_chars.append(char)
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_chars = []
+            elif char == ":":
+                self._pending_key = self._last_string
+            elif char in "{[":
+                self._open(char)
+            elif char in "}]":
+                item = self._close()
+                if item is not None:
+                    completed.append(item)
+            elif not char.isspace():
+                self._pending_key = None
+
+        return completed
+
+    def _open(self, char):
+        self._stack.append(char)
+        depth = len(self._stack)
+
+        if char == "[" and self._pending_key == self.target_key and self._array_depth is None:
+            self._array_depth = depth
+        elif char == "{" and self._array_depth is not None and depth == self._array_depth + 1:
+            self._item_depth = depth
+            self._buffer = ["{"]
+
+        self._pending_key = None
+
+    def _close(self):
+        depth = len(self._stack)
+        if self._stack:
+            self._stack.pop()
+        self._pending_key = None
+
+        if self._item_depth is not None and depth == self._item_depth:
+            raw = "".join(self._buffer)
+            self._item_depth = None
+            self._buffer = []
+            try:
+                item = json.loads(raw)
+            except json.JSONDecodeError:
+                return None
+            self.days_emitted += 1
+            return item
+
+        if self._array_depth is not None and depth == self._array_depth:
+            self._array_depth = None
+
+        return None
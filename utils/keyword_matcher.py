@@ -0,0 +1,92 @@
+"""
+多關鍵字比對器（Aho-Corasick 自動機）
+用於一次掃描訊息即可找出所有詞彙表中的關鍵字
+"""
+
+from collections import deque
+
+
+class KeywordMatcher:
+    """Aho-Corasick 多模式字串比對器"""
+
+    def __init__(self):
+        # 每個節點：子節點表、失敗連結、輸出（關鍵字, payload）列表
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        self._built = False
+
+    def add(self, keyword, payload):
+        """
+        加入關鍵字
+
+        Args:
+            keyword: 關鍵字字串
+            payload: 比對成功時一併回傳的資料
+        """
+        if not keyword:
+            return
+
+        node = 0
+        for char in keyword:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = next_node
+
+        self._output[node].append((keyword, payload))
+        self._built = False
+
+    def build(self):
+        """建立失敗連結（BFS）"""
+        queue = deque()
+
+        for node in self._goto[0].values():
+            self._fail[node] = 0
+            queue.append(node)
+
+        while queue:
+            current = queue.popleft()
+            for char, child in self._goto[current].items():
+                queue.append(child)
+
+                fallback = self._fail[current]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                if self._fail[child] == child:
+                    self._fail[child] = 0
+
+                # 合併失敗節點的輸出，掃描時不需再沿失敗鏈收集
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+        self._built = True
+        return self
+
+    def iter_matches(self, text):
+        """
+        掃描文字，依結束位置順序產生所有比對結果
+
+        Yields:
+            tuple: (起始位置, 關鍵字, payload)
+        """
+        if not self._built:
+            self.build()
+
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        node = 0
+
+        for index, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+
+            for keyword, payload in output[node]:
+                yield index - len(keyword) + 1, keyword, payload
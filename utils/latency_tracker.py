@@ -0,0 +1,50 @@
+"""
+延遲統計
+記錄各後端成功完成行程生成所需的時間，以近期的高百分位（預設 p90）
+決定對沖（hedged）請求要等多久才送出備援請求：
+只有最慢的約一成請求會多送一次，平均成本幾乎不變，尾端延遲則大幅縮短
+"""
+
+import math
+import threading
+from collections import deque
+
+
+class LatencyTracker:
+    """各後端的滾動延遲分位數"""
+
+    def __init__(self, window=100, percentile=0.9, min_samples=5, default=10.0):
+        """
+        Args:
+            window: 每個後端保留的最近樣本數
+            percentile: 對沖延遲使用的百分位
+            min_samples: 樣本數不足時使用 default
+            default: 預設對沖延遲（秒）
+        """
+        self.window = window
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.default = default
+
+        self._samples = {}  # 後端 → deque[秒數]
+        self._lock = threading.Lock()
+
+    def record(self, backend, seconds):
+        with self._lock:
+            self._samples.setdefault(backend, deque(maxlen=self.window)).append(seconds)
+
+    def delay(self, backend):
+        """對沖延遲：近期延遲的百分位（秒）"""
+        with self._lock:
+            samples = sorted(self._samples.get(backend, ()))
+
+        if len(samples) < self.min_samples:
+            return self.default
+
+        index = min(len(samples) - 1, max(0, math.ceil(self.percentile * len(samples)) - 1))
+        return samples[index]
+
+    def stats(self, backend):
+        with self._lock:
+            samples = list(self._samples.get(backend, ()))
+        return {"samples": len(samples), "delay": self.delay(backend)}
@@ -0,0 +1,135 @@
+"""
+數量詞法分析器
+單次掃描訊息，輸出天數、人數、預算等型別化 token（支援中文數字）
+"""
+
+import re
+from collections import namedtuple
+
+QuantityToken = namedtuple("QuantityToken", ["kind", "value", "start", "end"])
+
+# === 中文數字 ===
+CHINESE_DIGITS = {
+    '一': 1, '二': 2, '兩': 2, '两': 2, '三': 3, '四': 4,
+    '五': 5, '六': 6, '七': 7, '八': 8, '九': 9
+}
+
+CHINESE_UNITS = {'十': 10, '百': 100, '千': 1000}
+
+CHINESE_SECTION_UNITS = {'萬': 10000, '万': 10000}
+
+# 阿拉伯數字（可含小數）或以數字/「十」開頭的中文數字
+_NUMBER = r'(?:\d+(?:\.\d+)?(?![\d.])|[零〇一二兩两三四五六七八九十][零〇一二兩两三四五六七八九十百千萬万]*)'
+
+# 序數或相對時間（第二天、這兩天、前兩週）不是行程長度；也不從中文數字中間開始比對（第十二天的「二天」）
+_NOT_LENGTH = r'(?<![月\d第前這这那後后每頭头零〇一二兩两三四五六七八九十百千萬万])'
+
+_TOKEN_PATTERN = re.compile(rf'''
+    (?P<weekend>週末|周末)
+  | {_NOT_LENGTH}(?P<days>{_NUMBER})\s*個?\s*(?:天|日)(?:\s*(?P<nights>{_NUMBER})\s*(?:夜|晚))?
+  | {_NOT_LENGTH}(?P<weeks>{_NUMBER})\s*個?\s*(?:週|周|星期|禮拜)
+  | (?P<people>{_NUMBER})\s*個?\s*(?:人|位)
+  | (?P<money>{_NUMBER})\s*(?P<money_unit>萬|万|千)?\s*(?P<currency>元|塊)?(?!\s*年)
+''', re.VERBOSE)
+
+# 預算下限（避免把「台北101」之類的數字當成預算）
+MIN_BUDGET = 1000
+
+
+def parse_number(text):
+    """
+    解析阿拉伯或中文數字
+
+    Examples:
+        "3" → 3, "1.5" → 1.5, "十二" → 12, "一萬五" → 15000, "三四" → 3（範圍取前者）
+
+    Returns:
+        int/float，無法解析則回傳 None
+    """
+    if not text:
+        return None
+
+    if text[0].isdigit():
+        value = float(text)
+        return int(value) if value.is_integer() else value
+
+    total = 0        # 已完成的「萬」段
+    section = 0      # 目前段落（萬以下）
+    digit = None     # 尚未乘上單位的數字
+    last_unit = 10   # 上一個單位，用於口語省略（一萬五 = 15000）
+
+    for char in text:
+        if char in ('零', '〇'):
+            # 「一萬零五」：零之後的數字為個位數
+            last_unit = 10
+        elif char in CHINESE_DIGITS:
+            if digit is not None:
+                # 連續數字（三四天）視為範圍，取前者
+                break
+            digit = CHINESE_DIGITS[char]
+        elif char in CHINESE_UNITS:
+            unit = CHINESE_UNITS[char]
+            section += (1 if digit is None else digit) * unit
+            digit = None
+            last_unit = unit
+        elif char in CHINESE_SECTION_UNITS:
+            unit = CHINESE_SECTION_UNITS[char]
+            total += (section + (digit or 0)) * unit
+            section = 0
+            digit = None
+            last_unit = unit
+        else:
+            return None
+
+    if digit is not None:
+        section += digit * (last_unit // 10 if last_unit > 10 else 1)
+
+    return total + section
+
+
+def tokenize(message):
+    """
+    單次掃描訊息，產生數量 token
+
+    Returns:
+        list[QuantityToken]: kind 為 "duration" / "people" / "budget"
+    """
+    tokens = []
+
+    for match in _TOKEN_PATTERN.finditer(message):
+        start, end = match.span()
+
+        if match.group("weekend"):
+            tokens.append(QuantityToken("duration", 2, start, end))
+
+        elif match.group("days"):
+            days = parse_number(match.group("days"))
+            if days:
+                tokens.append(QuantityToken("duration", int(days), start, end))
+
+        elif match.group("weeks"):
+            weeks = parse_number(match.group("weeks"))
+            if weeks:
+                tokens.append(QuantityToken("duration", int(weeks * 7), start, end))
+
+        elif match.group("people"):
+            people = parse_number(match.group("people"))
+            if people:
+                tokens.append(QuantityToken("people", int(people), start, end))
+
+        else:
+            raw = match.group("money")
+            amount = parse_number(raw)
+            if amount is None:
+                continue
+
+            unit = match.group("money_unit")
+            if unit:
+                amount *= CHINESE_SECTION_UNITS.get(unit, 1000)
+
+            # 純阿拉伯數字需 4 位數以上，或帶有單位／幣別
+            explicit = unit or match.group("currency") or not raw[0].isdigit() or len(raw) >= 4
+            if explicit and amount >= MIN_BUDGET:
+                tokens.append(QuantityToken("budget", int(amount), start, end))
+
+    return tokens
@@ -0,0 +1,364 @@
+"""
+Gemini 配額排程
+每次 Gemini 呼叫前先向排程器預約：每分鐘請求數與 token 數各一個令牌桶，
+另有每日請求與 token 上限。預計等待超過期限、等待佇列已滿或今日配額用盡時
+直接拋出 QuotaExceeded，呼叫端改用快取或模板，不再打到 API 才失敗。
+每日用量寫入 SQLite，重啟後仍知道今天還剩多少配額
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+try:
+    from zoneinfo import ZoneInfo
+    QUOTA_TIMEZONE = ZoneInfo("America/Los_Angeles")  # Gemini 每日配額在太平洋時間午夜重置
+except Exception:
+    QUOTA_TIMEZONE = timezone(timedelta(hours=-8))
+
+# 沒有指定 max_output_tokens 時預估的輸出 token 數
+DEFAULT_OUTPUT_TOKENS = 1024
+
+
+class QuotaExceeded(RuntimeError):
+    """預計等待超過期限、等待佇列已滿或今日配額用盡"""
+
+    def __init__(self, message, wait=None):
+        super().__init__(message)
+        self.wait = wait
+
+
+def quota_day():
+    """目前的配額日（太平洋時間日期）"""
+    return datetime.now(QUOTA_TIMEZONE).date().isoformat()
+
+
+def estimate_tokens(text):
+    """粗估輸入 token 數（中文約一字一個 token，英數約四個字元一個 token）"""
+    text = str(text or "")
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    return (len(text) - ascii_chars) + ascii_chars // 4 + 1
+
+
+class TokenBucket:
+    """令牌桶（允許預約成負值：後來的請求依序排在前面的預約之後）"""
+
+    def __init__(self, rate_per_minute, capacity=None, clock=time.monotonic):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self._clock = clock
+        self._level = float(self.capacity)
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount):
+        """取得 amount 個令牌需要等待的秒數"""
+        self._refill()
+        if self._level >= amount:
+            return 0.0
+        return (amount - self._level) / self.rate if self.rate > 0 else float("inf")
+
+    def take(self, amount):
+        self._refill()
+        self._level -= amount
+
+    def give_back(self, amount):
+        """退回多預約的令牌（實際用量低於預估時）；amount 為負表示追加扣除"""
+        self._refill()
+        self._level = min(self.capacity, self._level + amount)
+
+    def drain(self):
+        """清空（收到配額錯誤時，之後的請求至少等一個補充週期）"""
+        self._refill()
+        self._level = min(self._level, 0.0)
+
+    @property
+    def level(self):
+        self._refill()
+        return self._level
+
+
+class QuotaScheduler:
+    """程序內共用的 Gemini 配額排程器（執行緒安全）"""
+
+    def __init__(self, requests_per_minute=10, tokens_per_minute=1_000_000, requests_per_day=1500,
+                 tokens_per_day=None, max_queue=8, deadline=20.0, db_path=None,
+                 clock=time.monotonic, today=quota_day):
+        """
+        Args:
+            requests_per_minute: 每分鐘請求上限（RPM）
+            tokens_per_minute: 每分鐘 token 上限（TPM，輸入加輸出）
+            requests_per_day: 每日請求上限（RPD）
+            tokens_per_day: 每日 token 上限（None 表示不限）
+            max_queue: 最多幾個請求同時等待配額
+            deadline: 預設可接受的最長等待秒數
+            db_path: 每日用量的 SQLite 檔案路徑（None 表示只用記憶體）
+            clock: 取得目前時間的函式（測試時可替換）
+            today: 取得配額日的函式（測試時可替換）
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.requests_per_day = requests_per_day
+        self.tokens_per_day = tokens_per_day
+        self.max_queue = max_queue
+        self.deadline = deadline
+        self._clock = clock
+        self._today = today
+
+        self._request_bucket = TokenBucket(requests_per_minute, clock=clock)
+        self._token_bucket = TokenBucket(tokens_per_minute, clock=clock)
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._blocked_until = 0.0
+        self._db = None
+
+        self._day = today()
+        self.daily_requests = 0
+        self.daily_tokens = 0
+
+        self.granted = 0
+        self.rejected = 0
+        self.waited = 0.0
+
+        if db_path:
+            self._open_db(db_path)
+
+    # === 每日用量（SQLite）===
+
+    def _open_db(self, db_path):
+        try:
+            directory = os.path.dirname(db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS quota_usage "
+                "(day TEXT PRIMARY KEY, requests INTEGER NOT NULL, tokens INTEGER NOT NULL)"
+            )
+            self._db.execute("DELETE FROM quota_usage WHERE day < ?", (self._day,))
+            self._db.commit()
+
+            row = self._db.execute(
+                "SELECT requests, tokens FROM quota_usage WHERE day = ?", (self._day,)
+            ).fetchone()
+            if row:
+                self.daily_requests, self.daily_tokens = row
+                print(f"📂 今日 Gemini 用量：{self.daily_requests} 次請求、{self.daily_tokens} tokens")
+        except sqlite3.Error as e:
+            print(f"⚠️ 配額資料庫無法開啟，只在記憶體中計數: {e}")
+            self._db = None
+
+    def _save(self):
+        if self._db is None:
+            return
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO quota_usage (day, requests, tokens) VALUES (?, ?, ?)",
+                (self._day, self.daily_requests, self.daily_tokens)
+            )
+            self._db.commit()
+        except sqlite3.Error as e:
+            print(f"⚠️ 配額用量寫入失敗: {e}")
+
+    def _rollover(self):
+        """跨日時重置每日用量"""
+        today = self._today()
+        if today != self._day:
+            self._day = today
+            self.daily_requests = 0
+            self.daily_tokens = 0
+
+    # === 公開介面 ===
+
+    def acquire(self, estimated_tokens, deadline=None):
+        """
+        預約一次請求（必要時等待到配額足夠）
+
+        Args:
+            estimated_tokens: 預估的輸入加輸出 token 數
+            deadline: 可接受的最長等待秒數（None 使用預設值）
+
+        Returns:
+            int: 實際預約的 token 數（回報用量時傳回 settle）
+
+        Raises:
+            QuotaExceeded: 今日配額用盡、等待佇列已滿或預計等待超過期限
+        """
+        deadline = self.deadline if deadline is None else deadline
+
+        with self._lock:
+            self._rollover()
+
+            if self.daily_requests >= self.requests_per_day:
+                self.rejected += 1
+                raise QuotaExceeded(f"今日 Gemini 請求配額已用完（{self.requests_per_day} 次）")
+            if self.tokens_per_day is not None and self.daily_tokens + estimated_tokens > self.tokens_per_day:
+                self.rejected += 1
+                raise QuotaExceeded(f"今日 Gemini token 配額已用完（{self.tokens_per_day:,}）")
+
+            wait = max(
+                0.0,
+                self._request_bucket.wait_time(1),
+                self._token_bucket.wait_time(estimated_tokens),
+                self._blocked_until - self._clock()
+            )
+            if wait > 0 and self._waiting >= self.max_queue:
+                self.rejected += 1
+                raise QuotaExceeded(f"Gemini 等待佇列已滿（{self.max_queue} 個請求）", wait)
+            if wait > deadline:
+                self.rejected += 1
+                raise QuotaExceeded(f"Gemini 配額預計需等待 {wait:.0f} 秒，超過 {deadline:.0f} 秒上限", wait)
+
+            # 先預約再等待：之後的請求會排在這次預約之後
+            self._request_bucket.take(1)
+            self._token_bucket.take(estimated_tokens)
+            self.daily_requests += 1
+            self.daily_tokens += estimated_tokens
+            self.granted += 1
+            self._save()
+
+            if wait > 0:
+                self._waiting += 1
+                self.waited += wait
+
+        if wait > 0:
+            print(f"⏳ 等待 Gemini 配額 {wait:.1f} 秒")
+            try:
+                time.sleep(wait)
+            finally:
+                with self._lock:
+                    self._waiting -= 1
+
+        return estimated_tokens
+
+    def settle(self, reserved_tokens, actual_tokens):
+        """以實際用量修正預約（多退少補）"""
+        if actual_tokens is None:
+            return
+        with self._lock:
+            self._token_bucket.give_back(reserved_tokens - actual_tokens)
+            self.daily_tokens = max(0, self.daily_tokens + actual_tokens - reserved_tokens)
+            self._save()
+
+    def record_exhausted(self, retry_after=60.0):
+        """API 回報配額錯誤（429）：清空令牌桶，retry_after 秒內的請求都視為需要等待"""
+        with self._lock:
+            self._request_bucket.drain()
+            self._token_bucket.drain()
+            self._blocked_until = max(self._blocked_until, self._clock() + retry_after)
+        print(f"⛔ Gemini 回報配額已滿，{retry_after:.0f} 秒內改用快取或模板")
+
+    def stats(self):
+        """取得用量統計"""
+        with self._lock:
+            self._rollover()
+            return {
+                "day": self._day,
+                "daily_requests": self.daily_requests,
+                "daily_tokens": self.daily_tokens,
+                "remaining_requests": max(0, self.requests_per_day - self.daily_requests),
+                "minute_requests_available": max(0, int(self._request_bucket.level)),
+                "waiting": self._waiting,
+                "blocked_for": max(0.0, self._blocked_until - self._clock()),
+                "granted": self.granted,
+                "rejected": self.rejected
+            }
+
+
+def is_quota_error(error):
+    """
+    是否為 API 的配額錯誤（google.api_core 的 ResourceExhausted、TooManyRequests 或狀態碼 429）
+
+    不比對錯誤訊息：訊息中剛好含有 429（例如 request id）的其他錯誤不應暫停呼叫
+    """
+    if type(error).__name__ in ("ResourceExhausted", "TooManyRequests"):
+        return True
+    return getattr(error, "code", None) == 429
+
+
+class ScheduledModel:
+    """
+    在 Gemini GenerativeModel 前加上配額排程（介面與原本的 model 相同）
+
+    ItineraryGenerator、問答頁等呼叫端不需要修改：配額不足時 generate_content
+    直接拋出 QuotaExceeded，沿用原本的錯誤處理改用快取或模板
+    """
+
+    def __init__(self, model, scheduler, deadline=None):
+        self.model = model
+        self.scheduler = scheduler
+        self.deadline = deadline
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def generate_content(self, prompt, generation_config=None, stream=False, **kwargs):
+        max_output = (generation_config or {}).get("max_output_tokens") or DEFAULT_OUTPUT_TOKENS
+        prompt_tokens = estimate_tokens(prompt)
+        reserved = self.scheduler.acquire(prompt_tokens + max_output, self.deadline)
+
+        try:
+            response = self.model.generate_content(
+                prompt, generation_config=generation_config, stream=stream, **kwargs
+            )
+        except Exception as e:
+            if is_quota_error(e):
+                self.scheduler.record_exhausted()
+            self.scheduler.settle(reserved, prompt_tokens)
+            raise
+
+        if stream:
+            return self._settle_stream(response, reserved, prompt_tokens)
+
+        self.scheduler.settle(reserved, self._usage(response, prompt_tokens))
+        return response
+
+    def _settle_stream(self, chunks, reserved, prompt_tokens):
+        """串流結束（或中途停止）時以最後的用量修正預約"""
+        actual = None
+        try:
+            for chunk in chunks:
+                actual = self._usage(chunk, prompt_tokens) or actual
+                yield chunk
+        finally:
+            self.scheduler.settle(reserved, actual if actual is not None else prompt_tokens)
+
+    @staticmethod
+    def _usage(response, prompt_tokens):
+        """回應的實際 token 用量（沒有 total_token_count 時以預估輸入加輸出 token 數計算）"""
+        usage = getattr(response, "usage_metadata", None)
+        total = getattr(usage, "total_token_count", None)
+        if total:
+            return total
+        output = getattr(usage, "candidates_token_count", None)
+        return prompt_tokens + output if output is not None else None
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_scheduler(db_path="user_data/gemini_quota.db"):
+    """
+    程序內共用的排程器（各頁面共用同一份配額）
+
+    上限可用環境變數 GEMINI_RPM、GEMINI_TPM、GEMINI_RPD、GEMINI_QUOTA_DEADLINE 調整
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = QuotaScheduler(
+                requests_per_minute=int(os.getenv("GEMINI_RPM", 10)),
+                tokens_per_minute=int(os.getenv("GEMINI_TPM", 1_000_000)),
+                requests_per_day=int(os.getenv("GEMINI_RPD", 1500)),
+                deadline=float(os.getenv("GEMINI_QUOTA_DEADLINE", 20)),
+                db_path=db_path
+            )
+        return _shared
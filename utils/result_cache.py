@@ -0,0 +1,191 @@
+"""
+結果快取模組
+記憶體 LRU + TTL，並可選擇 SQLite 磁碟層（Streamlit 重啟後仍保留）
+"""
+
+import copy
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    """LRU + TTL 快取（值需可 JSON 序列化）"""
+
+    def __init__(self, max_size=512, ttl=86400, db_path=None, table="cache", max_disk_entries=None):
+        """
+        初始化快取
+
+        Args:
+            max_size: 記憶體層最多保留幾筆（超過時淘汰最久未使用）
+            ttl: 存活秒數
+            db_path: SQLite 檔案路徑（None 表示只用記憶體）
+            table: SQLite 資料表名稱
+            max_disk_entries: 磁碟層上限（預設為 max_size 的 10 倍）
+        """
+        if not re.fullmatch(r"[A-Za-z_]\w*", table):
+            raise ValueError(f"不合法的資料表名稱: {table}")
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.table = table
+        self.max_disk_entries = max_disk_entries or max_size * 10
+
+        self._memory = OrderedDict()  # key → (created_at, value)
+        self._lock = threading.Lock()
+        self._db = None
+
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+        if db_path:
+            self._open_db(db_path)
+
+    # === 磁碟層 ===
+
+    def _open_db(self, db_path):
+        """開啟 SQLite 並清除過期資料"""
+        try:
+            directory = os.path.dirname(db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                f"DELETE FROM {self.table} WHERE created_at < ?",
+                (time.time() - self.ttl,)
+            )
+            self._db.commit()
+        except sqlite3.Error as e:
+            print(f"⚠️ 快取資料庫無法開啟，改用記憶體快取: {e}")
+            self._db = None
+
+    def _disk_get(self, key):
+        row = self._db.execute(
+            f"SELECT value, created_at FROM {self.table} WHERE key = ?", (key,)
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        value, created_at = row
+        if time.time() - created_at > self.ttl:
+            self._db.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self._db.commit()
+            return None
+
+        return created_at, json.loads(value)
+
+    def _disk_set(self, key, created_at, value):
+        self._db.execute(
+            f"INSERT OR REPLACE INTO {self.table} (key, value, created_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), created_at)
+        )
+        # 超過上限時刪除最舊的資料
+        self._db.execute(
+            f"DELETE FROM {self.table} WHERE key NOT IN "
+            f"(SELECT key FROM {self.table} ORDER BY created_at DESC LIMIT ?)",
+            (self.max_disk_entries,)
+        )
+        self._db.commit()
+
+    # === 公開介面 ===
+
+    def get(self, key):
+        """
+        讀取快取
+
+        Returns:
+            快取值的深拷貝；未命中或已過期則回傳 None
+        """
+        entry = self.get_entry(key)
+        return entry[1] if entry else None
+
+    def get_entry(self, key):
+        """
+        讀取快取與建立時間
+
+        Returns:
+            tuple: (created_at, 值的深拷貝)；未命中則回傳 None
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+
+            if entry is not None and time.time() - entry[0] > self.ttl:
+                del self._memory[key]
+                entry = None
+
+            if entry is None and self._db is not None:
+                try:
+                    entry = self._disk_get(key)
+                except sqlite3.Error as e:
+                    print(f"⚠️ 快取讀取失敗: {e}")
+                    entry = None
+
+                if entry is not None:
+                    self.disk_hits += 1
+                    self._memory[key] = entry
+                    self._evict()
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return entry[0], copy.deepcopy(entry[1])
+
+    def set(self, key, value):
+        """寫入快取（儲存深拷貝，呼叫端之後修改不影響快取）"""
+        entry = (time.time(), copy.deepcopy(value))
+
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            self._evict()
+
+            if self._db is not None:
+                try:
+                    self._disk_set(key, entry[0], entry[1])
+                except (sqlite3.Error, TypeError, ValueError) as e:
+                    print(f"⚠️ 快取寫入失敗: {e}")
+
+    def clear(self):
+        """清除所有快取與統計"""
+        with self._lock:
+            self._memory.clear()
+            self.hits = 0
+            self.misses = 0
+            self.disk_hits = 0
+
+            if self._db is not None:
+                self._db.execute(f"DELETE FROM {self.table}")
+                self._db.commit()
+
+    def stats(self):
+        """取得命中統計"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "size": len(self._memory),
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+    def _evict(self):
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def __len__(self):
+        return len(self._memory)
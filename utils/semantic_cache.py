@@ -0,0 +1,451 @@
+"""
+語意行程快取
+以本地計算的請求向量（雜湊字元 n-gram，不需網路）建立 FAISS 索引，
+新請求與既有行程夠相似（同城市、天數相近、偏好重疊）時直接改寫既有行程回傳，
+不呼叫 LLM。索引以記憶體映射載入，行程本體存在 SQLite（命中時才讀取）；
+新增只附加到記憶體，由背景執行緒延遲合併寫入磁碟
+"""
+
+import copy
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+# 雜湊字元 n-gram 的長度與權重（長的 n-gram 較有辨識度）
+NGRAM_WEIGHTS = {1: 0.5, 2: 1.0, 3: 1.5}
+
+
+def normalize_preferences(preferences):
+    """偏好正規化：NFKC、去空白、小寫、去重後排序"""
+    if isinstance(preferences, str):
+        preferences = [preferences]
+    return sorted({
+        unicodedata.normalize("NFKC", str(preference)).strip().lower()
+        for preference in preferences or []
+    } - {""})
+
+
+def request_text(location, duration, budget=None, preferences=None):
+    """請求的文字表示（向量化的輸入）"""
+    location = unicodedata.normalize("NFKC", str(location or "")).strip()
+    budget_text = f"預算{round(budget / 5000) * 5}千" if budget else "彈性預算"
+    return f"{location} {duration}天 {budget_text} {' '.join(normalize_preferences(preferences))}"
+
+
+def embed(text, dim=256):
+    """
+    雜湊字元 n-gram 向量（次線性詞頻，L2 正規化）
+
+    不使用語料 IDF：向量一旦寫入索引就不再變動，改以 n-gram 長度加權
+
+    Returns:
+        list[float]: 長度為 dim 的單位向量（空字串回傳零向量）
+    """
+    counts = {}
+    for token in text.split():
+        for n, weight in NGRAM_WEIGHTS.items():
+            for i in range(len(token) - n + 1):
+                gram = token[i:i + n]
+                digest = hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest()
+                bucket = int.from_bytes(digest[:4], "little") % dim
+                sign = 1.0 if digest[4] & 1 else -1.0
+                counts[bucket] = counts.get(bucket, 0.0) + sign * weight
+
+    vector = [0.0] * dim
+    for bucket, value in counts.items():
+        vector[bucket] = math.copysign(1 + math.log(abs(value)), value) if value else 0.0
+
+    norm = math.sqrt(sum(value * value for value in vector))
+    return [value / norm for value in vector] if norm else vector
+
+
+def cosine(a, b):
+    """兩個單位向量的餘弦相似度"""
+    return sum(x * y for x, y in zip(a, b))
+
+
+class SemanticItineraryCache:
+    """FAISS 語意行程快取（未安裝 faiss-cpu 或 numpy 時停用，只記錄警告）"""
+
+    def __init__(self, index_path=None, threshold=0.8, max_duration_diff=1, min_preference_overlap=0.5,
+                 max_entries=2000, dim=256, top_k=5, flush_delay=5.0):
+        """
+        Args:
+            index_path: 索引檔路徑（行程資料存在同名的 .db；None 表示只用記憶體）
+            threshold: 向量相似度門檻
+            max_duration_diff: 可接受的天數差距（差距內的行程會裁切或補足天數）
+            min_preference_overlap: 偏好的最低 Jaccard 重疊（雙方都沒有偏好視為相同）
+            max_entries: 索引上限（超過時在背景捨棄最舊的行程）
+            dim: 向量維度
+            top_k: 每次查詢檢查的候選數
+            flush_delay: 新增行程後延遲幾秒在背景寫入磁碟（期間的新增合併成一次寫入）
+        """
+        self.index_path = index_path
+        self.threshold = threshold
+        self.max_duration_diff = max_duration_diff
+        self.min_preference_overlap = min_preference_overlap
+        self.max_entries = max_entries
+        self.dim = dim
+        self.top_k = top_k
+        self.flush_delay = flush_delay
+
+        self._entries = []    # 與索引列順序相同的行程摘要（行程本體在 SQLite，命中時才讀取）
+        self._base = None     # 啟動時載入的索引（記憶體映射、唯讀）
+        self._delta = None    # 啟動後新增的向量（只附加，不複製載入的索引）
+        self._unsaved = {}    # 尚未寫入 SQLite 的行程本體（id → 結果）
+        self._next_id = 1
+        self._dirty = False   # 索引檔需要重寫（例如載入時重建）
+        self._db = None
+        self._timer = None
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        try:
+            import faiss
+            import numpy
+            self._faiss = faiss
+            self._numpy = numpy
+        except ImportError as e:
+            print(f"⚠️ 語意快取停用（缺少 {e.name}）")
+            self._faiss = None
+            return
+
+        self._base = faiss.IndexFlatIP(dim)
+        self._delta = faiss.IndexFlatIP(dim)
+        if index_path:
+            self._load()
+
+    @property
+    def available(self):
+        return self._faiss is not None
+
+    # === 磁碟 ===
+
+    def _metadata_path(self):
+        return os.path.splitext(self.index_path)[0] + ".db"
+
+    def _load(self):
+        """
+        載入行程摘要（SQLite）與索引（記憶體映射）
+
+        行程本體不載入；索引與資料庫不一致（例如寫入索引前中斷）時，以摘要中的請求文字重建索引
+        """
+        faiss = self._faiss
+        try:
+            directory = os.path.dirname(self.index_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            self._db = sqlite3.connect(self._metadata_path(), check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS itineraries "
+                "(id INTEGER PRIMARY KEY, location TEXT NOT NULL, duration INTEGER NOT NULL, budget REAL, "
+                "preferences TEXT NOT NULL, text TEXT NOT NULL, created_at REAL NOT NULL, result TEXT NOT NULL)"
+            )
+            self._db.commit()
+            rows = self._db.execute(
+                "SELECT id, location, duration, budget, preferences, text, created_at FROM itineraries ORDER BY id"
+            ).fetchall()
+        except (OSError, sqlite3.Error) as e:
+            print(f"⚠️ 語意快取資料庫無法開啟，只使用記憶體: {e}")
+            self._db = None
+            return
+
+        entries = [
+            {
+                "id": row[0],
+                "location": row[1],
+                "duration": row[2],
+                "budget": row[3],
+                "preferences": json.loads(row[4]),
+                "text": row[5],
+                "created_at": row[6]
+            }
+            for row in rows
+        ]
+        if entries:
+            self._next_id = entries[-1]["id"] + 1
+
+        index = None
+        if os.path.exists(self.index_path):
+            try:
+                try:
+                    index = faiss.read_index(self.index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+                except RuntimeError:
+                    index = faiss.read_index(self.index_path)
+            except RuntimeError as e:
+                print(f"⚠️ 語意快取索引無法載入: {e}")
+
+        if index is None or index.ntotal != len(entries) or index.d != self.dim:
+            index = faiss.IndexFlatIP(self.dim)
+            if entries:
+                print(f"🔧 語意快取索引與資料不一致，重建 {len(entries)} 筆")
+                index.add(self._vectors([entry["text"] for entry in entries]))
+                self._dirty = True
+
+        self._base, self._entries = index, entries
+        if entries:
+            print(f"📂 語意快取載入 {len(entries)} 筆行程")
+
+    def _schedule_flush(self):
+        """延遲寫入（呼叫端需持有 _lock；已排程時不重複排程）"""
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """
+        將新增的行程寫入 SQLite、重寫索引檔，並捨棄超過上限的最舊行程
+
+        在背景執行緒執行；查詢與新增只在取快照與換上新索引時短暫持有鎖
+        """
+        if not self.available:
+            return
+
+        with self._flush_lock:
+            with self._lock:
+                self._timer = None
+                entries = list(self._entries)
+                delta_count = self._delta.ntotal
+                base, unsaved, dirty = self._base, dict(self._unsaved), self._dirty
+                delta_vectors = self._delta.reconstruct_n(0, delta_count) if delta_count else None
+                self._dirty = False
+
+            evict = max(0, len(entries) - self.max_entries)
+            persist = self.index_path is not None and self._db is not None and (unsaved or dirty or evict)
+            if not persist and not evict:
+                return
+
+            # 合併載入的索引與新增的向量（在背景讀取記憶體映射，不佔用請求執行緒）
+            parts = [vectors for vectors in (
+                base.reconstruct_n(0, base.ntotal) if base.ntotal else None,
+                delta_vectors
+            ) if vectors is not None]
+            index = self._faiss.IndexFlatIP(self.dim)
+            if parts:
+                index.add(self._numpy.concatenate(parts)[evict:])
+            evicted = [entry["id"] for entry in entries[:evict]]
+
+            if persist:
+                try:
+                    self._write(entries, unsaved, evicted, index)
+                except (OSError, RuntimeError, sqlite3.Error) as e:
+                    print(f"⚠️ 語意快取寫入失敗: {e}")
+                    with self._lock:
+                        self._dirty = True
+                    return
+
+            with self._lock:
+                if persist:
+                    for entry_id in unsaved:
+                        self._unsaved.pop(entry_id, None)
+                if evict:
+                    # 快照之後新增的向量保留在新的 delta
+                    added = self._delta.ntotal - delta_count
+                    later = self._delta.reconstruct_n(delta_count, added) if added else None
+                    self._base = index
+                    self._delta = self._faiss.IndexFlatIP(self.dim)
+                    if later is not None:
+                        self._delta.add(later)
+                    self._entries = entries[evict:] + self._entries[len(entries):]
+                    for entry_id in evicted:
+                        self._unsaved.pop(entry_id, None)
+
+    def _write(self, entries, unsaved, evicted, index):
+        """只附加新的行程列並刪除被捨棄的列；索引先寫暫存檔再取代，避免中斷時留下半份檔案"""
+        rows = [
+            (
+                entry["id"], entry["location"], entry["duration"], entry["budget"],
+                json.dumps(entry["preferences"], ensure_ascii=False), entry["text"], entry["created_at"],
+                json.dumps(unsaved[entry["id"]], ensure_ascii=False)
+            )
+            for entry in entries if entry["id"] in unsaved
+        ]
+        with self._db_lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO itineraries "
+                "(id, location, duration, budget, preferences, text, created_at, result) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self._db.executemany("DELETE FROM itineraries WHERE id = ?", [(entry_id,) for entry_id in evicted])
+
+        self._faiss.write_index(index, self.index_path + ".tmp")
+        os.replace(self.index_path + ".tmp", self.index_path)
+
+    def _result(self, entry_id):
+        """讀取行程本體（尚未寫入的從記憶體取；已被捨棄時回傳 None）"""
+        with self._lock:
+            if entry_id in self._unsaved:
+                return self._unsaved[entry_id]
+        if self._db is None:
+            return None
+        try:
+            with self._db_lock:
+                row = self._db.execute("SELECT result FROM itineraries WHERE id = ?", (entry_id,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"⚠️ 語意快取讀取失敗: {e}")
+            return None
+        return json.loads(row[0]) if row else None
+
+    # === 公開介面 ===
+
+    def add(self, location, duration, budget, preferences, result):
+        """索引一份成功生成的行程（只附加到記憶體，磁碟寫入延遲到背景）"""
+        if not self.available:
+            return
+
+        entry = {
+            "location": unicodedata.normalize("NFKC", str(location or "")).strip(),
+            "duration": duration,
+            "budget": budget,
+            "preferences": normalize_preferences(preferences),
+            "text": request_text(location, duration, budget, preferences),
+            "created_at": time.time()
+        }
+        stored = copy.deepcopy({key: value for key, value in result.items() if key != "cache"})
+        vectors = self._vectors([entry["text"]])
+
+        with self._lock:
+            entry["id"] = self._next_id
+            self._next_id += 1
+            self._entries.append(entry)
+            self._delta.add(vectors)
+            self._unsaved[entry["id"]] = stored
+            if self.index_path or len(self._entries) > self.max_entries:
+                self._schedule_flush()
+
+    def lookup(self, location, duration, budget=None, preferences=None):
+        """
+        查詢相似行程
+
+        Returns:
+            dict: 改寫成本次請求的行程結果（含 cache 命中資訊）；沒有夠相似的行程則回傳 None
+        """
+        if not self.available:
+            return None
+
+        text = request_text(location, duration, budget, preferences)
+        vectors = self._vectors([text])
+        with self._lock:
+            if not self._entries:
+                self.misses += 1
+                return None
+            candidates = [(score, self._entries[row]) for score, row in self._search(vectors)]
+
+        for score, entry in candidates:
+            if score < self.threshold or not self.accepts(entry, location, duration, preferences):
+                continue
+            stored = self._result(entry["id"])
+            if stored is None:
+                continue
+
+            with self._lock:
+                self.hits += 1
+            print(f"🧭 語意快取命中：{entry['text']} ≈ {text}（相似度 {score:.2f}）")
+            result = self.adapt(stored, location, duration, budget)
+            result["cache"] = {
+                "hit": True,
+                "semantic": True,
+                "score": score,
+                "source": entry["text"],
+                "age": max(0.0, time.time() - entry["created_at"])
+            }
+            return result
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def accepts(self, entry, location, duration, preferences=None):
+        """硬性條件：同城市、天數差距內、偏好重疊足夠"""
+        if entry["location"] != unicodedata.normalize("NFKC", str(location or "")).strip():
+            return False
+        if abs(entry["duration"] - duration) > self.max_duration_diff:
+            return False
+
+        wanted = set(normalize_preferences(preferences))
+        stored = set(entry["preferences"])
+        if not wanted and not stored:
+            return True
+        return len(wanted & stored) / len(wanted | stored) >= self.min_preference_overlap
+
+    @staticmethod
+    def adapt(result, location, duration, budget=None):
+        """
+        將既有行程改寫成本次請求：裁切或補足天數（補的天數取自模板），依預算重算預算分配
+
+        Returns:
+            dict: 新的結果（不修改原本的行程）
+        """
+        from utils.itinerary_generator import ItineraryGenerator
+
+        result = copy.deepcopy(result)
+        data = result["data"]
+        days = sorted(data["daily_itinerary"], key=lambda day: day.get("day", 0))[:duration]
+
+        if len(days) < duration:
+            template = ItineraryGenerator._create_fallback_itinerary(location, duration, budget)
+            extra = template.get("daily_itinerary", [])
+            for day in range(len(days) + 1, duration + 1):
+                filler = copy.deepcopy(extra[(day - 1) % len(extra)]) if extra else {"activities": []}
+                filler["day"] = day
+                days.append(filler)
+
+        if budget:
+            total_budget = budget
+        elif data.get("total_budget") and data.get("duration"):
+            total_budget = int(data["total_budget"] * duration / data["duration"])
+        else:
+            total_budget = duration * 10000
+
+        if data.get("duration") != duration:
+            data["trip_name"] = f"{location}{duration}日遊"
+
+        data.update({
+            "duration": duration,
+            "total_budget": total_budget,
+            "budget_breakdown": {
+                "accommodation": int(total_budget * 0.3),
+                "food": int(total_budget * 0.3),
+                "transport": int(total_budget * 0.2),
+                "activities": int(total_budget * 0.2)
+            },
+            "daily_itinerary": days
+        })
+        return result
+
+    def stats(self):
+        """取得命中統計"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+    def _search(self, vectors):
+        """同時查詢載入的索引與新增的向量（呼叫端需持有 _lock）"""
+        matches = []
+        for offset, index in ((0, self._base), (self._base.ntotal, self._delta)):
+            if index.ntotal:
+                scores, rows = index.search(vectors, min(self.top_k, index.ntotal))
+                matches += [(float(score), offset + int(row)) for score, row in zip(scores[0], rows[0]) if row >= 0]
+        return sorted(matches, key=lambda match: match[0], reverse=True)[:self.top_k]
+
+    def _vectors(self, texts):
+        return self._numpy.array([embed(text, self.dim) for text in texts], dtype="float32")
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,138 @@
+"""
+單一航班（single-flight）請求合併
+熱門行程（例如促銷期間的「台北 3天」）常有多個 session 同時送出相同請求。
+相同鍵的請求同時進行時只有第一個（leader）真正呼叫 LLM，其他（follower）
+重播 leader 的事件並各自取得深拷貝；follower 各自計時，逾時不影響 leader
+"""
+
+import copy
+import threading
+import time
+
+
+class FlightAbandoned(RuntimeError):
+    """leader 在完成前停止（例如使用者離開頁面），follower 需要自行生成"""
+
+
+class _Flight:
+    """一次進行中的請求：已產出的事件與完成狀態"""
+
+    def __init__(self):
+        self.events = []
+        self.done = False
+        self.error = None
+        self.followers = 0
+        self.condition = threading.Condition()
+
+    def publish(self, event, payload):
+        with self.condition:
+            self.events.append((event, copy.deepcopy(payload)))
+            self.condition.notify_all()
+
+    def finish(self, error=None):
+        with self.condition:
+            self.done = True
+            self.error = error
+            self.condition.notify_all()
+
+
+class SingleFlight:
+    """以鍵合併同時進行的相同請求（執行緒安全）"""
+
+    def __init__(self, timeout=120.0):
+        """
+        Args:
+            timeout: follower 預設的最長等待秒數
+        """
+        self.timeout = timeout
+        self._flights = {}
+        self._lock = threading.Lock()
+
+        self.leaders = 0
+        self.coalesced = 0
+
+    def stream(self, key, make_events, timeout=None):
+        """
+        合併串流請求
+
+        Args:
+            key: 請求鍵（已正規化）
+            make_events: 產生事件迭代器的函式（只有 leader 會呼叫）
+            timeout: follower 的最長等待秒數（None 使用預設值）
+
+        Yields:
+            tuple: (事件, payload)；follower 取得的是深拷貝
+
+        Raises:
+            TimeoutError: follower 等待逾時
+            FlightAbandoned: follower 等待的 leader 在完成前停止
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.leaders += 1
+            else:
+                flight.followers += 1
+                self.coalesced += 1
+
+        if leader:
+            yield from self._lead(key, flight, make_events)
+        else:
+            print(f"🔗 合併相同的進行中請求：{key}")
+            yield from self._follow(flight, self.timeout if timeout is None else timeout)
+
+    def do(self, key, fn, timeout=None):
+        """
+        合併一般呼叫
+
+        Returns:
+            fn() 的回傳值（follower 取得深拷貝）
+        """
+        for _, result in self.stream(key, lambda: iter([("done", fn())]), timeout):
+            pass
+        return result
+
+    def _lead(self, key, flight, make_events):
+        error = FlightAbandoned("leader 在完成前停止")
+        try:
+            for event, payload in make_events():
+                # 先存一份拷貝再交給呼叫端（呼叫端修改 payload 不影響之後加入的 follower）
+                flight.publish(event, payload)
+                yield event, payload
+            error = None
+        except BaseException as e:
+            if not isinstance(e, GeneratorExit):
+                error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.finish(error)
+
+    def _follow(self, flight, timeout):
+        deadline = time.monotonic() + timeout
+        position = 0
+        while True:
+            with flight.condition:
+                while position >= len(flight.events) and not flight.done:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not flight.condition.wait(remaining):
+                        if position >= len(flight.events) and not flight.done:
+                            raise TimeoutError(f"等待相同請求逾時（{timeout:.0f} 秒）")
+                pending = flight.events[position:]
+                finished, error = flight.done, flight.error
+
+            for event, payload in pending:
+                yield event, copy.deepcopy(payload)
+            position += len(pending)
+
+            if finished and position >= len(flight.events):
+                if error is not None:
+                    raise error
+                return
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": len(self._flights), "leaders": self.leaders, "coalesced": self.coalesced}
@@ -0,0 +1,200 @@
+"""
+推測式行程生成
+一旦知道地點和天數就在背景開始生成行程；之後的對話若沒有改變生成參數，
+完成時直接使用背景結果，否則捨棄並重新開始
+"""
+
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+from utils.itinerary_generator import ItineraryGenerator
+
+# 背景生成在此執行緒池中進行（所有工作階段共用）
+_SPECULATIVE_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="speculative")
+
+
+class _Run:
+    """一次背景生成：已完成的單日行程與最終結果"""
+
+    def __init__(self, key):
+        self.key = key
+        self.days = []
+        self.future = None
+        self.stop = threading.Event()  # 設定後背景串流在下一個事件時關閉
+
+
+class SpeculativeItinerary:
+    """單一工作階段的推測式行程生成"""
+
+    def __init__(self, generate=None, stream=ItineraryGenerator.stream_itinerary):
+        """
+        Args:
+            generate: 非串流的行程生成函式（簽名同 ItineraryGenerator.generate_itinerary）；
+                      指定時取代 stream
+            stream: 串流行程生成函式（簽名同 ItineraryGenerator.stream_itinerary）
+        """
+        if generate is not None:
+            def stream(**kwargs):
+                yield "done", generate(**kwargs)
+
+        self._stream = stream
+        self._run = None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.cancelled = 0
+
+    @staticmethod
+    def _make_key(location, duration, budget=None, preferences=None):
+        """生成參數簽章（偏好不分順序）"""
+        if isinstance(preferences, (list, tuple, set)):
+            preferences = tuple(sorted(preferences))
+        return location, duration, budget, preferences
+
+    def start(self, client, location, duration, budget=None, preferences=None):
+        """
+        開始（或維持）背景生成
+
+        參數與進行中的生成相同時不重複送出；不同時取消舊的再重新開始
+
+        Returns:
+            bool: 是否送出了新的背景生成
+        """
+        key = self._make_key(location, duration, budget, preferences)
+
+        with self._lock:
+            if self._run is not None and self._run.key == key:
+                return False
+
+            self._cancel_locked()
+            run = _Run(key)
+            run.future = _SPECULATIVE_EXECUTOR.submit(
+                self._consume,
+                run,
+                client=client,
+                location=location,
+                duration=duration,
+                budget=budget,
+                preferences=preferences
+            )
+            self._run = run
+
+        print(f"🚀 推測式生成開始：{location} {duration} 天")
+        return True
+
+    def _consume(self, run, **kwargs):
+        """
+        背景執行：收集單日行程，回傳最終結果
+
+        被取消時關閉串流（放棄仍在進行的 API 請求，不再消耗配額與執行緒池）
+        """
+        stream = self._stream(**kwargs)
+        try:
+            for event, payload in stream:
+                if run.stop.is_set():
+                    raise CancelledError()
+                if event == "day":
+                    run.days.append(payload)
+                else:
+                    return payload
+        finally:
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+        raise RuntimeError("行程串流未回傳結果")
+
+    def events(self, client, location, duration, budget=None, preferences=None, poll_interval=0.05):
+        """
+        逐步取得生成進度
+
+        參數與背景生成相同時接續背景進度（先補上已完成的天數）；
+        否則取消背景生成並直接串流生成
+
+        Yields:
+            tuple: ("day", 單日行程 dict)，最後是 ("done", 與 generate_itinerary 相同格式的結果)
+        """
+        key = self._make_key(location, duration, budget, preferences)
+
+        with self._lock:
+            run = self._run if self._run is not None and self._run.key == key else None
+            if run is None:
+                self._cancel_locked()
+            self._run = None
+
+        kwargs = {
+            "client": client,
+            "location": location,
+            "duration": duration,
+            "budget": budget,
+            "preferences": preferences
+        }
+
+        if run is not None:
+            emitted = 0
+            while True:
+                finished = run.future.done()
+                while emitted < len(run.days):
+                    yield "day", run.days[emitted]
+                    emitted += 1
+                if finished:
+                    break
+                time.sleep(poll_interval)
+
+            try:
+                result = run.future.result()
+                self.hits += 1
+                print("⚡ 使用推測式生成結果")
+                yield "done", result
+                return
+            except Exception as e:
+                print(f"⚠️ 推測式生成失敗: {e}，重新生成")
+
+        self.misses += 1
+        for event, payload in self._stream(**kwargs):
+            # 已從背景補上的天數不重複產出
+            if event == "day" and run is not None and payload in run.days:
+                continue
+            yield event, payload
+            if event == "done":
+                return
+
+    def result(self, client, location, duration, budget=None, preferences=None, timeout=None):
+        """
+        取得生成結果（不需要逐日進度時使用）
+
+        參數與背景生成相同時等待並使用背景結果；否則取消背景生成並直接生成
+
+        Returns:
+            dict: 與 ItineraryGenerator.generate_itinerary 相同格式
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        for event, payload in self.events(client, location, duration, budget, preferences):
+            if event == "done":
+                return payload
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError("推測式生成逾時")
+
+        raise RuntimeError("行程串流未回傳結果")
+
+    def cancel(self):
+        """取消背景生成（進行中的串流在下一段回應到達時關閉）"""
+        with self._lock:
+            self._cancel_locked()
+
+    @property
+    def pending(self):
+        """是否有背景生成（進行中或已完成但尚未取用）"""
+        with self._lock:
+            return self._run is not None
+
+    def _cancel_locked(self):
+        if self._run is not None:
+            self._run.stop.set()
+            self._run.future.cancel()
+            self.cancelled += 1
+            print("🛑 生成參數已改變，捨棄推測式生成")
+
+        self._run = None
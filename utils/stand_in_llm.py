@@ -0,0 +1,506 @@
+"""
+本地 LLM 替身伺服器（離線壓力測試用）
+
+提供 OpenAI chat-completions 相容的 HTTP 端點（含串流）與 Gemini generateContent
+端點，以及可直接取代 genai.GenerativeModel 的 FakeGeminiModel。
+延遲分布、截斷 token 數、JSON 損毀與 `!!!!` 垃圾輸出比例皆可設定，
+行程請求回傳 data/trip_templates.json 中的模板
+
+執行方式（需在專案根目錄執行，才能讀到 data/）：
+    python -m utils.stand_in_llm --port 8001 --latency lognormal --latency-mean 0.4 --garbage-rate 0.1
+
+之後設定 VLLM_BASE_URL=http://127.0.0.1:8001/v1，並設定 LLM_STAND_IN=1 讓頁面改用 FakeGeminiModel
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+from utils.compact_schema import LEGEND_KEY, compact_itinerary
+
+# 粗略的 token 切分：每個中日韓字元、英數字詞或符號各算一個 token
+_TOKEN_PATTERN = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]|[A-Za-z0-9_]+|[^\sA-Za-z0-9_]|\s+")
+
+_FOLLOW_UP_QUESTIONS = {
+    "目的地": ["這次想去哪裡玩呢？", "有想去的城市嗎？", "想往哪個方向出發呢？"],
+    "天數": ["預計要玩幾天呢？", "這趟打算待幾天？", "想安排幾天的行程呢？"]
+}
+
+
+class StandInConfig:
+    """替身伺服器的行為設定"""
+
+    LATENCY_MODES = ("fixed", "uniform", "lognormal")
+
+    def __init__(self, latency="fixed", latency_mean=0.0, latency_jitter=0.5, token_delay=0.0,
+                 truncate_tokens=None, garbage_rate=0.0, malformed_json_rate=0.0,
+                 model="openai/gpt-oss-120b", seed=None):
+        """
+        Args:
+            latency: 首 token 延遲分布（fixed / uniform / lognormal）
+            latency_mean: 平均（lognormal 為中位數）延遲秒數
+            latency_jitter: uniform 的相對振幅，或 lognormal 的 sigma
+            token_delay: 每個 token 之間的延遲秒數（串流時逐步送出）
+            truncate_tokens: 回應最多幾個 token（None 表示只受請求的 max_tokens 限制）
+            garbage_rate: 回傳 `!!!!` 垃圾輸出的比例
+            malformed_json_rate: JSON 回應被損毀的比例
+            model: /v1/models 回報的模型名稱
+            seed: 亂數種子
+        """
+        if latency not in self.LATENCY_MODES:
+            raise ValueError(f"不支援的延遲分布: {latency}")
+
+        self.latency = latency
+        self.latency_mean = latency_mean
+        self.latency_jitter = latency_jitter
+        self.token_delay = token_delay
+        self.truncate_tokens = truncate_tokens
+        self.garbage_rate = garbage_rate
+        self.malformed_json_rate = malformed_json_rate
+        self.model = model
+        self.seed = seed
+
+
+class StandInResponder:
+    """依 prompt 類型產生回應並套用故障模式（HTTP 伺服器與 FakeGeminiModel 共用）"""
+
+    def __init__(self, config=None):
+        self.config = config or StandInConfig()
+        self._random = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "garbage": 0, "malformed_json": 0, "truncated": 0}
+
+    # === 延遲 ===
+
+    def sample_latency(self):
+        """依設定的分布抽樣首 token 延遲（秒）"""
+        config = self.config
+        if config.latency_mean <= 0:
+            return 0.0
+
+        with self._lock:
+            if config.latency == "uniform":
+                spread = config.latency_mean * config.latency_jitter
+                return max(0.0, self._random.uniform(config.latency_mean - spread, config.latency_mean + spread))
+            if config.latency == "lognormal":
+                return self._random.lognormvariate(0, config.latency_jitter) * config.latency_mean
+            return config.latency_mean
+
+    def _roll(self, rate):
+        with self._lock:
+            return rate > 0 and self._random.random() < rate
+
+    # === 回應內容 ===
+
+    def respond(self, prompt, max_tokens=None, stop=None):
+        """
+        產生回應
+
+        Returns:
+            tuple: (文字, finish_reason)
+        """
+        with self._lock:
+            self.stats["requests"] += 1
+
+        if self._roll(self.config.garbage_rate):
+            with self._lock:
+                self.stats["garbage"] += 1
+            text = "!" * (max_tokens or 200)
+        else:
+            text = self._compose(prompt)
+
+            if text.startswith("{") and self._roll(self.config.malformed_json_rate):
+                with self._lock:
+                    self.stats["malformed_json"] += 1
+                text = self._corrupt_json(text)
+
+        for sequence in stop or []:
+            if sequence and sequence in text:
+                text = text[:text.index(sequence)]
+
+        limits = [limit for limit in (max_tokens, self.config.truncate_tokens) if limit]
+        tokens = tokenize(text)
+        if limits and len(tokens) > min(limits):
+            with self._lock:
+                self.stats["truncated"] += 1
+            return "".join(tokens[:min(limits)]), "length"
+
+        return text, "stop"
+
+    def _compose(self, prompt):
+        """依 prompt 類型產生合理的回應"""
+        # 分日並行生成的骨架與單日（ItineraryGenerator.stream_itinerary_parallel）
+        if "行程骨架" in prompt:
+            return json.dumps(self._skeleton(prompt), ensure_ascii=False, indent=2)
+        single_day = re.search(r"只規劃第 (\d+) 天", prompt)
+        if single_day:
+            return json.dumps(self._single_day(prompt, int(single_day.group(1))), ensure_ascii=False, indent=2)
+
+        # 截斷後的接續生成：只回傳缺少的天
+        continuation = re.search(r"請接續規劃第 ([\d、]+) 天", prompt)
+        if continuation:
+            return self._continuation(prompt, [int(day) for day in continuation.group(1).split("、")])
+
+        # 行程生成（ItineraryGenerator；prompt 帶圖例時回傳精簡格式，每個活動一行）
+        if "目的地：" in prompt and "JSON" in prompt:
+            if LEGEND_KEY in prompt:
+                return self._compact_json(compact_itinerary(self._itinerary(prompt)))
+            return json.dumps(self._itinerary(prompt), ensure_ascii=False, indent=2)
+
+        # 追問（TripInfoCollector._agenerate_llm_question）
+        if prompt.rstrip().endswith("Question:"):
+            missing = re.search(r"Missing: (\S+)", prompt)
+            choices = _FOLLOW_UP_QUESTIONS.get(missing.group(1) if missing else "", ["可以再多告訴我一些嗎？"])
+            with self._lock:
+                return self._random.choice(choices)
+
+        # 資訊提取（TripInfoCollector._allm_extract）
+        said = re.search(r'User says: "(.*?)"', prompt, re.S)
+        if said:
+            return self._extraction(said.group(1), prompt)
+
+        # 其他（問答、健康檢查）
+        question = re.search(r"用戶問題：(.+)", prompt)
+        if question:
+            return f"關於「{question.group(1).strip()[:30]}」：這是本地替身伺服器的示範回答。"
+        return "OK"
+
+    @staticmethod
+    def _extraction(message, prompt):
+        from utils.info_collector import TripInfoCollector
+
+        rule = TripInfoCollector._rule_extract(message)
+        location = rule.get("location") or "unknown"
+        duration = rule.get("duration") or "unknown"
+
+        if prompt.rstrip().endswith("City name:"):
+            return str(location)
+        if prompt.rstrip().endswith("Number of days:"):
+            return str(duration)
+        return f"Location: {location}\nDuration: {duration}"
+
+    @staticmethod
+    def _itinerary(prompt):
+        from utils.itinerary_generator import ItineraryGenerator
+
+        location = re.search(r"目的地：(\S+)", prompt)
+        duration = re.search(r"天數：(\d+)天", prompt)
+        budget = re.search(r"預算：NT\$ ([\d,]+)", prompt)
+
+        return ItineraryGenerator._create_fallback_itinerary(
+            location.group(1) if location else "台北",
+            int(duration.group(1)) if duration else 3,
+            int(budget.group(1).replace(",", "")) if budget else None
+        )
+
+    @staticmethod
+    def _compact_json(itinerary):
+        """精簡格式的排版：頂層縮排，每個活動陣列各佔一行"""
+        lines = []
+        for key, value in itinerary.items():
+            if key == "daily_itinerary":
+                days = []
+                for day in value:
+                    head = json.dumps({k: v for k, v in day.items() if k != "activities"}, ensure_ascii=False)[:-1]
+                    rows = ",\n      ".join(json.dumps(row, ensure_ascii=False) for row in day["activities"])
+                    days.append(f'    {head}, "activities": [\n      {rows}\n    ]}}')
+                lines.append(f'  "{key}": [\n' + ",\n".join(days) + "\n  ]")
+            else:
+                lines.append(f'  "{key}": {json.dumps(value, ensure_ascii=False)}')
+        return "{\n" + ",\n".join(lines) + "\n}"
+
+    @classmethod
+    def _skeleton(cls, prompt):
+        itinerary = cls._itinerary(prompt)
+        skeleton = {
+            key: value for key, value in itinerary.items()
+            if key not in ("daily_itinerary", "budget_breakdown")
+        }
+        skeleton["daily_plan"] = [
+            {
+                "day": day["day"],
+                "theme": day.get("theme", ""),
+                "area": (day.get("activities") or [{}])[0].get("location", itinerary["location"])
+            }
+            for day in itinerary["daily_itinerary"]
+        ]
+        return skeleton
+
+    @classmethod
+    def _single_day(cls, prompt, day):
+        days = cls._itinerary(prompt)["daily_itinerary"]
+        entry = dict(days[(day - 1) % len(days)])
+        entry["day"] = day
+        return entry
+
+    @classmethod
+    def _continuation(cls, prompt, days):
+        entries = [cls._single_day(prompt, day) for day in days]
+        if LEGEND_KEY in prompt:
+            return cls._compact_json(compact_itinerary({"daily_itinerary": entries}))
+        return json.dumps({"daily_itinerary": entries}, ensure_ascii=False, indent=2)
+
+    def _corrupt_json(self, text):
+        """刪掉一個逗號，產生 json.loads 會失敗的內容"""
+        commas = [match.start() for match in re.finditer(r",\n", text)]
+        if not commas:
+            return text[:len(text) // 2]
+        with self._lock:
+            position = self._random.choice(commas)
+        return text[:position] + text[position + 1:]
+
+
+def tokenize(text):
+    """將文字切成替身伺服器使用的 token（串接後等於原文）"""
+    return _TOKEN_PATTERN.findall(text)
+
+
+# === Gemini 替身 ===
+
+class FakeGeminiModel:
+    """可取代 genai.GenerativeModel 的替身（只實作 generate_content）"""
+
+    def __init__(self, config=None, responder=None):
+        self.responder = responder or StandInResponder(config)
+
+    def generate_content(self, prompt, generation_config=None, stream=False, **kwargs):
+        generation_config = generation_config or {}
+        time.sleep(self.responder.sample_latency())
+
+        text, finish_reason = self.responder.respond(
+            prompt if isinstance(prompt, str) else str(prompt),
+            max_tokens=generation_config.get("max_output_tokens")
+        )
+        finish_reason = "MAX_TOKENS" if finish_reason == "length" else "STOP"
+
+        if stream:
+            return self._stream(text, finish_reason)
+
+        time.sleep(self.responder.config.token_delay * len(tokenize(text)))
+
+        return SimpleNamespace(
+            text=text,
+            candidates=[SimpleNamespace(finish_reason=finish_reason)],
+            usage_metadata=SimpleNamespace(candidates_token_count=len(tokenize(text)))
+        )
+
+    def _stream(self, text, finish_reason, tokens_per_chunk=16):
+        """模擬 Gemini 串流：每個 chunk 帶數個 token"""
+        tokens = tokenize(text)
+        for start in range(0, len(tokens), tokens_per_chunk):
+            chunk_tokens = tokens[start:start + tokens_per_chunk]
+            time.sleep(self.responder.config.token_delay * len(chunk_tokens))
+            is_last = start + tokens_per_chunk >= len(tokens)
+            yield SimpleNamespace(
+                text="".join(chunk_tokens),
+                candidates=[SimpleNamespace(finish_reason=finish_reason if is_last else None)],
+                usage_metadata=SimpleNamespace(candidates_token_count=len(tokens) if is_last else None)
+            )
+
+
+# === HTTP 伺服器 ===
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def responder(self):
+        return self.server.responder
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json({"object": "list", "data": [{"id": self.responder.config.model, "object": "model"}]})
+        elif self.path.rstrip("/") == "/stats":
+            self._send_json(self.responder.stats)
+        else:
+            self._send_json({"error": {"message": f"未知路徑: {self.path}"}}, 404)
+
+    def do_POST(self):
+        try:
+            request = self._read_json()
+        except json.JSONDecodeError:
+            self._send_json({"error": {"message": "請求不是有效的 JSON"}}, 400)
+            return
+
+        if self.path.rstrip("/").endswith("/chat/completions"):
+            self._chat_completions(request)
+        elif ":generateContent" in self.path:
+            self._generate_content(request)
+        else:
+            self._send_json({"error": {"message": f"未知路徑: {self.path}"}}, 404)
+
+    def _chat_completions(self, request):
+        messages = request.get("messages") or [{}]
+        user_messages = [m for m in messages if m.get("role") == "user"] or messages
+        prompt = user_messages[-1].get("content") or ""
+
+        stop = request.get("stop")
+        if isinstance(stop, str):
+            stop = [stop]
+
+        time.sleep(self.responder.sample_latency())
+        text, finish_reason = self.responder.respond(prompt, request.get("max_tokens"), stop)
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        model = request.get("model") or self.responder.config.model
+        tokens = tokenize(text)
+
+        if not request.get("stream"):
+            time.sleep(self.responder.config.token_delay * len(tokens))
+            self._send_json({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": finish_reason
+                }],
+                "usage": {
+                    "prompt_tokens": len(tokenize(prompt)),
+                    "completion_tokens": len(tokens),
+                    "total_tokens": len(tokenize(prompt)) + len(tokens)
+                }
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def send_chunk(delta, finish=None):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        try:
+            send_chunk({"role": "assistant", "content": ""})
+            for token in tokens:
+                if self.responder.config.token_delay:
+                    time.sleep(self.responder.config.token_delay)
+                send_chunk({"content": token})
+            send_chunk({}, finish_reason)
+            if (request.get("stream_options") or {}).get("include_usage"):
+                usage_chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [],
+                    "usage": {
+                        "prompt_tokens": len(tokenize(prompt)),
+                        "completion_tokens": len(tokens),
+                        "total_tokens": len(tokenize(prompt)) + len(tokens)
+                    }
+                }
+                self.wfile.write(f"data: {json.dumps(usage_chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # 用戶端提前中止串流（例如偵測到垃圾輸出）
+            pass
+
+    def _generate_content(self, request):
+        prompt = "".join(
+            part.get("text", "")
+            for content in request.get("contents", [])
+            for part in content.get("parts", [])
+        )
+        config = request.get("generationConfig") or {}
+
+        time.sleep(self.responder.sample_latency())
+        text, finish_reason = self.responder.respond(prompt, config.get("maxOutputTokens"))
+        time.sleep(self.responder.config.token_delay * len(tokenize(text)))
+
+        self._send_json({
+            "candidates": [{
+                "content": {"role": "model", "parts": [{"text": text}]},
+                "finishReason": "MAX_TOKENS" if finish_reason == "length" else "STOP",
+                "index": 0
+            }]
+        })
+
+
+def create_server(config=None, host="127.0.0.1", port=8001):
+    """
+    建立替身伺服器（呼叫端自行 serve_forever / shutdown）
+
+    port 設為 0 時由系統挑選可用埠，可從 server.server_address 取得
+    """
+    server = ThreadingHTTPServer((host, port), _StandInHandler)
+    server.daemon_threads = True
+    server.responder = StandInResponder(config)
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地 OpenAI／Gemini 相容替身伺服器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", choices=StandInConfig.LATENCY_MODES, default="fixed", help="首 token 延遲分布")
+    parser.add_argument("--latency-mean", type=float, default=0.0, help="平均延遲秒數（lognormal 為中位數）")
+    parser.add_argument("--latency-jitter", type=float, default=0.5, help="uniform 相對振幅或 lognormal sigma")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="每個 token 的延遲秒數")
+    parser.add_argument("--truncate-tokens", type=int, default=None, help="回應最多幾個 token")
+    parser.add_argument("--garbage-rate", type=float, default=0.0, help="回傳 !!!! 垃圾輸出的比例")
+    parser.add_argument("--malformed-json-rate", type=float, default=0.0, help="JSON 回應損毀的比例")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    config = StandInConfig(
+        latency=args.latency,
+        latency_mean=args.latency_mean,
+        latency_jitter=args.latency_jitter,
+        token_delay=args.token_delay,
+        truncate_tokens=args.truncate_tokens,
+        garbage_rate=args.garbage_rate,
+        malformed_json_rate=args.malformed_json_rate,
+        seed=args.seed
+    )
+    server = create_server(config, args.host, args.port)
+
+    print(f"🧪 LLM 替身伺服器：http://{args.host}:{server.server_address[1]}/v1")
+    print(f"💡 設定 VLLM_BASE_URL=http://{args.host}:{server.server_address[1]}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"\n📊 統計：{server.responder.stats}")
+
+
+if __name__ == "__main__":
+    main()
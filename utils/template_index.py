@@ -0,0 +1,377 @@
+"""
+行程模板索引
+data/trip_templates.json 只在啟動或檔案修改時間改變時載入一次，
+轉成唯讀結構後以（地點, 天數）索引。查詢結果與索引共用內部結構，
+只有頂層（預算等欄位）是新的 dict，任何修改共用資料的嘗試都會拋出 TypeError
+
+沒有該天數的模板時，從單日模板池（該地點所有模板的每一天，再加上通用的單日行程）
+依偏好挑選不重複的天數組成行程；沒有任何模板的地點只用通用單日行程組合
+"""
+
+import copy
+import json
+import os
+import threading
+
+
+def _readonly(self, *args, **kwargs):
+    raise TypeError("模板資料為唯讀，請先以 copy.deepcopy 複製")
+
+
+class FrozenDict(dict):
+    """唯讀 dict（仍是 dict 子類別，可直接 json.dumps；複製時還原成一般 dict）"""
+
+    __slots__ = ()
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return {key: copy.deepcopy(value, memo) for key, value in self.items()}
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+
+class FrozenList(list):
+    """唯讀 list（複製時還原成一般 list）"""
+
+    __slots__ = ()
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = extend = insert = pop = remove = clear = sort = reverse = _readonly
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return [copy.deepcopy(value, memo) for value in self]
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+
+# 通用單日行程：地點模板用完後補上，沒有模板的地點整個模板池都來自這裡
+GENERIC_DAYS = [
+    {
+        "theme": "{location}在地探索",
+        "activities": [
+            {"time": "09:00", "name": "早餐時光", "type": "美食", "location": "{location}", "duration": "1小時", "cost": 150, "note": "探索在地早餐小吃", "icon": "🍳"},
+            {"time": "10:30", "name": "上午景點", "type": "景點", "location": "{location}", "duration": "2小時", "cost": 200, "note": "參觀當地主要景點", "icon": "🏛️"},
+            {"time": "13:00", "name": "午餐時間", "type": "美食", "location": "{location}", "duration": "1.5小時", "cost": 300, "note": "品嚐當地特色料理", "icon": "🍜"},
+            {"time": "15:00", "name": "下午活動", "type": "景點", "location": "{location}", "duration": "2小時", "cost": 150, "note": "休閒漫遊或文化體驗", "icon": "🎨"},
+            {"time": "18:30", "name": "晚餐 & 夜市", "type": "美食", "location": "{location}", "duration": "2小時", "cost": 400, "note": "夜市美食巡禮", "icon": "🌙"}
+        ]
+    },
+    {
+        "theme": "{location}近郊自然",
+        "activities": [
+            {"time": "08:30", "name": "早餐外帶", "type": "美食", "location": "{location}", "duration": "0.5小時", "cost": 100, "note": "帶上早餐出發", "icon": "🥪"},
+            {"time": "09:30", "name": "近郊步道", "type": "景點", "location": "{location}近郊", "duration": "3小時", "cost": 0, "note": "選擇輕鬆的步道，注意天氣", "icon": "🥾"},
+            {"time": "13:00", "name": "山城小吃", "type": "美食", "location": "{location}近郊", "duration": "1小時", "cost": 250, "note": "品嚐當地農產與小吃", "icon": "🍲"},
+            {"time": "15:00", "name": "景觀咖啡", "type": "景點", "location": "{location}近郊", "duration": "1.5小時", "cost": 200, "note": "欣賞風景稍作休息", "icon": "☕"},
+            {"time": "18:30", "name": "回市區晚餐", "type": "美食", "location": "{location}", "duration": "1.5小時", "cost": 350, "note": "在地人推薦的餐廳", "icon": "🍽️"}
+        ]
+    },
+    {
+        "theme": "{location}市場與老街",
+        "activities": [
+            {"time": "08:00", "name": "傳統市場早餐", "type": "美食", "location": "{location}", "duration": "1小時", "cost": 120, "note": "體驗在地市場生活", "icon": "🥟"},
+            {"time": "10:00", "name": "老街散步", "type": "景點", "location": "{location}", "duration": "2小時", "cost": 0, "note": "欣賞老建築與街景", "icon": "🏘️"},
+            {"time": "12:30", "name": "老字號午餐", "type": "美食", "location": "{location}", "duration": "1小時", "cost": 250, "note": "品嚐傳承多年的老店", "icon": "🍚"},
+            {"time": "14:30", "name": "伴手禮採買", "type": "購物", "location": "{location}", "duration": "2小時", "cost": 800, "note": "挑選在地特產", "icon": "🛍️"},
+            {"time": "18:00", "name": "街邊小吃晚餐", "type": "美食", "location": "{location}", "duration": "1.5小時", "cost": 300, "note": "邊走邊吃", "icon": "🍢"}
+        ]
+    },
+    {
+        "theme": "{location}藝文慢活",
+        "activities": [
+            {"time": "10:00", "name": "咖啡早午餐", "type": "美食", "location": "{location}", "duration": "1.5小時", "cost": 300, "note": "睡飽再出門", "icon": "🥞"},
+            {"time": "12:00", "name": "博物館或藝文空間", "type": "景點", "location": "{location}", "duration": "2小時", "cost": 150, "note": "查詢當期展覽", "icon": "🖼️"},
+            {"time": "15:00", "name": "公園散步", "type": "景點", "location": "{location}", "duration": "1.5小時", "cost": 0, "note": "放慢腳步", "icon": "🌳"},
+            {"time": "18:00", "name": "特色餐廳晚餐", "type": "美食", "location": "{location}", "duration": "2小時", "cost": 600, "note": "建議提前訂位", "icon": "🍷"}
+        ]
+    }
+]
+
+
+def generic_day(location, index):
+    """第 index 個通用單日行程（依序輪替，用完才重複，重複的主題加上編號區分）"""
+    generic = GENERIC_DAYS[index % len(GENERIC_DAYS)]
+    round_number = index // len(GENERIC_DAYS)
+    return {
+        "theme": generic["theme"].format(location=location) + (f"（{round_number + 1}）" if round_number else ""),
+        "activities": [
+            dict(activity, location=activity["location"].format(location=location))
+            for activity in generic["activities"]
+        ]
+    }
+
+
+def generic_template(location, duration, total_budget):
+    """
+    沒有地點模板時的行程架構：通用單日行程依序輪替，加上住宿、交通與行前提醒
+
+    Returns:
+        dict: 一般（可修改的）行程 dict
+    """
+    return {
+        "trip_name": f"{location}{duration}日遊",
+        "location": location,
+        "duration": duration,
+        "total_budget": total_budget,
+        "budget_breakdown": {
+            "accommodation": int(total_budget * 0.3),
+            "food": int(total_budget * 0.3),
+            "transport": int(total_budget * 0.2),
+            "activities": int(total_budget * 0.2)
+        },
+        "daily_itinerary": [dict(generic_day(location, day - 1), day=day) for day in range(1, duration + 1)],
+        "accommodation_suggestions": [
+            {
+                "name": f"{location}市中心旅館",
+                "type": "商務旅館",
+                "area": "市中心",
+                "price_range": f"NT$ {int(total_budget * 0.15):,}-{int(total_budget * 0.2):,}/晚",
+                "reason": "交通便利，近主要景點"
+            }
+        ],
+        "transport_tips": "建議使用大眾運輸工具，可購買一日券較划算",
+        "packing_list": ["防曬用品", "雨具", "舒適步鞋", "相機", "充電器"],
+        "important_notes": ["注意天氣變化", "提前訂房享優惠", "夜市記得空腹去", "保持彈性調整行程"]
+    }
+
+
+def freeze(value):
+    """遞迴轉成唯讀結構（已是唯讀的部分直接共用）"""
+    if isinstance(value, (FrozenDict, FrozenList)):
+        return value
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return FrozenList(freeze(item) for item in value)
+    return value
+
+
+def _activity_texts(day):
+    return tuple(
+        f"{activity.get('type', '')} {activity.get('name', '')} {activity.get('note', '')}"
+        for activity in day.get("activities", [])
+    )
+
+
+def _preference_score(entry, preferences):
+    """偏好分數：主題相符算 2 分，每個相符的活動算 1 分"""
+    return sum(
+        2 * (preference in entry["theme"]) + sum(preference in text for text in entry["texts"])
+        for preference in preferences
+    )
+
+
+def budget_breakdown(total_budget, days):
+    """
+    依活動實際花費分配預算：餐飲與活動取各天花費總和，其餘 6:4 分給住宿與交通
+
+    花費超過總預算的七成時改用固定比例（30/30/20/20）
+    """
+    food = sum(a.get("cost", 0) or 0 for day in days for a in day.get("activities", []) if a.get("type") == "美食")
+    activities = sum(a.get("cost", 0) or 0 for day in days for a in day.get("activities", []) if a.get("type") != "美食")
+
+    if food + activities > total_budget * 0.7:
+        return {
+            "accommodation": int(total_budget * 0.3),
+            "food": int(total_budget * 0.3),
+            "transport": int(total_budget * 0.2),
+            "activities": int(total_budget * 0.2)
+        }
+
+    remainder = total_budget - food - activities
+    return {
+        "accommodation": int(remainder * 0.6),
+        "food": int(food),
+        "transport": remainder - int(remainder * 0.6),
+        "activities": int(activities)
+    }
+
+
+class TemplateIndex:
+    """（地點, 天數）→ 唯讀行程模板，以及依地點、主題、活動類型索引的單日模板池"""
+
+    MAX_ADJUSTED = 512
+
+    def __init__(self, path="data/trip_templates.json"):
+        self.path = path
+
+        self._templates = {}   # 地點 → {天數: 模板}（檔案原始內容）
+        self._pools = {}       # 地點 → 不重複的單日模板（依模板檔順序）
+        self._adjusted = {}    # (地點, 天數, 偏好) → (模板, 是否由單日模板池組合)
+        self._mtime = None
+        self._lock = threading.Lock()
+
+        self.loads = 0
+
+    def lookup(self, location, duration, budget=None, preferences=None):
+        """
+        取得模板（沒有該天數時從單日模板池組合，天數不重複）
+
+        Args:
+            preferences: 偏好列表（組合時優先挑選主題或活動相符的天）
+
+        Returns:
+            dict: 頂層為新的 dict，內部結構與索引共用且唯讀（沒有該地點的模板時以通用單日行程組合）
+
+        Raises:
+            OSError, ValueError: 模板檔存在但無法讀取或解析
+        """
+        self._refresh()
+
+        preferences = tuple(sorted(str(p) for p in preferences or []))
+        entry = self._adjusted.get((location, duration, preferences))
+        if entry is None:
+            entry = self._build(location, duration, preferences)
+
+        template, assembled = entry
+        result = dict(template)
+        if budget:
+            result["total_budget"] = budget
+            if assembled:
+                result["budget_breakdown"] = budget_breakdown(budget, template["daily_itinerary"])
+            else:
+                result["budget_breakdown"] = {
+                    "accommodation": int(budget * 0.3),
+                    "food": int(budget * 0.3),
+                    "transport": int(budget * 0.2),
+                    "activities": int(budget * 0.2)
+                }
+        return result
+
+    def pool(self, location, theme=None, activity_type=None):
+        """
+        查詢單日模板池
+
+        Args:
+            theme: 主題需包含的文字
+            activity_type: 當天需包含的活動類型（例如 美食、購物）
+
+        Returns:
+            list: 符合條件的單日行程（唯讀）
+        """
+        self._refresh()
+        return [
+            entry["day"] for entry in self._pools.get(location, [])
+            if (theme is None or theme in entry["theme"])
+            and (activity_type is None or activity_type in entry["types"])
+        ]
+
+    def _refresh(self):
+        """檔案修改時間改變時重新載入（檔案不存在時清空索引）"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+
+        if mtime == self._mtime:
+            return
+
+        with self._lock:
+            if mtime == self._mtime:
+                return
+
+            templates = {}
+            if mtime is not None:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    templates = freeze(json.load(f))
+
+            self._templates = templates
+            self._pools = {location: self._build_pool(durations) for location, durations in templates.items()}
+            self._adjusted = {}
+            self._mtime = mtime
+            self.loads += 1
+
+    @staticmethod
+    def _build_pool(durations):
+        """拆解某地點的所有模板成單日模板池（主題與活動完全相同的天只保留一次）"""
+        pool = []
+        seen = set()
+        for template in durations.values():
+            for day in template.get("daily_itinerary", []):
+                signature = (day.get("theme"), tuple(a.get("name") for a in day.get("activities", [])))
+                if signature in seen:
+                    continue
+                seen.add(signature)
+                pool.append({
+                    "day": day,
+                    "theme": day.get("theme", ""),
+                    "types": frozenset(a.get("type") for a in day.get("activities", [])),
+                    "texts": _activity_texts(day)
+                })
+        return pool
+
+    def _build(self, location, duration, preferences=()):
+        """
+        建立並索引模板：有精確天數的模板直接共用，否則從單日模板池組合
+
+        組合時以天數最接近的模板為底（保留原本的天數順序），再依偏好補上其他模板的天，
+        地點的天用完後補上通用單日行程；各天共用原本的活動資料，只有天數欄位不同。
+        沒有該地點的模板時，以通用行程架構為底，從通用單日行程依偏好挑選
+
+        Returns:
+            tuple: (模板, 是否由單日模板池組合)
+        """
+        durations = self._templates.get(location)
+        template = durations.get(f"{duration}天") if durations else None
+        assembled = template is None
+        if assembled:
+            if durations:
+                base = min(durations.values(), key=lambda t: abs(len(t.get("daily_itinerary", [])) - duration))
+                pool = self._pools.get(location, [])
+                extra = 0
+            else:
+                base = generic_template(location, duration, duration * 5000)
+                base["daily_itinerary"] = []
+                pool = self._build_pool({"generic": {"daily_itinerary": [
+                    freeze(generic_day(location, index)) for index in range(len(GENERIC_DAYS))
+                ]}})
+                extra = len(GENERIC_DAYS)
+            base_days = base.get("daily_itinerary", [])
+
+            # 以底模板的天在前，其餘依偏好分數排序；天數較少時只取分數最高的幾天
+            order = {id(day): index for index, day in enumerate(base_days)}
+            ranked = sorted(
+                range(len(pool)),
+                key=lambda i: (
+                    -_preference_score(pool[i], preferences),
+                    order.get(id(pool[i]["day"]), len(base_days) + i)
+                )
+            )
+            chosen = sorted(ranked[:duration], key=lambda i: order.get(id(pool[i]["day"]), len(base_days) + i))
+            days = [pool[i]["day"] for i in chosen]
+
+            # 地點的天用完時補上通用單日行程（池中已有通用行程時從下一輪開始）
+            while len(days) < duration:
+                days.append(freeze(generic_day(location, extra)))
+                extra += 1
+
+            days = [FrozenDict(dict(day, day=number)) for number, day in enumerate(days, start=1)]
+
+            base_duration = base.get("duration") or len(base_days) or 1
+            total_budget = int(base.get("total_budget", base_duration * 5000) * duration / base_duration)
+
+            template = freeze(dict(
+                base,
+                trip_name=f"{location}{duration}日遊",
+                duration=duration,
+                total_budget=total_budget,
+                budget_breakdown=budget_breakdown(total_budget, days),
+                daily_itinerary=days
+            ))
+
+        with self._lock:
+            # 偏好組合沒有上限，超過時整個重建
+            if len(self._adjusted) >= self.MAX_ADJUSTED:
+                self._adjusted = {}
+            self._adjusted[(location, duration, preferences)] = (template, assembled)
+        return template, assembled
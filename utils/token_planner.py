@@ -0,0 +1,118 @@
+"""
+輸出 token 上限規劃
+記錄每次行程生成實際輸出的 token 數、天數、偏好數與是否被截斷，
+以近期每日 token 數的高百分位加上緩衝決定 max_output_tokens；
+截斷率升高時自動放寬。上限太小會截斷（修復失敗、改用模板），
+太大則浪費 vLLM 的批次容量
+"""
+
+import math
+import threading
+from collections import deque
+
+
+class TokenBudgetPlanner:
+    """依觀察到的生成統計規劃輸出 token 上限（每個後端各自統計）"""
+
+    def __init__(self, window=200, percentile=0.95, headroom=0.15, min_samples=10,
+                 target_truncation_rate=0.05, truncation_window=50, widen_gain=4.0, max_widen=2.0,
+                 min_tokens=512, max_tokens=8192):
+        """
+        Args:
+            window: 每個後端保留的最近樣本數
+            percentile: 每日 token 數取的百分位
+            headroom: 在百分位之上額外保留的比例
+            min_samples: 樣本數不足時使用呼叫端提供的預設值
+            target_truncation_rate: 可接受的截斷率
+            truncation_window: 計算截斷率的最近樣本數
+            widen_gain: 截斷率每超過目標 1 個百分點，上限放寬 widen_gain 個百分點
+            max_widen: 放寬倍數上限
+            min_tokens, max_tokens: 規劃結果的範圍
+        """
+        self.window = window
+        self.percentile = percentile
+        self.headroom = headroom
+        self.min_samples = min_samples
+        self.target_truncation_rate = target_truncation_rate
+        self.truncation_window = truncation_window
+        self.widen_gain = widen_gain
+        self.max_widen = max_widen
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+
+        self._samples = {}  # 後端 → deque[(天數, 偏好數, 輸出 token 數, 是否截斷)]
+        self._lock = threading.Lock()
+
+    def record(self, backend, duration, preference_count, output_tokens, truncated):
+        """記錄一次生成結果（被截斷的樣本只是下限，由截斷率放寬補償）"""
+        if not duration or output_tokens is None:
+            return
+
+        with self._lock:
+            samples = self._samples.setdefault(backend, deque(maxlen=self.window))
+            samples.append((duration, preference_count, output_tokens, bool(truncated)))
+
+    def plan(self, backend, duration, preference_count=0, default=None):
+        """
+        規劃輸出 token 上限
+
+        優先使用天數與偏好數相近的樣本，不足時使用該後端全部樣本
+
+        Args:
+            default: 樣本不足時回傳的值（None 表示使用 max_tokens）
+
+        Returns:
+            int: max_output_tokens
+        """
+        with self._lock:
+            samples = list(self._samples.get(backend, ()))
+
+        if len(samples) < self.min_samples:
+            return default if default is not None else self.max_tokens
+
+        similar = [
+            sample for sample in samples
+            if abs(sample[0] - duration) <= 1 and abs(sample[1] - preference_count) <= 1
+        ]
+        if len(similar) < self.min_samples:
+            similar = samples
+
+        per_day = sorted(tokens / days for days, _, tokens, _ in similar)
+        index = min(len(per_day) - 1, math.ceil(self.percentile * len(per_day)) - 1)
+        planned = per_day[max(0, index)] * duration * (1 + self.headroom) * self._widen(samples)
+
+        return int(min(self.max_tokens, max(self.min_tokens, math.ceil(planned))))
+
+    def _widen(self, samples):
+        """截斷率超過目標時的放寬倍數"""
+        recent = samples[-self.truncation_window:]
+        rate = sum(truncated for *_, truncated in recent) / len(recent)
+        excess = max(0.0, rate - self.target_truncation_rate)
+        return min(self.max_widen, 1 + excess * self.widen_gain)
+
+    def stats(self, backend):
+        """取得某後端的統計"""
+        with self._lock:
+            samples = list(self._samples.get(backend, ()))
+
+        if not samples:
+            return {"samples": 0, "truncation_rate": 0.0, "widen": 1.0}
+
+        recent = samples[-self.truncation_window:]
+        return {
+            "samples": len(samples),
+            "truncation_rate": sum(truncated for *_, truncated in recent) / len(recent),
+            "widen": self._widen(samples)
+        }
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+
+
+def is_truncated(finish_reason):
+    """finish_reason 是否表示因長度上限截斷（Gemini 的 MAX_TOKENS 列舉或 OpenAI 的 length）"""
+    if finish_reason is None:
+        return False
+    name = getattr(finish_reason, "name", finish_reason)
+    return name in ("MAX_TOKENS", "length") or finish_reason == 2